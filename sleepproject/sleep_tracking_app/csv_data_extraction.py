@@ -1,35 +1,206 @@
 import json
+import os
+from typing import Callable, Dict, Iterator, Tuple
+
+import numpy as np
 import pandas as pd
 from celery_progress.backend import ProgressRecorder
-from typing import Tuple
 
-def convert_to_readable_time(list_of_unix_timestamps: list, df_column: pd.DataFrame) -> None:
-    """Преобразует UNIX-метку времени в читаемый формат."""
-    for col in list_of_unix_timestamps:
-        if col in df_column.columns:
-            df_column[col] = pd.to_datetime(df_column[col].astype(int), unit='s', utc=True).dt.tz_convert(
-                'UTC').dt.strftime('%Y-%m-%d %H:%M:%S%z')
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Количество строк CSV, которое читается за один раз в потоковом режиме
+CSV_CHUNK_SIZE = int(os.getenv("SLEEP_IMPORT_CHUNK_SIZE", 100_000))
+
+REQUIRED_COLUMNS = ['Key', 'Time', 'Value']
+
+NS_PER_DAY = 24 * 60 * 60 * 10 ** 9
+
+# JSON-парсер для пакетного декодирования: orjson из зависимостей проекта, json — запасной вариант
+json_loads = orjson.loads if orjson is not None else json.loads
+
+# Служебные ключи записи сна, которые не попадают в метаданные
+SLEEP_SERVICE_KEYS = ['items', 'version', 'timezone', 'has_stage']
+SLEEP_ITEM_FIELDS = ['start_time', 'end_time', 'state']
+
+
+def convert_unix_time_columns(df: pd.DataFrame) -> None:
+    """
+    Преобразует колонки с UNIX-меткой времени (в названии есть 'time') в datetime64[ns, UTC].
+    Пропуски становятся NaT.
+    """
+    for col in [c for c in df.columns if 'time' in c]:
+        df[col] = pd.to_datetime(df[col], unit='s', utc=True)
+
+
+def assign_night_records(heart_idx: pd.DatetimeIndex, intervals: pd.DataFrame) -> np.ndarray:
+    """
+    Сопоставляет каждому замеру пульса ночь, в интервал [start, end) которой он попадает.
+    Возвращает массив позиций строк intervals (-1, если замер вне ночей).
+
+    Интервалы сортируются по началу, и для всех замеров за один проход searchsorted
+    находится последняя ночь, начавшаяся не позже замера. Интервал с end <= start
+    считается переходящим через сутки: конец переносится на ближайший момент после начала
+    с тем же временем суток.
+    """
+    if intervals.empty or heart_idx.empty:
+        return np.full(len(heart_idx), -1, dtype=np.int64)
+
+    times = pd.DatetimeIndex(heart_idx).as_unit('ns').asi8
+    starts = pd.DatetimeIndex(intervals['start']).as_unit('ns').asi8
+    ends = pd.DatetimeIndex(intervals['end']).as_unit('ns').asi8
+    ends = np.where(ends > starts, ends, starts + (ends - starts) % NS_PER_DAY)
+
+    order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[order]
+    sorted_ends = ends[order]
+
+    pos = np.searchsorted(sorted_starts, times, side='right') - 1
+    inside = pos >= 0
+    inside[inside] = times[inside] < sorted_ends[pos[inside]]
+
+    return np.where(inside, order[pos], -1)
+
+
+def _set_progress(progress_recorder: ProgressRecorder, current: int, total: int) -> None:
+    if progress_recorder is not None:
+        progress_recorder.set_progress(current, total)
+
+
+def _is_valid_sleep(data) -> bool:
+    """Проверяет, что запись сна имеет version == 2 и содержит стадии сна"""
+    return isinstance(data, dict) and 'items' in data and data.get('version') == 2 and bool(data.get('has_stage'))
+
+
+def decode_json_batch(values: pd.Series) -> list:
+    """Декодирует серию JSON-документов одним вызовом парсера вместо вызова на каждую строку"""
+    return json_loads('[' + ','.join(values) + ']')
+
+
+def decode_sleep_payloads(times: pd.Series, values: pd.Series) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Пакетно декодирует записи сна в метаданные ночей и сегменты сна.
+    Сегменты собираются сразу в колонки start_time/end_time/state, без json_normalize и explode.
+    Из повторов записи с одним временем остаётся последняя вместе со своими сегментами.
+    Возвращает (meta, items), проиндексированные временем записи (UTC).
+    """
+    docs = decode_json_batch(values)
+    # Оставляем только version==2 и непустые items (has_stage как флаг, что есть стадии сна)
+    keep = np.fromiter((_is_valid_sleep(d) for d in docs), dtype=bool, count=len(docs))
+    docs = [d for d, valid in zip(docs, keep) if valid]
+
+    record_time = pd.DatetimeIndex(pd.to_datetime(times.to_numpy(dtype=np.int64)[keep], unit='s', utc=True),
+                                   name='Time')
+
+    # Одна запись сна на время фиксации: при повторах остаются последняя строка и только её сегменты
+    last = ~record_time.duplicated(keep='last')
+    docs = [d for d, kept in zip(docs, last) if kept]
+    record_time = record_time[last]
+
+    # Метаданные
+    df_meta = pd.DataFrame.from_records(docs).drop(columns=SLEEP_SERVICE_KEYS, errors='ignore')
+    df_meta.index = record_time
+
+    # Сегменты сна всех ночей одной таблицей, индекс повторяет время записи нужное число раз
+    counts = np.fromiter((len(d['items']) for d in docs), dtype=np.int64, count=len(docs))
+    df_items = pd.DataFrame.from_records([item for d in docs for item in d['items']], columns=SLEEP_ITEM_FIELDS)
+    df_items.index = record_time.repeat(counts)
+
+    convert_unix_time_columns(df_meta)
+    convert_unix_time_columns(df_items)
+    return df_meta, df_items
+
+
+def decode_heart_rate_payloads(values: pd.Series) -> pd.DataFrame:
+    """
+    Пакетно декодирует замеры пульса {"time": ..., "bpm": ...} в типизированные массивы.
+    Возвращает DataFrame с колонкой bpm, проиндексированный временем замера (UTC).
+    """
+    docs = decode_json_batch(values)
+    if not docs:
+        return _empty_heart_frame()
+
+    time = np.fromiter((d['time'] for d in docs), dtype=np.int64, count=len(docs))
+    bpm = np.fromiter((d['bpm'] for d in docs), dtype=np.int64, count=len(docs))
+    return pd.DataFrame({'bpm': bpm}, index=pd.DatetimeIndex(pd.to_datetime(time, unit='s', utc=True), name='Time'))
+
+
+# Декодеры полезной нагрузки по ключу строки выгрузки; можно заменить на свои с той же сигнатурой
+PAYLOAD_DECODERS: Dict[str, Callable] = {
+    'sleep': decode_sleep_payloads,
+    'heart_rate': decode_heart_rate_payloads,
+}
+
+
+def _parse_sleep_rows(df_sleep: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Разбирает строки с ключом 'sleep' в метаданные ночей и сегменты сна.
+    Возвращает (meta, items), проиндексированные временем записи (UTC).
+    """
+    return PAYLOAD_DECODERS['sleep'](df_sleep['Time'], df_sleep['Value'])
+
+
+def _empty_heart_frame() -> pd.DataFrame:
+    return pd.DataFrame({'bpm': pd.Series(dtype='int64')}, index=pd.DatetimeIndex([], tz='UTC', name='Time'))
+
+
+def _empty_night_frame() -> pd.DataFrame:
+    df_night = _empty_heart_frame()
+    df_night['sleep_time'] = pd.DatetimeIndex([], tz='UTC')
+    return df_night
 
 
-def mask_night(heart_idx: pd.Index, start: pd.Timestamp, end: pd.Timestamp) -> bool:
+def _parse_heart_rows(df_hr: pd.DataFrame) -> pd.DataFrame:
     """
-    Создает маску для фильтрации сердечного ритма по ночным интервалам
+    Разбирает строки с ключом 'heart_rate' в DataFrame с колонкой bpm,
+    проиндексированный временем замера (UTC).
     """
+    return PAYLOAD_DECODERS['heart_rate'](df_hr['Value'])
 
-    if start < end:
-        return (heart_idx >= start) & (heart_idx < end)
-    else:
-        return (heart_idx >= start) | (heart_idx < end)
+
+def _night_intervals(df_meta: pd.DataFrame) -> pd.DataFrame:
+    """Интервалы ночного сна (start, end) из метаданных"""
+    return pd.DataFrame({
+        'start': df_meta['device_bedtime'],
+        'end': df_meta['device_wake_up_time'],
+    }, index=df_meta.index)
 
 
-def sleep_record_from_csv(sleep_data: pd.DataFrame, progress_recorder: ProgressRecorder = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def _split_night(df_heart: pd.DataFrame, intervals: pd.DataFrame) -> pd.DataFrame:
+    """
+    Оставляет только замеры пульса, попадающие в ночные интервалы,
+    и помечает каждый из них временем записи сна (колонка sleep_time)
+    """
+    owner = assign_night_records(df_heart.index, intervals)
+    in_night = owner >= 0
+
+    df_night = df_heart[in_night].copy()
+    df_night['sleep_time'] = intervals.index[owner[in_night]]
+    return df_night
+
+
+def _format_output(df_meta: pd.DataFrame, df_items: pd.DataFrame, df_night: pd.DataFrame) \
+        -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Итоговые типизированные таблицы: все моменты времени остаются datetime64[ns, UTC],
+    индексы meta и items и колонка sleep_time пульса — время записи сна
+    """
+    if not df_items.empty:
+        df_items = df_items.astype({'state': 'int64'})
+    df_night = df_night.astype({'bpm': 'int64'})
+
+    return df_meta, df_items, df_night
+
+
+def sleep_record_from_csv(sleep_data: pd.DataFrame, progress_recorder: ProgressRecorder = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Извлекает данные из CSV-файла, фильтруя записи сна и ночной сердечный ритм
-    Возвращает кортеж (meta, items, night_hr, df_day) или None, если данные невалидны
+    Возвращает кортеж (meta, items, night_hr) или None, если данные невалидны
     """
     # Проверяем наличие обязательных колонок
-    required_columns = ['Key', 'Time', 'Value']
-    if not all(col in sleep_data.columns for col in required_columns):
+    if not all(col in sleep_data.columns for col in REQUIRED_COLUMNS):
         return None
 
     # Проверяем наличие хотя бы одной записи сна с валидным JSON
@@ -41,102 +212,101 @@ def sleep_record_from_csv(sleep_data: pd.DataFrame, progress_recorder: ProgressR
     has_valid_sleep = False
     for value in sleep_entries['Value'].head(5):  # Проверяем только первые 5 записей
         try:
-            data = json.loads(value)
-            if isinstance(data, dict) and 'items' in data and data.get('version') == 2 and data.get('has_stage'):
+            if _is_valid_sleep(json.loads(value)):
                 has_valid_sleep = True
                 break
-        except (json.JSONDecodeError, AttributeError):
+        except (json.JSONDecodeError, TypeError):
             continue
 
     if not has_valid_sleep:
         return None
 
-    total_steps = 9
+    total_steps = 5
 
     # Разделяем на sleep и heart_rate
-    df_sleep = sleep_data[sleep_data['Key'] == 'sleep'].copy()
-    df_hr = sleep_data[sleep_data['Key'] == 'heart_rate'].copy()
-    progress_recorder.set_progress(1, total_steps)
-
-    # Преобразуем JSON в столбцы
-    df_sleep['json'] = df_sleep['Value'].apply(json.loads)
-    # Оставляем только version==2 и непустые items (has_stage как флаг, что есть стадии сна)
-    valid_sleep = df_sleep['json'].apply(lambda d: d.get('version') == 2 and d.get('has_stage'))
-    df_sleep = df_sleep[valid_sleep]
-    progress_recorder.set_progress(2, total_steps)
+    df_sleep = sleep_data[sleep_data['Key'] == 'sleep']
+    df_hr = sleep_data[sleep_data['Key'] == 'heart_rate']
+    _set_progress(progress_recorder, 1, total_steps)
 
-    # Конвертируем Time в datetime
-    df_sleep['Time_dt'] = (
-        pd.to_datetime(df_sleep['Time'].astype(int), unit='s', utc=True)
-        .dt.tz_convert('UTC')
-    )
-    progress_recorder.set_progress(3, total_steps)
-
-    # Метаданные
-    df_meta = pd.json_normalize(df_sleep['json'])
-    df_meta = df_meta.drop(columns=['items', 'version', 'timezone', 'has_stage'])
-    df_meta.index = df_sleep['Time_dt']
-    df_meta.index.name = 'Time'
-    progress_recorder.set_progress(4, total_steps)
-
-    # Разворачиваем список items
-    df_sleep['items_list'] = df_sleep['json'].apply(lambda d: d['items'])
-    df_items_exp = df_sleep.explode('items_list')
-    # Нормализуем вложенные словари
-    df_items = pd.json_normalize(df_items_exp['items_list'])
-    # Индексируем по тому же времени
-    df_items.index = df_items_exp['Time_dt']
-    df_items.index.name = 'Time'
-    progress_recorder.set_progress(5, total_steps)
+    df_meta, df_items = _parse_sleep_rows(df_sleep)
+    _set_progress(progress_recorder, 2, total_steps)
 
     # Пульс
-    df_hr['json'] = df_hr['Value'].apply(json.loads)
-    df_heart = pd.json_normalize(df_hr['json'])
-    df_heart.index = pd.to_datetime(df_heart['time'], unit='s', utc=True).dt.tz_convert('UTC')
-    df_heart.index.name = 'Time'
-    df_heart = df_heart.drop(columns=['time'])
-    progress_recorder.set_progress(6, total_steps)
+    df_heart = _parse_heart_rows(df_hr)
+    _set_progress(progress_recorder, 3, total_steps)
 
     # Разделение на ночь
-    # Интервалы из метаданных
-    intervals = pd.DataFrame({
-        'start': pd.to_datetime(df_meta['device_bedtime'], unit='s', utc=True).dt.tz_convert('UTC'),
-        'end': pd.to_datetime(df_meta['device_wake_up_time'], unit='s', utc=True).dt.tz_convert('UTC')
-    }, index=df_meta.index)
-    progress_recorder.set_progress(7, total_steps)
+    df_night = _split_night(df_heart, _night_intervals(df_meta))
+    _set_progress(progress_recorder, 4, total_steps)
 
-    night_parts = []
-    for idx, row in intervals.iterrows():
-        mask = mask_night(df_heart.index, row['start'], row['end'])
-        night_parts.append(df_heart[mask])
+    result = _format_output(df_meta, df_items, df_night)
+    _set_progress(progress_recorder, 5, total_steps)
 
-    df_night = pd.concat(night_parts)
-    progress_recorder.set_progress(8, total_steps)
-    # df_day = df_heart.drop(df_night.index)
+    return result
 
-    # Преобразование времени к строкам с сохранением информации о временной зоне
-    df_meta.index = df_meta.index.strftime('%Y-%m-%d %H:%M:%S%z')
-    df_items.index = df_items.index.strftime('%Y-%m-%d %H:%M:%S%z')
-    df_night.index = df_night.index.strftime('%Y-%m-%d %H:%M:%S%z')
-    # df_day.index = df_day.index.strftime('%Y-%m-%d %H:%M:%S%z')
 
-    list_item_time = [c for c in df_items.columns if 'time' in c]
-    list_meta_time = [c for c in df_meta.columns if 'time' in c]
+def _iter_csv_chunks(csv_path: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Читает CSV кусками фиксированного размера, оставляя только нужные колонки
+    и строки с ключами 'sleep' и 'heart_rate'.
+    """
+    reader = pd.read_csv(csv_path, encoding='utf-8', usecols=REQUIRED_COLUMNS,
+                         dtype={'Key': 'string', 'Value': 'string'}, chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            yield chunk[chunk['Key'].isin(('sleep', 'heart_rate'))]
 
-    convert_to_readable_time(list_item_time, df_items)
-    convert_to_readable_time(list_meta_time, df_meta)
-    progress_recorder.set_progress(9, total_steps)
 
-    return df_meta, df_items, df_night
+def sleep_record_from_csv_chunks(csv_path: str, progress_recorder: ProgressRecorder = None,
+                                 chunksize: int = CSV_CHUNK_SIZE) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Потоковый вариант sleep_record_from_csv для больших выгрузок.
 
+    Файл читается кусками по chunksize строк в два прохода: первый собирает записи сна
+    и ночные интервалы, второй оставляет из пульса только ночные замеры. Исходные строки
+    CSV после обработки куска не удерживаются, поэтому пиковая память определяется
+    размером куска и объёмом результата, а не размером файла.
+    Возвращает (meta, items, night_hr) в том же формате, что sleep_record_from_csv, или None.
+    """
+    header = pd.read_csv(csv_path, encoding='utf-8', nrows=0)
+    if not all(col in header.columns for col in REQUIRED_COLUMNS):
+        return None
 
-def main():
-    csv_file_path = "F:/Pasha/Courses/Web-sleep-app/dataset/hlth_center_fitness_data.csv"
-    df = pd.read_csv(csv_file_path, delimiter=',', encoding='utf-8')
+    total_steps = 3
+
+    # Проход 1: записи сна. Их по одной на ночь, поэтому строки копятся и разбираются вместе:
+    # повтор ночи из другого куска заменяет предыдущий вместе с сегментами
+    sleep_parts = [chunk[chunk['Key'] == 'sleep'] for chunk in _iter_csv_chunks(csv_path, chunksize)]
+    if not sleep_parts:
+        return None
+    df_meta, df_items = _parse_sleep_rows(pd.concat(sleep_parts))
+    if df_meta.empty:
+        return None
+
+    intervals = _night_intervals(df_meta)
+    _set_progress(progress_recorder, 1, total_steps)
+
+    # Проход 2: ночной пульс
+    night_parts = []
+    for chunk in _iter_csv_chunks(csv_path, chunksize):
+        df_hr = chunk[chunk['Key'] == 'heart_rate']
+        if df_hr.empty:
+            continue
+        night_parts.append(_split_night(_parse_heart_rows(df_hr), intervals))
 
+    df_night = pd.concat(night_parts) if night_parts else _empty_night_frame()
+    _set_progress(progress_recorder, 2, total_steps)
 
-    meta, items, night_hr = sleep_record_from_csv(df)
+    result = _format_output(df_meta, df_items, df_night)
+    _set_progress(progress_recorder, 3, total_steps)
+
+    return result
+
+
+def main():
+    csv_file_path = "F:/Pasha/Courses/Web-sleep-app/dataset/hlth_center_fitness_data.csv"
 
+    meta, items, night_hr = sleep_record_from_csv_chunks(csv_file_path)
 
 
 if __name__ == "__main__": main()
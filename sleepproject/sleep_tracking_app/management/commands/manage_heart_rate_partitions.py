@@ -0,0 +1,47 @@
+# sleep_tracking_app/management/commands/manage_heart_rate_partitions.py
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from sleep_tracking_app.partitioning import partitioning_supported, ensure_month_partitions, \
+    detach_month_partitions, add_months
+
+
+class Command(BaseCommand):
+    help = ("Создаёт помесячные секции таблиц ночного пульса заранее и отсоединяет старые "
+            "(только PostgreSQL). Запускается по расписанию, например раз в месяц")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=2,
+                            help="на сколько месяцев вперёд, включая текущий, создать секции")
+        parser.add_argument('--since', help="создать секции начиная с месяца YYYY-MM (например, для истории)")
+        parser.add_argument('--detach-before', help="отсоединить секции за месяцы раньше YYYY-MM")
+        parser.add_argument('--drop', action='store_true',
+                            help="удалить отсоединённые секции, а не оставлять отдельными таблицами")
+
+    def _month(self, value: str) -> date:
+        try:
+            return date.fromisoformat(f'{value}-01')
+        except ValueError:
+            raise CommandError(f"Ожидается месяц в формате YYYY-MM: {value}")
+
+    def handle(self, *args, **options):
+        if not partitioning_supported():
+            self.stdout.write(self.style.WARNING("Секционирование поддерживается только на PostgreSQL"))
+            return
+
+        current = timezone.now().date().replace(day=1)
+        first = self._month(options['since']) if options['since'] else current
+        months = (current.year - first.year) * 12 + current.month - first.month + options['ahead']
+        created = ensure_month_partitions(first, max(months, 0))
+        self.stdout.write(f"Создано секций: {created} (до {add_months(first, max(months, 0)):%Y-%m})")
+
+        if options['detach_before']:
+            detached = detach_month_partitions(self._month(options['detach_before']), drop=options['drop'])
+            action = "Удалено" if options['drop'] else "Отсоединено"
+            self.stdout.write(f"{action} секций: {len(detached)}")
+            for name in detached:
+                self.stdout.write(f"  {name}")
+
+        self.stdout.write(self.style.SUCCESS("Готово"))
@@ -0,0 +1,16 @@
+# sleep_tracking_app/management/commands/pack_night_heart_rate.py
+from django.core.management.base import BaseCommand
+
+from sleep_tracking_app.sleep_import.hr_series import pack_legacy_heart_rate, PACK_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Упаковывает строки ночного пульса (NightHeartRateEntry) в NightHeartRateSeries по строке на ночь"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PACK_BATCH_SIZE,
+                            help="сколько записей сна упаковывать за одну транзакцию")
+
+    def handle(self, *args, **options):
+        packed = pack_legacy_heart_rate(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Готово. Упаковано ночей: {packed}"))
@@ -0,0 +1,12 @@
+# sleep_tracking_app/management/commands/rebuild_cohort_sketches.py
+from django.core.management.base import BaseCommand
+
+from sleep_tracking_app.sleep_statistic import rebuild_cohort_sketches
+
+
+class Command(BaseCommand):
+    help = "Строит скетчи когорт заново по всей SleepStatistics (первичное заполнение)"
+
+    def handle(self, *args, **options):
+        rows = rebuild_cohort_sketches()
+        self.stdout.write(self.style.SUCCESS(f"Готово. Скетчей когорт: {rows}"))
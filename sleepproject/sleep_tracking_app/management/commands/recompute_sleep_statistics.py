@@ -0,0 +1,73 @@
+# sleep_tracking_app/management/commands/recompute_sleep_statistics.py
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from sleep_tracking_app.sleep_import.recompute import recompute_user_statistics, RECOMPUTE_BATCH_SIZE
+
+
+def _init_worker():
+    # В дочернем процессе нельзя использовать соединения с БД, унаследованные от родителя
+    django.setup()
+    connections.close_all()
+
+
+def _recompute(user_id: int, batch_size: int):
+    return user_id, recompute_user_statistics(user_id, batch_size)
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает SleepStatistics по текущим формулам для всех или выбранных пользователей"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', nargs='+', type=int, help="id пользователей (по умолчанию — все)")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="количество процессов; 1 — пересчёт в текущем процессе")
+        parser.add_argument('--batch-size', type=int, default=RECOMPUTE_BATCH_SIZE,
+                            help="сколько записей сна читать и записывать за раз")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['users']:
+            users = users.filter(pk__in=options['users'])
+        user_ids = list(users.values_list('pk', flat=True))
+        if not user_ids:
+            self.stdout.write(self.style.WARNING("Пользователи не найдены"))
+            return
+
+        batch_size = options['batch_size']
+        workers = options['workers']
+        total = len(user_ids)
+        self.stdout.write(self.style.NOTICE(f"Пересчёт статистики для {total} пользователей, процессов: {workers}"))
+
+        started = time.monotonic()
+        nights = 0
+
+        def report(done: int, user_id: int, count: int):
+            elapsed = time.monotonic() - started
+            rate = nights / elapsed if elapsed else 0
+            self.stdout.write(f"[{done}/{total}] пользователь {user_id}: {count} ночей, {rate:.0f} ночей/с")
+
+        if workers <= 1:
+            for done, user_id in enumerate(user_ids, start=1):
+                count = recompute_user_statistics(user_id, batch_size)
+                nights += count
+                report(done, user_id, count)
+        else:
+            # Соединения закрываются до fork, чтобы процессы не делили один сокет
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                futures = [pool.submit(_recompute, user_id, batch_size) for user_id in user_ids]
+                for done, future in enumerate(as_completed(futures), start=1):
+                    user_id, count = future.result()
+                    nights += count
+                    report(done, user_id, count)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово. Пересчитано {nights} ночей за {elapsed:.1f} с ({nights / elapsed if elapsed else 0:.0f} ночей/с)"
+        ))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0007_alter_userdata_height'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sleeprecord',
+            name='content_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sleepstatistics',
+            name='record',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='sleep_tracking_app.sleeprecord'),
+        ),
+    ]
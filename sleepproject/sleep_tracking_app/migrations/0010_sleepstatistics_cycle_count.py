@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0009_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sleepstatistics',
+            name='cycle_count',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
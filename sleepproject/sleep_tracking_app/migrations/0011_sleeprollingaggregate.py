@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0010_sleepstatistics_cycle_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SleepRollingAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('nights', models.PositiveIntegerField(default=0)),
+                ('duration_nights', models.PositiveIntegerField(default=0)),
+                ('duration_sum', models.FloatField(default=0)),
+                ('duration_sq_sum', models.FloatField(default=0)),
+                ('bedtime_nights', models.PositiveIntegerField(default=0)),
+                ('bedtime_sum', models.FloatField(default=0)),
+                ('bedtime_sq_sum', models.FloatField(default=0)),
+                ('wake_nights', models.PositiveIntegerField(default=0)),
+                ('wake_sum', models.FloatField(default=0)),
+                ('wake_sq_sum', models.FloatField(default=0)),
+                ('free_nights', models.PositiveIntegerField(default=0)),
+                ('free_midpoint_sum', models.FloatField(default=0)),
+                ('free_duration_sum', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sleep_rolling_aggregates', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'date')},
+            },
+        ),
+    ]
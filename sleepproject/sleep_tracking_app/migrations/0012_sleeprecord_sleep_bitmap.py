@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0011_sleeprollingaggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sleeprecord',
+            name='sleep_bitmap',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0012_sleeprecord_sleep_bitmap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sleepstatistics',
+            name='stage_heart_rate',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
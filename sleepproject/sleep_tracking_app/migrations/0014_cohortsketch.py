@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0013_sleepstatistics_stage_heart_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('age_band', models.CharField(max_length=8)),
+                ('gender', models.PositiveSmallIntegerField()),
+                ('metric', models.CharField(max_length=32)),
+                ('count', models.BigIntegerField(default=0)),
+                ('zero_count', models.BigIntegerField(default=0)),
+                ('buckets', models.JSONField(default=dict)),
+            ],
+            options={
+                'unique_together': {('age_band', 'gender', 'metric')},
+            },
+        ),
+    ]
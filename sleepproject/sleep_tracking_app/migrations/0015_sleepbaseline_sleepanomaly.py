@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0014_cohortsketch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SleepBaseline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_night', models.DateTimeField(blank=True, null=True)),
+                ('state', models.JSONField(default=dict)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sleep_baseline', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SleepAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('sleep_efficiency', 'Эффективность сна'), ('latency_minutes', 'Время засыпания'), ('awake_count', 'Количество пробуждений'), ('avg_hr', 'Средний пульс')], max_length=32)),
+                ('value', models.FloatField()),
+                ('baseline', models.FloatField()),
+                ('score', models.FloatField()),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='sleep_tracking_app.sleeprecord')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sleep_anomalies', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('record', 'metric')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0015_sleepbaseline_sleepanomaly'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NightHeartRateSeries',
+            fields=[
+                ('record', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='hr_series', serialize=False, to='sleep_tracking_app.sleeprecord')),
+                ('start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('offsets', models.BinaryField()),
+                ('bpm', models.BinaryField()),
+            ],
+        ),
+    ]
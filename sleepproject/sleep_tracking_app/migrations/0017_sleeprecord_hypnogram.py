@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0016_nightheartrateseries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sleeprecord',
+            name='hypnogram_durations',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sleeprecord',
+            name='hypnogram_start',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sleeprecord',
+            name='hypnogram_states',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
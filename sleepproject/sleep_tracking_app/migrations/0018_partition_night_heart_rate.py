@@ -0,0 +1,114 @@
+# Помесячное секционирование таблиц ночного пульса (только PostgreSQL).
+# На других СУБД миграция ничего не делает.
+
+from django.db import migrations
+
+# Таблица -> (колонки первичного ключа модели, колонка ключа секционирования).
+# Упакованные ряды (строка на ночь) не секционируются: первичный ключ секционированной таблицы включал бы start,
+# и БД перестала бы гарантировать один ряд на запись сна (см. 0023)
+PARTITIONED_TABLES = {
+    'sleep_tracking_app_nightheartrateentry': (['id'], 'time'),
+}
+
+
+def _rebuild(schema_editor, table: str, pk: list, key: str, partitioned: bool) -> None:
+    """
+    Пересоздаёт таблицу секционированной по месяцам (или обычной) с переносом данных.
+    Индексы, внешние ключи и последовательность id сохраняются под прежними именами.
+    Первичный ключ секционированной таблицы обязан включать ключ секционирования.
+    """
+    connection = schema_editor.connection
+    qn = schema_editor.quote_name
+    legacy = f'{table}_legacy'
+
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+        cursor.execute(
+            "SELECT a.attidentity, pg_get_serial_sequence(%s, 'id') FROM pg_attribute a "
+            "WHERE a.attrelid = %s::regclass AND a.attname = 'id'",
+            [table, table],
+        )
+        id_column = cursor.fetchone()
+
+    schema_editor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+    partition_clause = f' PARTITION BY RANGE ({qn(key)})' if partitioned else ''
+    schema_editor.execute(
+        f'CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING IDENTITY '
+        f'INCLUDING CONSTRAINTS){partition_clause}'
+    )
+
+    if partitioned:
+        schema_editor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT DISTINCT date_trunc('month', {qn(key)} AT TIME ZONE 'UTC')::date FROM {qn(legacy)}"
+            )
+            months = [row[0] for row in cursor.fetchall()]
+        for month in months:
+            following = month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+            schema_editor.execute(
+                f'CREATE TABLE {qn(f"{table}_p{month:%Y_%m}")} PARTITION OF {qn(table)} '
+                f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{following.isoformat()} 00:00:00+00')"
+            )
+
+    overriding = ' OVERRIDING SYSTEM VALUE' if id_column and id_column[0] else ''
+    schema_editor.execute(f'INSERT INTO {qn(table)}{overriding} SELECT * FROM {qn(legacy)}')
+
+    if id_column is not None:
+        if id_column[0]:
+            # identity-колонка получила новую последовательность — продолжаем нумерацию
+            schema_editor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {qn(table)}), 0) + 1, false)"
+            )
+        else:
+            # serial: последовательность принадлежит старой таблице и удалилась бы вместе с ней
+            schema_editor.execute(f"ALTER SEQUENCE {id_column[1]} OWNED BY {qn(table)}.{qn('id')}")
+
+    schema_editor.execute(f'DROP TABLE {qn(legacy)} CASCADE')
+    if id_column is not None and id_column[0]:
+        # Новая последовательность создана рядом со старой под другим именем — возвращаем прежнее
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+            sequence = cursor.fetchone()[0]
+        if sequence.split('.')[-1].strip('"') != f'{table}_id_seq':
+            schema_editor.execute(f'ALTER SEQUENCE {sequence} RENAME TO {qn(table + "_id_seq")}')
+
+    pk_columns = pk + [key] if partitioned else pk
+    schema_editor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY ({", ".join(qn(c) for c in pk_columns)})')
+    for name, info in constraints.items():
+        if info['foreign_key']:
+            ref_table, ref_column = info['foreign_key']
+            schema_editor.execute(
+                f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} FOREIGN KEY ({qn(info["columns"][0])}) '
+                f'REFERENCES {qn(ref_table)} ({qn(ref_column)}) DEFERRABLE INITIALLY DEFERRED'
+            )
+        elif info['index'] and not info['primary_key'] and not info['unique']:
+            schema_editor.execute(
+                f'CREATE INDEX {qn(name)} ON {qn(table)} ({", ".join(qn(c) for c in info["columns"])})'
+            )
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, (pk, key) in PARTITIONED_TABLES.items():
+        _rebuild(schema_editor, table, pk, key, partitioned=True)
+
+
+def unpartition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, (pk, key) in PARTITIONED_TABLES.items():
+        _rebuild(schema_editor, table, pk, key, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0017_sleeprecord_hypnogram'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0018_partition_night_heart_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NightHeartRateAggregate',
+            fields=[
+                ('record', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='hr_aggregate', serialize=False, to='sleep_tracking_app.sleeprecord')),
+                ('start', models.DateTimeField()),
+                ('resolution', models.PositiveIntegerField()),
+                ('buckets', models.BinaryField()),
+                ('samples', models.BinaryField()),
+                ('bpm_min', models.BinaryField()),
+                ('bpm_mean', models.BinaryField()),
+                ('bpm_max', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:16
+
+from django.db import migrations, models
+
+# Фаза сна (ключ sleep_phases) -> колонка с её процентом
+PHASE_FIELDS = {
+    'deep': 'deep_percent',
+    'light': 'light_percent',
+    'rem': 'rem_percent',
+    'awake': 'awake_percent',
+}
+BACKFILL_BATCH_SIZE = 2000
+
+
+def backfill_phase_percent(apps, schema_editor):
+    """Переносит проценты фаз из JSON sleep_phases в новые колонки кусками по BACKFILL_BATCH_SIZE строк"""
+    SleepStatistics = apps.get_model('sleep_tracking_app', 'SleepStatistics')
+    rows = SleepStatistics.objects.filter(sleep_phases__isnull=False).only('pk', 'sleep_phases') \
+        .order_by('pk').iterator(chunk_size=BACKFILL_BATCH_SIZE)
+
+    batch = []
+    for stat in rows:
+        phases = stat.sleep_phases if isinstance(stat.sleep_phases, dict) else {}
+        for phase, field in PHASE_FIELDS.items():
+            value = phases.get(phase)
+            setattr(stat, field, float(value) if value is not None else None)
+        batch.append(stat)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            SleepStatistics.objects.bulk_update(batch, list(PHASE_FIELDS.values()))
+            batch = []
+    if batch:
+        SleepStatistics.objects.bulk_update(batch, list(PHASE_FIELDS.values()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0019_nightheartrateaggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sleepstatistics',
+            name='awake_percent',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sleepstatistics',
+            name='deep_percent',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sleepstatistics',
+            name='light_percent',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sleepstatistics',
+            name='rem_percent',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_phase_percent, migrations.RunPython.noop),
+    ]
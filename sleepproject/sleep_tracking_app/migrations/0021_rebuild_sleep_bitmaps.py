@@ -0,0 +1,20 @@
+# Карты сна (sleep_bitmap) теперь покрывают двое суток UTC вместо суток от полудня.
+# Старые карты сбрасываются и достраиваются по гипнограммам при первом расчёте SRI (ensure_sleep_bitmaps).
+
+from django.db import migrations
+
+
+def reset_sleep_bitmaps(apps, schema_editor):
+    SleepRecord = apps.get_model('sleep_tracking_app', 'SleepRecord')
+    SleepRecord.objects.filter(sleep_bitmap__isnull=False).update(sleep_bitmap=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0020_sleepstatistics_phase_percent'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_sleep_bitmaps, reset_sleep_bitmaps),
+    ]
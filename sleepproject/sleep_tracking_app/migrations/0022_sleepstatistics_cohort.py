@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0021_rebuild_sleep_bitmaps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sleepstatistics',
+            name='cohort_age_band',
+            field=models.CharField(blank=True, max_length=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='sleepstatistics',
+            name='cohort_gender',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
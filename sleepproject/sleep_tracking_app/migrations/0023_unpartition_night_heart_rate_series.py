@@ -0,0 +1,39 @@
+# Возвращает таблице упакованных рядов пульса обычный вид на базах, где её секционировала
+# прежняя версия миграции 0018 (только PostgreSQL). Первичный ключ снова record_id — один ряд на запись сна.
+
+from importlib import import_module
+
+from django.db import migrations
+
+SERIES_TABLE = 'sleep_tracking_app_nightheartrateseries'
+
+
+def unpartition_series(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [SERIES_TABLE])
+        row = cursor.fetchone()
+    if row is None or row[0] != 'p':
+        return
+
+    qn = schema_editor.quote_name
+    # При ключе (record_id, start) у записи могли появиться лишние ряды — остаётся самый поздний
+    schema_editor.execute(
+        f'DELETE FROM {qn(SERIES_TABLE)} stale USING {qn(SERIES_TABLE)} fresh '
+        f'WHERE stale.record_id = fresh.record_id AND stale.start < fresh.start'
+    )
+    partitioning = import_module('sleep_tracking_app.migrations.0018_partition_night_heart_rate')
+    partitioning._rebuild(schema_editor, SERIES_TABLE, ['record_id'], 'start', partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracking_app', '0022_sleepstatistics_cohort'),
+    ]
+
+    operations = [
+        migrations.RunPython(unpartition_series, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,6 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Optional, Tuple
+
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
@@ -84,6 +87,18 @@ class SleepRecord(models.Model):
                                          validators=[MinValueValidator(0),
                                                      MaxValueValidator(1440)])  # Убрать везде (устарело)
 
+    content_hash = models.BigIntegerField(null=True,
+                                          blank=True)  # отпечаток содержимого ночи (метаданные, сегменты, пульс) для инкрементального импорта
+
+    sleep_bitmap = models.BinaryField(null=True,
+                                      blank=True)  # сон по минутам двух суток UTC, 2880 бит (np.packbits), для SRI
+
+    hypnogram_start = models.DateTimeField(null=True, blank=True)  # начало первого сегмента сна
+    hypnogram_states = models.BinaryField(null=True,
+                                          blank=True)  # гипнограмма RLE: стадии отрезков (uint8, 0 — нет данных)
+    hypnogram_durations = models.BinaryField(null=True,
+                                             blank=True)  # гипнограмма RLE: длительности отрезков в секундах ('<u2')
+
     class Meta:
         unique_together = ('user', 'sleep_date_time')
         indexes = [
@@ -109,6 +124,105 @@ class SleepRecord(models.Model):
 
         return cls.objects.filter(user=user).order_by('-sleep_date_time', 'id')
 
+    # Окно вокруг sleep_date_time (время пробуждения), в котором лежат замеры пульса ночи.
+    # Фильтр по нему даёт PostgreSQL отсечь лишние помесячные секции таблиц пульса
+    HEART_RATE_WINDOW = (timedelta(days=2), timedelta(days=1))
+
+    @classmethod
+    def heart_rate_time_range(cls, sleep_times) -> Tuple[datetime, datetime]:
+        """Диапазон времени замеров пульса для ночей с данными sleep_date_time"""
+        before, after = cls.HEART_RATE_WINDOW
+        return min(sleep_times) - before, max(sleep_times) + after
+
+    # Наибольшая длительность отрезка гипнограммы, которая помещается в uint16; длинные отрезки делятся
+    MAX_HYPNOGRAM_RUN = np.iinfo(np.uint16).max
+
+    @classmethod
+    def pack_hypnogram(cls, starts: np.ndarray, ends: np.ndarray, states: np.ndarray) \
+            -> Tuple[Optional[datetime], Optional[bytes], Optional[bytes]]:
+        """
+        Упаковывает сегменты одной ночи (секунды Unix, отсортированы по началу) в гипнограмму RLE:
+        (начало, стадии, длительности). Соседние сегменты одной стадии сливаются, промежутки без данных
+        записываются стадией 0, перекрытия обрезаются по концу предыдущего сегмента.
+        """
+        run_states, run_durations = [], []
+        first = prev_end = None
+        for start, end, state in zip(starts.tolist(), ends.tolist(), states.tolist()):
+            if prev_end is not None:
+                start = max(start, prev_end)
+            if end <= start:
+                continue
+            if first is None:
+                first = start
+            elif start > prev_end:
+                run_states.append(0)
+                run_durations.append(start - prev_end)
+            if run_states and run_states[-1] == state:
+                run_durations[-1] += end - start
+            else:
+                run_states.append(state)
+                run_durations.append(end - start)
+            prev_end = end
+
+        if first is None:
+            return None, None, None
+
+        states_out, durations_out = [], []
+        for state, duration in zip(run_states, run_durations):
+            while duration > cls.MAX_HYPNOGRAM_RUN:
+                states_out.append(state)
+                durations_out.append(cls.MAX_HYPNOGRAM_RUN)
+                duration -= cls.MAX_HYPNOGRAM_RUN
+            states_out.append(state)
+            durations_out.append(duration)
+
+        return (datetime.fromtimestamp(first, tz=dt_timezone.utc),
+                np.array(states_out, dtype='uint8').tobytes(),
+                np.array(durations_out, dtype='<u2').tobytes())
+
+    @staticmethod
+    def unpack_hypnogram(start: datetime, states: bytes, durations: bytes) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(начала отрезков datetime64[s], концы, стадии uint8) без промежутков без данных"""
+        durations = np.frombuffer(bytes(durations), dtype='<u2').astype('int64')
+        states = np.frombuffer(bytes(states), dtype='uint8')
+        ends = int(start.timestamp()) + np.cumsum(durations)
+        starts = ends - durations
+        known = states != 0
+        return starts[known].astype('datetime64[s]'), ends[known].astype('datetime64[s]'), states[known]
+
+    def hypnogram(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Гипнограмма записи: (начала отрезков datetime64[s] UTC, концы, стадии) в порядке времени.
+        Читается из упакованных полей записи; для записей без них — из сегментов сна.
+        """
+        if self.hypnogram_start is not None:
+            return self.unpack_hypnogram(self.hypnogram_start, self.hypnogram_states, self.hypnogram_durations)
+
+        rows = list(self.segments.order_by('start_time').values_list('start_time', 'end_time', 'state'))
+        starts = np.array([int(start.timestamp()) for start, _, _ in rows], dtype='int64')
+        ends = np.array([int(end.timestamp()) for _, end, _ in rows], dtype='int64')
+        return (starts.astype('datetime64[s]'), ends.astype('datetime64[s]'),
+                np.array([state for _, _, state in rows], dtype='uint8'))
+
+    def night_heart_rate(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Ночной пульс записи: (время замеров datetime64[s] UTC, пульс) в порядке времени.
+        Читается одна строка упакованного ряда; для ночей старше срока хранения замеров — средние
+        по интервалам огрублённого ряда; для записей, импортированных до появления рядов, — строки замеров.
+        """
+        time_range = self.heart_rate_time_range([self.sleep_date_time])
+        series = NightHeartRateSeries.objects.filter(record=self).first()
+        if series is not None:
+            return series.arrays()
+        aggregate = NightHeartRateAggregate.objects.filter(record=self).first()
+        if aggregate is not None:
+            return aggregate.arrays()
+
+        rows = list(self.night_hr_entries.filter(time__range=time_range).order_by('time').values_list('time', 'bpm'))
+        seconds = np.array([int(time.timestamp()) for time, _ in rows], dtype='int64')
+        return seconds.astype('datetime64[s]'), np.array([bpm for _, bpm in rows], dtype='uint16')
+
 
 """class DayHeartRateEntry(models.Model):
     record = models.ForeignKey(SleepRecord, on_delete=models.CASCADE, related_name='day_hr_entries')
@@ -125,6 +239,121 @@ class NightHeartRateEntry(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(300)])
 
 
+class NightHeartRateSeries(models.Model):
+    """
+    Ночной пульс записи сна одной строкой: время первого замера, интервалы между замерами
+    в секундах (uint16) и пульс (uint8), упакованные в байты. Заменяет строки NightHeartRateEntry
+    для новых импортов.
+    """
+    record = models.OneToOneField(SleepRecord, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='hr_series')
+    start = models.DateTimeField()  # время первого замера
+    count = models.PositiveIntegerField()  # количество замеров
+    offsets = models.BinaryField()  # интервалы от предыдущего замера, секунды, '<u2'
+    bpm = models.BinaryField()  # пульс, uint8
+
+    # Наибольший интервал между замерами, который помещается в uint16
+    MAX_OFFSET = np.iinfo(np.uint16).max
+    # Наибольший пульс, который помещается в uint8 (NightHeartRateEntry допускает до 300)
+    MAX_BPM = np.iinfo(np.uint8).max
+
+    @classmethod
+    def pack(cls, record_id: int, seconds: np.ndarray, bpm: np.ndarray) -> 'NightHeartRateSeries':
+        """
+        Упаковывает отсортированные по времени замеры (секунды Unix, пульс) одной ночи.
+        Интервалы больше MAX_OFFSET и пульс больше MAX_BPM не помещаются в ряд: такие ночи
+        хранятся строками NightHeartRateEntry.
+        """
+        offsets = np.diff(seconds, prepend=seconds[0])
+        if len(seconds) and (offsets.max() > cls.MAX_OFFSET or np.max(bpm) > cls.MAX_BPM or np.min(bpm) < 0):
+            raise ValueError('Замеры ночи не помещаются в упакованный ряд')
+        return cls(
+            record_id=record_id,
+            start=datetime.fromtimestamp(int(seconds[0]), tz=dt_timezone.utc),
+            count=len(seconds),
+            offsets=offsets.astype('<u2').tobytes(),
+            bpm=np.asarray(bpm).astype('uint8').tobytes(),
+        )
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(время замеров datetime64[s] UTC, пульс uint8)"""
+        seconds = int(self.start.timestamp()) + np.cumsum(np.frombuffer(bytes(self.offsets), dtype='<u2'),
+                                                          dtype='int64')
+        return seconds.astype('datetime64[s]'), np.frombuffer(bytes(self.bpm), dtype='uint8')
+
+
+class NightHeartRateAggregate(models.Model):
+    """
+    Огрублённый ночной пульс старой записи сна: минимум, среднее и максимум за интервалы
+    по resolution секунд. Заменяет исходные замеры ночи после истечения срока их хранения.
+    Хранятся только интервалы с замерами: номер интервала от start (uint16) и значения (uint8).
+    """
+    record = models.OneToOneField(SleepRecord, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='hr_aggregate')
+    start = models.DateTimeField()  # начало первого интервала, кратное resolution
+    resolution = models.PositiveIntegerField()  # длина интервала, секунды
+    buckets = models.BinaryField()  # номера интервалов от start, '<u2'
+    samples = models.BinaryField()  # количество исходных замеров в интервале, '<u2'
+    bpm_min = models.BinaryField()  # uint8
+    bpm_mean = models.BinaryField()  # uint8
+    bpm_max = models.BinaryField()  # uint8
+
+    @classmethod
+    def aggregate(cls, record_id: int, seconds: np.ndarray, bpm_min: np.ndarray, bpm_mean: np.ndarray,
+                  bpm_max: np.ndarray, samples: np.ndarray, resolution: int) -> 'NightHeartRateAggregate':
+        """
+        Сводит значения одной ночи (секунды Unix; для исходных замеров min = mean = max, samples = 1)
+        в интервалы по resolution секунд. Подходит и для огрубления уже сведённой ночи.
+        """
+        keys = np.asarray(seconds, dtype='int64') // resolution
+        keys, inverse = np.unique(keys, return_inverse=True)
+        weights = np.asarray(samples, dtype='float64')
+
+        counts = np.bincount(inverse, weights=weights)
+        means = np.bincount(inverse, weights=np.asarray(bpm_mean, dtype='float64') * weights) / counts
+        lows = np.full(len(keys), 255, dtype='int64')
+        np.minimum.at(lows, inverse, np.asarray(bpm_min, dtype='int64'))
+        highs = np.zeros(len(keys), dtype='int64')
+        np.maximum.at(highs, inverse, np.asarray(bpm_max, dtype='int64'))
+
+        def as_uint8(values: np.ndarray) -> bytes:
+            return np.clip(np.rint(values), 0, 255).astype('uint8').tobytes()
+
+        return cls(
+            record_id=record_id,
+            start=datetime.fromtimestamp(int(keys[0]) * resolution, tz=dt_timezone.utc),
+            resolution=resolution,
+            buckets=(keys - keys[0]).astype('<u2').tobytes(),
+            samples=np.clip(counts, 0, np.iinfo(np.uint16).max).astype('<u2').tobytes(),
+            bpm_min=as_uint8(lows),
+            bpm_mean=as_uint8(means),
+            bpm_max=as_uint8(highs),
+        )
+
+    def coarsen(self, resolution: int) -> 'NightHeartRateAggregate':
+        """Та же ночь с более крупными интервалами"""
+        seconds = int(self.start.timestamp()) + self.bucket_offsets()
+        return self.aggregate(self.record_id, seconds, *self.values(), resolution)
+
+    def bucket_offsets(self) -> np.ndarray:
+        """Начала интервалов в секундах от start"""
+        return np.frombuffer(bytes(self.buckets), dtype='<u2').astype('int64') * self.resolution
+
+    def values(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(минимум, среднее, максимум, количество замеров) по интервалам"""
+        return (
+            np.frombuffer(bytes(self.bpm_min), dtype='uint8'),
+            np.frombuffer(bytes(self.bpm_mean), dtype='uint8'),
+            np.frombuffer(bytes(self.bpm_max), dtype='uint8'),
+            np.frombuffer(bytes(self.samples), dtype='<u2'),
+        )
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(середины интервалов datetime64[s] UTC, средний пульс uint8) — как у NightHeartRateSeries"""
+        seconds = int(self.start.timestamp()) + self.bucket_offsets() + self.resolution // 2
+        return seconds.astype('datetime64[s]'), np.frombuffer(bytes(self.bpm_mean), dtype='uint8')
+
+
 class SleepSegment(models.Model):
     record = models.ForeignKey(SleepRecord, on_delete=models.CASCADE, related_name='segments')
     start_time = models.DateTimeField()  # время начала сегмента сна
@@ -139,14 +368,27 @@ class SleepSegment(models.Model):
 
 class SleepStatistics(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    record = models.OneToOneField(SleepRecord, on_delete=models.CASCADE, null=True, blank=True,
+                                  related_name='statistics')  # запись сна, по которой посчитана статистика
 
     latency_minutes = models.FloatField(null=True, blank=True)  # Латентность сна в минутах
     sleep_efficiency = models.FloatField(null=True, blank=True)  # Эффективность сна в процентах
     sleep_phases = models.JSONField(null=True,
                                     blank=True)  # Процент каждой фазы сна (глубокий, легкий, REM, бодрствование)
+    # Проценты фаз отдельными колонками: средние и тренды считаются агрегатами БД, без разбора JSON
+    deep_percent = models.FloatField(null=True, blank=True)  # Процент глубокого сна
+    light_percent = models.FloatField(null=True, blank=True)  # Процент легкого сна
+    rem_percent = models.FloatField(null=True, blank=True)  # Процент REM-сна
+    awake_percent = models.FloatField(null=True, blank=True)  # Процент бодрствования
     sleep_fragmentation_index = models.FloatField(null=True, blank=True)  # Индекс фрагментации сна
     sleep_calories_burned = models.FloatField(null=True, blank=True)  # Сожжённые калории во время сна (на основе BMR)
+    cycle_count = models.PositiveSmallIntegerField(null=True, blank=True)  # Количество завершённых циклов сна
+    stage_heart_rate = models.JSONField(null=True,
+                                        blank=True)  # Пульс по стадиям сна: среднее, минимум, максимум, снижение в %
     date = models.DateField(db_index=True)  # Дата, к которой относятся эти данные
+    # Когорта, в скетчи которой учтены метрики этой ночи: из неё они и вычитаются при замене
+    cohort_age_band = models.CharField(null=True, blank=True, max_length=8)  # как CohortSketch.age_band
+    cohort_gender = models.PositiveSmallIntegerField(null=True, blank=True)  # как CohortSketch.gender
 
     recommended = models.TextField(null=True, blank=True)  # Рекомендовано ли пользователю улучшение сна
 
@@ -163,6 +405,22 @@ class SleepStatistics(models.Model):
             models.Index(fields=['user', 'date']),
         ]
 
+    # Фаза сна (ключ sleep_phases) -> колонка с её процентом
+    PHASE_FIELDS = {
+        'deep': 'deep_percent',
+        'light': 'light_percent',
+        'rem': 'rem_percent',
+        'awake': 'awake_percent',
+    }
+
+    def phase_percentages(self) -> dict:
+        """
+        Проценты фаз сна {фаза: процент} из колонок; для строк, где колонки не заполнены, — из sleep_phases
+        """
+        if all(getattr(self, field) is None for field in self.PHASE_FIELDS.values()):
+            return dict(self.sleep_phases or {})
+        return {phase: getattr(self, field) or 0 for phase, field in self.PHASE_FIELDS.items()}
+
     @classmethod
     def get_last_sleep_statistics(cls, user: User) -> "SleepStatistics | None":
         """
@@ -181,3 +439,92 @@ class SleepStatistics(models.Model):
         """
 
         return cls.objects.filter(user=user).order_by('-date', 'id')
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Отметка об успешно записанном шарде импорта.
+    По ней повторный запуск импорта того же файла пропускает уже записанные шарды.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file_hash = models.CharField(max_length=64)  # sha256 загруженного файла
+    shard = models.CharField(max_length=32)  # ключ шарда (период, например 2025-11)
+    imported = models.PositiveIntegerField(default=0)  # сколько ночей записано в шарде
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'file_hash', 'shard')
+
+
+class SleepRollingAggregate(models.Model):
+    """
+    Накопленные (префиксные) суммы по ночам пользователя до даты date включительно.
+    Сумма за любое окно дат — разность двух строк, поэтому метрики за 7/30/90 дней читаются без скана записей.
+    Время отбоя и подъёма — в минутах от 20:00 (time_to_minutes), середина сна — в часах.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sleep_rolling_aggregates')
+    date = models.DateField()
+
+    nights = models.PositiveIntegerField(default=0)  # количество ночей
+    duration_nights = models.PositiveIntegerField(default=0)  # ночей с ненулевой длительностью сна
+    duration_sum = models.FloatField(default=0)  # сумма длительностей сна, минуты
+    duration_sq_sum = models.FloatField(default=0)  # сумма квадратов длительностей
+    bedtime_nights = models.PositiveIntegerField(default=0)
+    bedtime_sum = models.FloatField(default=0)
+    bedtime_sq_sum = models.FloatField(default=0)
+    wake_nights = models.PositiveIntegerField(default=0)
+    wake_sum = models.FloatField(default=0)
+    wake_sq_sum = models.FloatField(default=0)
+    free_nights = models.PositiveIntegerField(default=0)  # ночей с отходом ко сну в выходные
+    free_midpoint_sum = models.FloatField(default=0)  # сумма середин сна в выходные, часы
+    free_duration_sum = models.FloatField(default=0)  # сумма длительностей сна в выходные, минуты
+
+    class Meta:
+        unique_together = ('user', 'date')
+
+
+class CohortSketch(models.Model):
+    """
+    Квантильный скетч (логарифмические корзины в духе DDSketch) значений метрики сна
+    для когорты: возрастная группа и пол. Скетчи сливаются и обновляются при импорте
+    добавлением и вычитанием значений, поэтому перцентиль пользователя читается без скана SleepStatistics.
+    """
+    age_band = models.CharField(max_length=8)  # возрастная группа, например 25-34
+    gender = models.PositiveSmallIntegerField()  # как UserData.gender
+    metric = models.CharField(max_length=32)  # имя метрики (sleep_efficiency, duration, ...)
+
+    count = models.BigIntegerField(default=0)  # всего значений
+    zero_count = models.BigIntegerField(default=0)  # значений <= 0
+    buckets = models.JSONField(default=dict)  # {индекс корзины: количество}
+
+    class Meta:
+        unique_together = ('age_band', 'gender', 'metric')
+
+
+class SleepBaseline(models.Model):
+    """
+    Потоковое состояние базовой линии ночных метрик пользователя: для каждой метрики
+    экспоненциально сглаженные среднее, дисперсия и среднее абсолютное отклонение.
+    Обновляется за O(1) на ночь, last_night — последняя учтённая ночь.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='sleep_baseline')
+    last_night = models.DateTimeField(null=True, blank=True)  # sleep_date_time последней учтённой ночи
+    state = models.JSONField(default=dict)  # {метрика: {'n', 'mean', 'var', 'mad'}}
+
+
+class SleepAnomaly(models.Model):
+    """Ночь, метрика которой резко отклонилась от базовой линии пользователя"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sleep_anomalies')
+    record = models.ForeignKey(SleepRecord, on_delete=models.CASCADE, related_name='anomalies')
+    metric = models.CharField(max_length=32, choices=(
+        ('sleep_efficiency', 'Эффективность сна'),
+        ('latency_minutes', 'Время засыпания'),
+        ('awake_count', 'Количество пробуждений'),
+        ('avg_hr', 'Средний пульс'),
+    ))  # метрика, по которой замечено отклонение
+    value = models.FloatField()  # значение метрики в эту ночь
+    baseline = models.FloatField()  # сглаженное среднее до этой ночи
+    score = models.FloatField()  # робастный z-score, знак — направление отклонения
+
+    class Meta:
+        unique_together = ('record', 'metric')
@@ -0,0 +1,114 @@
+from datetime import date
+from typing import List, Tuple
+
+from django.db import connection, models, transaction
+
+from .models import NightHeartRateEntry
+
+# Таблицы ночного пульса, секционированные по месяцам (миграция 0018): модель -> поле ключа секционирования.
+# NightHeartRateSeries не секционируется: строка на ночь, и первичный ключ record обязан оставаться уникальным
+PARTITIONED_MODELS = {
+    NightHeartRateEntry: 'time',
+}
+
+
+def partitioning_supported() -> bool:
+    """Декларативное секционирование есть только на PostgreSQL"""
+    return connection.vendor == 'postgresql'
+
+
+def month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(model: type[models.Model], month: date) -> str:
+    return f'{model._meta.db_table}_p{month:%Y_%m}'
+
+
+def _month_bounds(month: date) -> Tuple[str, str]:
+    return f'{month.isoformat()} 00:00:00+00', f'{add_months(month, 1).isoformat()} 00:00:00+00'
+
+
+def month_partitions(model: type[models.Model]) -> List[date]:
+    """Месяцы, для которых у таблицы модели есть присоединённые секции (без секции по умолчанию)"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    prefix = f'{table}_p'
+    return sorted(
+        date(int(name[len(prefix):len(prefix) + 4]), int(name[-2:]), 1)
+        for name in names if name.startswith(prefix)
+    )
+
+
+def create_month_partition(model: type[models.Model], month: date) -> bool:
+    """
+    Создаёт секцию таблицы модели за месяц. Строки этого месяца, попавшие в секцию по умолчанию,
+    переносятся в новую секцию. Возвращает False, если секция уже есть.
+    """
+    month = month_start(month)
+    if month in month_partitions(model):
+        return False
+
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    default = f'{table}_default'
+    key = qn(model._meta.get_field(PARTITIONED_MODELS[model]).column)
+    lower, upper = _month_bounds(month)
+    in_month = f'{key} >= %s AND {key} < %s'
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Пока в секции по умолчанию есть строки месяца, PostgreSQL не даст создать для него секцию
+        cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(default)}')
+        cursor.execute(
+            f'CREATE TABLE {qn(partition_name(model, month))} PARTITION OF {qn(table)} '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            [lower, upper],
+        )
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(default)} WHERE {in_month}', [lower, upper])
+        cursor.execute(f'DELETE FROM {qn(default)} WHERE {in_month}', [lower, upper])
+        cursor.execute(f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(default)} DEFAULT')
+    return True
+
+
+def ensure_month_partitions(first: date, months: int) -> int:
+    """Создаёт секции всех секционированных таблиц на months месяцев начиная с first. Возвращает число новых"""
+    created = 0
+    for model in PARTITIONED_MODELS:
+        for offset in range(months):
+            created += create_month_partition(model, add_months(month_start(first), offset))
+    return created
+
+
+def detach_month_partitions(before: date, drop: bool = False) -> List[str]:
+    """
+    Отсоединяет секции за месяцы раньше before. Отсоединённая секция остаётся отдельной таблицей
+    (её можно выгрузить в архив) или удаляется, если drop. Возвращает имена секций.
+    """
+    qn = connection.ops.quote_name
+    detached = []
+    for model in PARTITIONED_MODELS:
+        table = model._meta.db_table
+        for month in month_partitions(model):
+            if month >= month_start(before):
+                continue
+            name = partition_name(model, month)
+            with connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+                if drop:
+                    cursor.execute(f'DROP TABLE {qn(name)}')
+            detached.append(name)
+    return detached
@@ -1,15 +1,17 @@
 from typing import List
 
-from sleep_tracking_app.models import UserData, SleepStatistics, SleepRecord
+from sleep_tracking_app.models import UserData, SleepStatistics, SleepRecord, SleepAnomaly
 
 
 def create_sleep_analysis_prompt(
         user_data: UserData,
         sleep_statistics_list: List[SleepStatistics],
-        sleep_records_list: List[SleepRecord]) -> str:
+        sleep_records_list: List[SleepRecord],
+        anomalies: List[SleepAnomaly] = None) -> str:
     """
     Создает промпт для анализа сна на основе данных пользователя
     и нескольких последних ночей сна.
+    anomalies — недавние резкие отклонения ночных метрик от обычных значений пользователя.
 
     ВАЖНО:
     - Первый элемент списков считается ПОСЛЕДНЕЙ ночью (самая свежая запись).
@@ -66,11 +68,25 @@ def create_sleep_analysis_prompt(
             sleep_info += f"\n- Максимальный пульс: {sleep_record.max_hr} уд/мин"
         if getattr(sleep_record, "awake_count", None):
             sleep_info += f"\n- Количество пробуждений: {sleep_record.awake_count}"
+        # Количество циклов сна посчитано при импорте
+        if getattr(sleep_statistics, "cycle_count", None) is not None:
+            sleep_info += f"\n- Завершённых циклов сна: {sleep_statistics.cycle_count}"
 
         nights_blocks.append(sleep_info)
 
     nights_info = "\n\n".join(nights_blocks) if nights_blocks else "Нет данных по ночам сна."
 
+    # Отклонения от базовой линии пользователя
+    anomalies_info = ""
+    if anomalies:
+        anomaly_lines = [
+            f"- {anomaly.record.sleep_date_time.date()}: {anomaly.get_metric_display()} "
+            f"{anomaly.value:g} (обычно около {anomaly.baseline:g})"
+            for anomaly in anomalies
+        ]
+        anomalies_info = "Резкие отклонения от моих обычных показателей за последние недели:\n" \
+                         + "\n".join(anomaly_lines)
+
     prompt = f"""
         {user_info}
         
@@ -78,6 +94,8 @@ def create_sleep_analysis_prompt(
         
         {nights_info}
         
+        {anomalies_info}
+        
         Внимательно проанализируй мои записи сна. Чётко учитывай, что первая описанная ночь — это ПОСЛЕДНЯЯ ночь (самая свежая запись),
         вторая — ПРЕДЫДУЩАЯ ночь. Сравни показатели между последней и предпредыдущей ночью, опиши тенденции и изменения.
         Дай конкретные советы, как улучшить мой сон, с опорой в первую очередь на последнюю ночь, но с учётом динамики по сравнению с предыдущей.
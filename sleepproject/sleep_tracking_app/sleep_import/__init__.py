@@ -0,0 +1,63 @@
+from .records import upsert_sleep_records, SLEEP_RECORD_FIELDS
+from .copy_loader import load_sleep_segments, load_night_heart_rate, copy_frame, supports_copy
+from .hr_series import pack_heart_rate_frame, pack_legacy_heart_rate, PACK_BATCH_SIZE
+from .hr_retention import downsample_night_heart_rate, retention_tiers, DEFAULT_RETENTION_TIERS, RETENTION_BATCH_SIZE
+from .fingerprint import night_fingerprints, select_changed_nights
+from .statistics import sleep_statistics_from_frames, sleep_bitmaps_from_frames, hypnograms_from_frames, \
+    SLEEP_STATISTICS_COLUMNS
+from .pipeline import import_sleep_frames, create_sleep_statistics
+from .sharding import split_into_shards, write_shards, read_shard, shard_start
+from .progress import ThrottledProgress, ProgressSpan, TaskStateProxy, report_shard_progress, IMPORT_STAGES
+from .recompute import recompute_user_statistics, RECOMPUTE_BATCH_SIZE
+from .checkpoint import file_digest, completed_shards, imported_total, import_shard_checkpointed, \
+    clear_checkpoints
+
+__all__ = [
+    'upsert_sleep_records',
+    'SLEEP_RECORD_FIELDS',
+
+    'load_sleep_segments',
+    'load_night_heart_rate',
+    'copy_frame',
+    'supports_copy',
+
+    'pack_heart_rate_frame',
+    'pack_legacy_heart_rate',
+    'PACK_BATCH_SIZE',
+
+    'downsample_night_heart_rate',
+    'retention_tiers',
+    'DEFAULT_RETENTION_TIERS',
+    'RETENTION_BATCH_SIZE',
+
+    'night_fingerprints',
+    'select_changed_nights',
+
+    'sleep_statistics_from_frames',
+    'sleep_bitmaps_from_frames',
+    'hypnograms_from_frames',
+    'SLEEP_STATISTICS_COLUMNS',
+
+    'import_sleep_frames',
+    'create_sleep_statistics',
+
+    'split_into_shards',
+    'write_shards',
+    'read_shard',
+    'shard_start',
+
+    'ThrottledProgress',
+    'ProgressSpan',
+    'TaskStateProxy',
+    'report_shard_progress',
+    'IMPORT_STAGES',
+
+    'recompute_user_statistics',
+    'RECOMPUTE_BATCH_SIZE',
+
+    'file_digest',
+    'completed_shards',
+    'imported_total',
+    'import_shard_checkpointed',
+    'clear_checkpoints',
+]
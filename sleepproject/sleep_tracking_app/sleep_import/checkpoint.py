@@ -0,0 +1,55 @@
+import hashlib
+from typing import Set
+
+import pandas as pd
+from celery_progress.backend import ProgressRecorder
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Sum
+
+from ..models import ImportCheckpoint, UserData
+from .pipeline import import_sleep_frames
+
+# Размер блока при подсчёте хеша файла
+DIGEST_BLOCK_SIZE = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    """sha256 файла, читается блоками. Ключ, по которому повторный импорт находит свои отметки"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DIGEST_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def completed_shards(user: User, file_hash: str) -> Set[str]:
+    """Ключи шардов этого файла, которые уже записаны в БД"""
+    return set(ImportCheckpoint.objects.filter(user=user, file_hash=file_hash).values_list('shard', flat=True))
+
+
+def imported_total(user: User, file_hash: str) -> int:
+    """Сколько ночей записано по всем отметкам файла"""
+    return ImportCheckpoint.objects.filter(user=user, file_hash=file_hash).aggregate(
+        total=Sum('imported'))['total'] or 0
+
+
+def import_shard_checkpointed(user: User, user_data: UserData, file_hash: str, shard: str, meta: pd.DataFrame,
+                              items: pd.DataFrame, night_hr: pd.DataFrame,
+                              progress_recorder: ProgressRecorder = None) -> int:
+    """
+    Записывает шард и отметку о нём одной транзакцией: после падения воркера
+    шард либо записан вместе с отметкой, либо не записан вовсе.
+    Уже отмеченный шард пропускается. Возвращает количество записанных ночей.
+    """
+    with transaction.atomic():
+        if ImportCheckpoint.objects.filter(user=user, file_hash=file_hash, shard=shard).exists():
+            return 0
+        processed = import_sleep_frames(user, user_data, meta, items, night_hr, progress_recorder)
+        ImportCheckpoint.objects.create(user=user, file_hash=file_hash, shard=shard, imported=processed)
+    return processed
+
+
+def clear_checkpoints(user: User, file_hash: str) -> None:
+    """Удаляет отметки файла после успешного завершения импорта"""
+    ImportCheckpoint.objects.filter(user=user, file_hash=file_hash).delete()
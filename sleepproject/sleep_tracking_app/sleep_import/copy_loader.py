@@ -0,0 +1,110 @@
+import json
+from typing import Dict, List
+
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+from django.db import connection, models
+
+from ..models import SleepSegment, NightHeartRateEntry, NightHeartRateSeries
+from .hr_series import pack_heart_rate_frame
+
+# Количество строк, которое форматируется и отправляется в COPY за один раз
+COPY_CHUNK_SIZE = 100_000
+BULK_BATCH_SIZE = 1000
+
+# Экранирование текста для COPY в текстовом формате; обратная косая черта — первой
+COPY_ESCAPES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))
+
+
+def supports_copy() -> bool:
+    """COPY FROM STDIN доступен только на PostgreSQL с драйвером psycopg 3"""
+    if connection.vendor != 'postgresql':
+        return False
+
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    return is_psycopg3
+
+
+def _copy_text(column: pd.Series) -> pd.Series:
+    """
+    Значения колонки в текстовом формате COPY: пропуски — \\N, словари и списки — JSON,
+    обратная косая черта, табуляция и переводы строк в тексте экранируются
+    """
+    missing = column.isna()
+    if is_bool_dtype(column) or is_numeric_dtype(column) or is_datetime64_any_dtype(column):
+        text = column.astype(str)
+    else:
+        text = column.map(lambda value: json.dumps(value) if isinstance(value, (dict, list)) else str(value))
+        for char, escaped in COPY_ESCAPES:
+            text = text.str.replace(char, escaped, regex=False)
+    return text.mask(missing, '\\N')
+
+
+def copy_frame(model: type[models.Model], frame: pd.DataFrame, chunk_size: int = COPY_CHUNK_SIZE) -> int:
+    """
+    Загружает DataFrame в таблицу модели через COPY FROM STDIN.
+    Колонки frame должны называться как поля модели; строки форматируются
+    pandas кусками, без создания объектов модели.
+    """
+    quote_name = connection.ops.quote_name
+    columns = ', '.join(quote_name(model._meta.get_field(name).column) for name in frame.columns)
+    sql = f'COPY {quote_name(model._meta.db_table)} ({columns}) FROM STDIN'
+
+    with connection.cursor() as cursor:
+        with cursor.copy(sql) as copy:
+            for start in range(0, len(frame), chunk_size):
+                # Индекс сбрасывается: str.cat выравнивает колонки по нему, а время записи сна повторяется
+                part = frame.iloc[start:start + chunk_size].reset_index(drop=True)
+                columns_text = [_copy_text(column) for _, column in part.items()]
+                lines = columns_text[0].str.cat(columns_text[1:], sep='\t') if len(columns_text) > 1 \
+                    else columns_text[0]
+                copy.write('\n'.join(lines) + '\n')
+
+    return len(frame)
+
+
+def _with_record_id(frame: pd.DataFrame, record_map: Dict, key: pd.Index) -> pd.DataFrame:
+    """Добавляет колонку record_id по времени записи сна и отбрасывает строки без записи"""
+    record_id = key.map(record_map)
+    frame = frame.assign(record_id=record_id.to_numpy())
+    return frame[frame['record_id'].notna()].astype({'record_id': 'int64'})
+
+
+def _bulk_create(model: type[models.Model], frame: pd.DataFrame) -> int:
+    columns: List[str] = list(frame.columns)
+    objs = [model(**dict(zip(columns, row))) for row in frame.itertuples(index=False, name=None)]
+    model.objects.bulk_create(objs, batch_size=BULK_BATCH_SIZE)
+    return len(objs)
+
+
+def _load(model: type[models.Model], frame: pd.DataFrame) -> int:
+    if frame.empty:
+        return 0
+    if supports_copy():
+        return copy_frame(model, frame)
+    # Fallback для SQLite (settings_ci) и других СУБД
+    return _bulk_create(model, frame)
+
+
+def load_sleep_segments(items: pd.DataFrame, record_map: Dict) -> int:
+    """
+    Сохраняет сегменты сна из items (индекс — время записи сна).
+    Возвращает количество загруженных строк.
+    """
+    frame = _with_record_id(items[['start_time', 'end_time', 'state']], record_map, items.index)
+    return _load(SleepSegment, frame[['record_id', 'start_time', 'end_time', 'state']])
+
+
+def load_night_heart_rate(night_hr: pd.DataFrame, record_map: Dict) -> int:
+    """
+    Сохраняет ночной пульс из night_hr (индекс — время замера, колонка sleep_time — запись сна)
+    одной строкой NightHeartRateSeries на ночь. Ночи, не помещающиеся в упаковку, пишутся строками замеров.
+    Возвращает количество сохранённых замеров.
+    """
+    frame = pd.DataFrame({'time': night_hr.index, 'bpm': night_hr['bpm'].to_numpy()})
+    frame = _with_record_id(frame, record_map, pd.Index(night_hr['sleep_time']))
+
+    series, overflow = pack_heart_rate_frame(frame[['record_id', 'time', 'bpm']])
+    NightHeartRateSeries.objects.bulk_create(series, batch_size=BULK_BATCH_SIZE)
+    _load(NightHeartRateEntry, overflow)
+    return len(frame)
@@ -0,0 +1,97 @@
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+
+from ..models import SleepRecord
+from .records import SLEEP_RECORD_FIELDS
+
+
+def _normalize(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Приводит каждое поле к фиксированному типу, чтобы отпечаток ночи не зависел от того,
+    какой тип pandas вывел для колонки по всей выгрузке (int, float, bool или object из-за
+    пропусков и смешанных значений в других ночах): время — int64 наносекунд UTC,
+    остальное — float64 (пропуски и нечисловые значения — NaN).
+    """
+    normalized = {}
+    for col in frame.columns:
+        values = frame[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            # Время хешируется как есть, без форматирования в строки
+            normalized[col] = pd.DatetimeIndex(values).as_unit('ns').asi8
+        elif 'time' in col:
+            normalized[col] = pd.DatetimeIndex(pd.to_datetime(values, utc=True)).as_unit('ns').asi8
+        else:
+            normalized[col] = pd.to_numeric(values, errors='coerce').astype('float64').to_numpy()
+    return pd.DataFrame(normalized, index=frame.index)
+
+
+def _hash_per_night(frame: pd.DataFrame, key: pd.Index, nights: pd.Index) -> np.ndarray:
+    """
+    Хеширует строки frame и сворачивает их в один uint64 на ночь (сумма по модулю 2**64).
+    Порядок строк внутри ночи учитывается через их номер.
+    """
+    result = np.zeros(len(nights), dtype=np.uint64)
+    if frame.empty:
+        return result
+
+    position = pd.Series(np.arange(len(frame)), index=key).groupby(level=0).cumcount().to_numpy()
+    hashed = pd.util.hash_pandas_object(_normalize(frame).assign(_position=position), index=False).to_numpy()
+
+    night_pos = nights.get_indexer(key)
+    known = night_pos >= 0
+    np.add.at(result, night_pos[known], hashed[known])
+    return result
+
+
+def night_fingerprints(meta: pd.DataFrame, items: pd.DataFrame, night_hr: pd.DataFrame) -> pd.Series:
+    """
+    Отпечаток содержимого каждой ночи: метаданные, сегменты сна и ночной пульс.
+    Возвращает Series int64 (подходит для BigIntegerField), проиндексированный как meta.
+    """
+    columns = [field for field in SLEEP_RECORD_FIELDS if field in meta.columns]
+    meta_hash = pd.util.hash_pandas_object(_normalize(meta[columns]), index=False).to_numpy()
+
+    items_hash = _hash_per_night(items[['start_time', 'end_time', 'state']], items.index, meta.index)
+    hr_hash = _hash_per_night(
+        pd.DataFrame({'time': night_hr.index, 'bpm': night_hr['bpm'].to_numpy()}),
+        pd.Index(night_hr['sleep_time']), meta.index,
+    )
+
+    combined = pd.DataFrame({'meta': meta_hash, 'items': items_hash, 'hr': hr_hash})
+    fingerprint = pd.util.hash_pandas_object(combined, index=False).to_numpy().view(np.int64)
+    return pd.Series(fingerprint, index=meta.index, name='content_hash')
+
+
+def select_changed_nights(user: User, meta: pd.DataFrame, items: pd.DataFrame, night_hr: pd.DataFrame) \
+        -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Оставляет только новые ночи и ночи, содержимое которых изменилось
+    по сравнению с уже сохранёнными (по sleep_date_time и content_hash).
+    meta должен содержать колонку content_hash.
+    """
+    if meta.empty:
+        return meta, items, night_hr
+
+    # Один диапазонный запрос по индексу (user, sleep_date_time) вместо IN по всем ночам
+    sleep_times = meta.index
+    stored: Dict[pd.Timestamp, int] = {
+        pd.Timestamp(sleep_date_time): content_hash
+        for sleep_date_time, content_hash in SleepRecord.objects.filter(
+            user=user, sleep_date_time__range=(sleep_times.min(), sleep_times.max()),
+        ).values_list('sleep_date_time', 'content_hash')
+    }
+
+    changed = np.array([
+        stored.get(sleep_time) != content_hash
+        for sleep_time, content_hash in zip(sleep_times, meta['content_hash'])
+    ], dtype=bool)
+
+    nights = meta.index[changed]
+    return (
+        meta[changed],
+        items[items.index.isin(nights)],
+        night_hr[night_hr['sleep_time'].isin(nights)],
+    )
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import SleepRecord, NightHeartRateEntry, NightHeartRateSeries, NightHeartRateAggregate
+from ..sleep_statistic import night_heart_rate_frame
+
+# Сроки хранения ночного пульса по умолчанию: (возраст ночи в днях, длина интервала в секундах).
+# Ночи старше 90 дней хранятся поминутно, старше года — по 5 минут
+DEFAULT_RETENTION_TIERS = ((90, 60), (365, 300))
+
+# Сколько записей сна огрубляется за одну транзакцию
+RETENTION_BATCH_SIZE = 500
+
+
+def retention_tiers() -> List[Tuple[int, int]]:
+    """Уровни хранения из настройки HEART_RATE_RETENTION_TIERS, от самого старого к самому свежему"""
+    tiers = getattr(settings, 'HEART_RATE_RETENTION_TIERS', DEFAULT_RETENTION_TIERS)
+    return sorted(((int(days), int(resolution)) for days, resolution in tiers), reverse=True)
+
+
+def _downsample_raw(ids: List[int], resolution: int) -> int:
+    """Сводит исходные замеры записей в интервалы и удаляет замеры"""
+    sleep_times = SleepRecord.objects.filter(pk__in=ids).values_list('sleep_date_time', flat=True)
+    time_range = SleepRecord.heart_rate_time_range(list(sleep_times))
+    frame = night_heart_rate_frame(ids, time_range)
+
+    aggregates = []
+    for record_id, night in frame.groupby('record_id', sort=False):
+        seconds = night['time'].dt.tz_convert(None).to_numpy().astype('datetime64[s]').astype('int64')
+        bpm = night['bpm'].to_numpy()
+        aggregates.append(NightHeartRateAggregate.aggregate(
+            int(record_id), seconds, bpm, bpm, bpm, np.ones(len(bpm)), resolution
+        ))
+
+    with transaction.atomic():
+        # Огрублённый ряд, оставшийся от прошлого импорта этих ночей, заменяется новым
+        NightHeartRateAggregate.objects.filter(record_id__in=ids).delete()
+        NightHeartRateAggregate.objects.bulk_create(aggregates)
+        NightHeartRateSeries.objects.filter(record_id__in=ids).delete()
+        NightHeartRateEntry.objects.filter(record_id__in=ids, time__range=time_range).delete()
+    return len(aggregates)
+
+
+def _coarsen(ids: List[int], resolution: int) -> int:
+    """Укрупняет интервалы огрублённых рядов записей до resolution"""
+    aggregates = [
+        aggregate.coarsen(resolution) for aggregate in NightHeartRateAggregate.objects.filter(record_id__in=ids)
+    ]
+    with transaction.atomic():
+        NightHeartRateAggregate.objects.filter(record_id__in=ids).delete()
+        NightHeartRateAggregate.objects.bulk_create(aggregates)
+    return len(aggregates)
+
+
+def downsample_night_heart_rate(now: Optional[datetime] = None, tiers: Optional[Sequence[Tuple[int, int]]] = None,
+                                batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """
+    Переводит ночной пульс старых записей сна на более грубый уровень хранения: исходные замеры
+    (упакованный ряд и строки замеров) сводятся в минимум/среднее/максимум по интервалам и удаляются,
+    а уже сведённые ночи укрупняются, когда переходят на следующий уровень. Так объём пульса
+    на пользователя ограничен сроком хранения замеров, а не всей историей.
+    Возвращает количество обработанных ночей.
+    """
+    now = now or timezone.now()
+    tiers = sorted(tiers, reverse=True) if tiers is not None else retention_tiers()
+
+    processed = 0
+    # Начинаем с самого грубого уровня: ночь сразу сводится к итоговой длине интервала
+    for days, resolution in tiers:
+        cutoff = now - timedelta(days=days)
+        old = SleepRecord.objects.filter(sleep_date_time__lt=cutoff)
+
+        raw = old.filter(Q(hr_series__isnull=False) | Q(night_hr_entries__isnull=False))
+        finer = old.filter(hr_aggregate__resolution__lt=resolution)
+        for queryset, step in ((raw, _downsample_raw), (finer, _coarsen)):
+            last_id = 0
+            while True:
+                ids = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)
+                           .distinct()[:batch_size])
+                if not ids:
+                    break
+                last_id = ids[-1]
+                processed += step(ids, resolution)
+    return processed
@@ -0,0 +1,67 @@
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+
+from ..models import SleepRecord, NightHeartRateEntry, NightHeartRateSeries
+
+# Сколько записей сна переупаковывается за одну транзакцию
+PACK_BATCH_SIZE = 500
+
+
+def pack_heart_rate_frame(frame: pd.DataFrame) -> Tuple[List[NightHeartRateSeries], pd.DataFrame]:
+    """
+    Упаковывает замеры пульса (колонки record_id, time, bpm) в один NightHeartRateSeries на запись сна.
+    Ночи с интервалом между замерами больше MAX_OFFSET секунд (не помещается в uint16) или пульсом
+    больше MAX_BPM (не помещается в uint8) возвращаются вторым значением как строки для NightHeartRateEntry.
+    """
+    if frame.empty:
+        return [], frame
+
+    frame = frame.sort_values(['record_id', 'time'], kind='stable')
+    times = pd.DatetimeIndex(pd.to_datetime(frame['time'], utc=True)).tz_convert(None)
+    seconds = times.to_numpy().astype('datetime64[s]').astype('int64')
+    bpm = frame['bpm'].to_numpy()
+    record_ids = frame['record_id'].to_numpy()
+
+    starts = np.r_[0, np.flatnonzero(np.diff(record_ids)) + 1]
+    ends = np.r_[starts[1:], len(frame)]
+    gaps = np.diff(seconds, prepend=seconds[0])
+    gaps[starts] = 0
+    overflow = (np.maximum.reduceat(gaps, starts) > NightHeartRateSeries.MAX_OFFSET) \
+        | (np.maximum.reduceat(bpm, starts) > NightHeartRateSeries.MAX_BPM)
+
+    series = [
+        NightHeartRateSeries.pack(int(record_ids[start]), seconds[start:end], bpm[start:end])
+        for start, end, too_long in zip(starts, ends, overflow) if not too_long
+    ]
+    return series, frame[np.repeat(overflow, ends - starts)]
+
+
+def pack_legacy_heart_rate(batch_size: int = PACK_BATCH_SIZE) -> int:
+    """
+    Переупаковывает строки NightHeartRateEntry записей, импортированных до появления
+    NightHeartRateSeries, в упакованные ряды и удаляет упакованные строки.
+    Возвращает количество упакованных ночей.
+    """
+    packed = 0
+    last_id = 0
+    while True:
+        ids = list(
+            SleepRecord.objects.filter(pk__gt=last_id, hr_series__isnull=True, night_hr_entries__isnull=False)
+            .order_by('pk').values_list('pk', flat=True).distinct()[:batch_size]
+        )
+        if not ids:
+            return packed
+        last_id = ids[-1]
+
+        frame = pd.DataFrame.from_records(
+            NightHeartRateEntry.objects.filter(record_id__in=ids).values_list('record_id', 'time', 'bpm'),
+            columns=['record_id', 'time', 'bpm'],
+        )
+        series, _ = pack_heart_rate_frame(frame)
+        with transaction.atomic():
+            NightHeartRateSeries.objects.bulk_create(series)
+            NightHeartRateEntry.objects.filter(record_id__in=[item.record_id for item in series]).delete()
+        packed += len(series)
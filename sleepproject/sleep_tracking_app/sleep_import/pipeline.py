@@ -0,0 +1,111 @@
+from typing import Dict
+
+import pandas as pd
+from celery_progress.backend import ProgressRecorder
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+
+from ..models import SleepRecord, SleepSegment, NightHeartRateEntry, NightHeartRateSeries, NightHeartRateAggregate, \
+    SleepStatistics, UserData
+from ..sleep_statistic import counted_cohort_values, update_cohort_sketches
+from .copy_loader import load_sleep_segments, load_night_heart_rate
+from .records import upsert_sleep_records
+from .statistics import sleep_statistics_from_frames, sleep_bitmaps_from_frames, hypnograms_from_frames
+
+# Этапы записи ночей: записи сна, сегменты, ночной пульс, статистика
+IMPORT_STEPS = 4
+
+
+def _report(progress_recorder: ProgressRecorder, step: int, description: str) -> None:
+    if progress_recorder is not None:
+        progress_recorder.set_progress(step, IMPORT_STEPS, description)
+
+
+def create_sleep_statistics(user: User, user_data: UserData, meta: pd.DataFrame, items: pd.DataFrame,
+                            night_hr: pd.DataFrame, record_map: Dict) -> int:
+    """
+    Считает статистику сна по разобранным meta, items и night_hr и сохраняет её одним bulk insert.
+    Записи сна не перечитываются из БД: id берутся из record_map (время записи сна -> id).
+    """
+    stats = sleep_statistics_from_frames(meta, items, user_data.get_age_months(), user_data.gender,
+                                         user_data.weight, user_data.height, night_hr)
+    stats = stats.assign(record_id=stats.index.map(record_map))
+    stats = stats[stats['record_id'].notna()]
+
+    # --- подготавливаем статистику сна ---
+    sleep_statistic_to_create = [
+        SleepStatistics(
+            user=user,
+            record_id=int(row.record_id),
+            date=row.date,
+            latency_minutes=row.latency_minutes,
+            sleep_efficiency=row.sleep_efficiency,
+            sleep_phases=row.sleep_phases,
+            **{field: getattr(row, field) for field in SleepStatistics.PHASE_FIELDS.values()},
+            sleep_fragmentation_index=row.sleep_fragmentation_index,
+            sleep_calories_burned=row.sleep_calories_burned,
+            cycle_count=row.cycle_count,
+            stage_heart_rate=row.stage_heart_rate,
+        )
+        for row in stats.itertuples(index=False)
+    ]
+
+    # bulk insert
+    SleepStatistics.objects.bulk_create(sleep_statistic_to_create, batch_size=1000)
+    return len(sleep_statistic_to_create)
+
+
+def import_sleep_frames(user: User, user_data: UserData, meta: pd.DataFrame, items: pd.DataFrame,
+                        night_hr: pd.DataFrame, progress_recorder: ProgressRecorder = None) -> int:
+    """
+    Записывает разобранные ночи в БД одной транзакцией: записи сна, сегменты, ночной пульс
+    и статистику. Дочерние объекты и статистика этих ночей заменяются целиком.
+    О каждом этапе сообщается в progress_recorder (ProgressRecorder или ProgressSpan).
+    Возвращает количество записанных ночей.
+    """
+    if meta.empty:
+        return 0
+
+    with transaction.atomic():
+        # Статистика заменяемых ночей (и старая, не привязанная к записям) до обновления записей —
+        # её значения вычитаются из скетчей когорт
+        replaced = SleepStatistics.objects.filter(
+            Q(user=user, record__sleep_date_time__in=list(meta.index))
+            | Q(user=user, record__isnull=True, date__in={sleep_time.date() for sleep_time in meta.index})
+        )
+        removed = counted_cohort_values(replaced, user_data)
+
+        # Создаём или обновляем базовые записи сна одним bulk upsert и собираем их id в словарь;
+        # минутные карты сна для SRI и упакованная гипнограмма сохраняются вместе с записью
+        hypnograms = hypnograms_from_frames(meta, items)
+        record_map = upsert_sleep_records(user, meta.assign(
+            sleep_bitmap=sleep_bitmaps_from_frames(meta, items),
+            **{column: hypnograms[column].to_numpy() for column in hypnograms.columns},
+        ))
+        record_ids = list(record_map.values())
+        processed = len(record_map)
+        _report(progress_recorder, 1, 'Записи сна')
+
+        # Удаляем старые дочерние объекты и статистику этих ночей разом
+        SleepSegment.objects.filter(record_id__in=record_ids).delete()
+        # Диапазон времени отсекает лишние помесячные секции строк замеров на PostgreSQL;
+        # ряд у записи один, он удаляется по записи независимо от времени первого замера
+        hr_range = SleepRecord.heart_rate_time_range(meta.index)
+        NightHeartRateEntry.objects.filter(record_id__in=record_ids, time__range=hr_range).delete()
+        NightHeartRateSeries.objects.filter(record_id__in=record_ids).delete()
+        NightHeartRateAggregate.objects.filter(record_id__in=record_ids).delete()
+        replaced.delete()
+
+        # Сегменты и пульс загружаются прямо из DataFrame (COPY на PostgreSQL, bulk_create на SQLite)
+        load_sleep_segments(items, record_map)
+        _report(progress_recorder, 2, 'Сегменты сна')
+        load_night_heart_rate(night_hr, record_map)
+        _report(progress_recorder, 3, 'Ночной пульс')
+
+        create_sleep_statistics(user, user_data, meta, items, night_hr, record_map)
+        added = SleepStatistics.objects.filter(record_id__in=record_ids)
+        update_cohort_sketches(user_data, added=added, removed=removed)
+        _report(progress_recorder, 4, 'Статистика сна')
+
+    return processed
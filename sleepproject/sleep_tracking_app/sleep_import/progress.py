@@ -0,0 +1,109 @@
+import time
+from typing import Callable, Dict
+
+from celery_progress.backend import ProgressRecorder
+
+# Обновления прогресса реже этого интервала (секунды) и меньше этого шага (проценты) не отправляются
+PROGRESS_MIN_INTERVAL = 0.5
+PROGRESS_MIN_DELTA = 1.0
+
+# Доли этапов импорта в общей шкале прогресса
+IMPORT_STAGES = {'parse': 30, 'import': 70}
+
+
+class ProgressSpan:
+    """
+    Отрезок [start, end] общей шкалы прогресса в процентах.
+    Совместим с ProgressRecorder.set_progress, поэтому передаётся в функции этапов вместо него.
+    """
+
+    def __init__(self, reporter: 'ThrottledProgress', start: float, end: float):
+        self.reporter = reporter
+        self.start = start
+        self.end = end
+
+    def set_progress(self, current: float, total: float, description: str = '') -> None:
+        fraction = min(current / total, 1.0) if total else 1.0
+        self.reporter.report(self.start + (self.end - self.start) * fraction, description)
+
+    def span(self, current: float, size: float, total: float) -> 'ProgressSpan':
+        """Часть отрезка: элементы [current, current + size) из total"""
+        if not total:
+            return ProgressSpan(self.reporter, self.end, self.end)
+        width = self.end - self.start
+        return ProgressSpan(self.reporter, self.start + width * current / total,
+                            self.start + width * min(current + size, total) / total)
+
+
+class ThrottledProgress:
+    """
+    Отправляет прогресс в ProgressRecorder не чаще раза в min_interval секунд
+    и только при сдвиге не меньше min_delta процентов или смене описания.
+    Первое и финальное (100%) обновления отправляются всегда.
+    """
+
+    def __init__(self, progress_recorder: ProgressRecorder, min_interval: float = PROGRESS_MIN_INTERVAL,
+                 min_delta: float = PROGRESS_MIN_DELTA, clock: Callable[[], float] = time.monotonic):
+        self.progress_recorder = progress_recorder
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.clock = clock
+        self.last_time = None
+        self.last_percent = None
+        self.last_description = None
+
+    def stages(self, weights: Dict[str, float]) -> Dict[str, ProgressSpan]:
+        """Делит шкалу 0–100 на отрезки этапов пропорционально весам (в порядке словаря)"""
+        total = sum(weights.values())
+        spans = {}
+        start = 0.0
+        for name, weight in weights.items():
+            end = start + 100.0 * weight / total
+            spans[name] = ProgressSpan(self, start, end)
+            start = end
+        return spans
+
+    def _should_send(self, percent: float, description: str, now: float) -> bool:
+        if self.last_time is None:
+            return True
+        if percent >= 100.0:
+            return self.last_percent < 100.0
+        if now - self.last_time < self.min_interval:
+            return False
+        return percent - self.last_percent >= self.min_delta or description != self.last_description
+
+    def report(self, percent: float, description: str = '') -> None:
+        percent = min(max(percent, 0.0), 100.0)
+        now = self.clock()
+        if not self._should_send(percent, description, now):
+            return
+
+        self.progress_recorder.set_progress(round(percent, 1), 100, description)
+        self.last_time = now
+        self.last_percent = percent
+        self.last_description = description
+
+    def finish(self, description: str = '') -> None:
+        self.report(100.0, description)
+
+
+class TaskStateProxy:
+    """
+    Задача с update_state для ProgressRecorder, которая пишет состояние другой задачи по её id.
+    Через неё шарды и итоговая задача обновляют прогресс исходной задачи импорта.
+    """
+
+    def __init__(self, task, task_id: str):
+        self.task = task
+        self.task_id = task_id
+
+    def update_state(self, state=None, meta=None) -> None:
+        self.task.update_state(task_id=self.task_id, state=state, meta=meta)
+
+
+def report_shard_progress(task, task_id: str, done: int, total: int, description: str = '') -> None:
+    """Отмечает в прогрессе задачи task_id, что записано done шардов из total (этап 'import' шкалы)"""
+    if not task_id:
+        return
+    progress = ThrottledProgress(ProgressRecorder(TaskStateProxy(task, task_id)))
+    progress.stages(IMPORT_STAGES)['import'].set_progress(done, total, description)
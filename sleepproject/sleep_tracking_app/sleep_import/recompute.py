@@ -0,0 +1,112 @@
+from typing import Dict, Iterator, List
+
+import pandas as pd
+from django.db import transaction
+
+from ..models import SleepRecord, SleepStatistics, UserData
+from ..sleep_statistic import counted_cohort_values, update_cohort_sketches, night_heart_rate_frame, hypnogram_frame
+from .records import SLEEP_RECORD_FIELDS
+from .statistics import sleep_statistics_from_frames
+
+# Сколько записей сна пересчитывается и записывается за один раз
+RECOMPUTE_BATCH_SIZE = 2000
+
+# Поля SleepStatistics, которые пересчитываются; остальные (рекомендации и т.п.) не трогаются
+RECOMPUTED_FIELDS = [
+    'date',
+    'latency_minutes',
+    'sleep_efficiency',
+    'sleep_phases',
+    *SleepStatistics.PHASE_FIELDS.values(),
+    'sleep_fragmentation_index',
+    'sleep_calories_burned',
+    'cycle_count',
+    'stage_heart_rate',
+]
+
+
+def _iter_record_batches(user_id: int, batch_size: int) -> Iterator[pd.DataFrame]:
+    """Записи сна пользователя кусками по batch_size; на PostgreSQL читаются серверным курсором"""
+    columns = ['id', 'sleep_date_time'] + SLEEP_RECORD_FIELDS
+    rows = SleepRecord.objects.filter(user_id=user_id).order_by('sleep_date_time').values(*columns) \
+        .iterator(chunk_size=batch_size)
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+            batch = []
+    if batch:
+        yield pd.DataFrame.from_records(batch, columns=columns)
+
+
+def _frames_for_batch(records: pd.DataFrame):
+    """meta, items и night_hr в формате импорта для куска записей: два запроса на весь кусок"""
+    sleep_times = pd.DatetimeIndex(pd.to_datetime(records['sleep_date_time'], utc=True))
+    meta = records.drop(columns=['id', 'sleep_date_time']).set_axis(sleep_times)
+    for column in ('device_bedtime', 'bedtime', 'wake_up_time', 'device_wake_up_time'):
+        meta[column] = pd.to_datetime(meta[column], utc=True)
+    night_of: Dict[int, pd.Timestamp] = dict(zip(records['id'], sleep_times))
+
+    ids = list(night_of)
+    segments = hypnogram_frame(ids)
+    items = pd.DataFrame({
+        'start_time': pd.to_datetime(segments['start_time'], utc=True),
+        'end_time': pd.to_datetime(segments['end_time'], utc=True),
+        'state': segments['state'].astype('int64'),
+    }).set_axis(pd.DatetimeIndex(segments['record_id'].map(night_of), tz='UTC'))
+
+    heart_rate = night_heart_rate_frame(ids, SleepRecord.heart_rate_time_range(sleep_times))
+    night_hr = pd.DataFrame({
+        'bpm': heart_rate['bpm'].astype('int64').to_numpy(),
+        'sleep_time': pd.DatetimeIndex(heart_rate['record_id'].map(night_of), tz='UTC'),
+    }, index=pd.DatetimeIndex(pd.to_datetime(heart_rate['time'], utc=True)))
+
+    return meta, items, night_hr
+
+
+def recompute_user_statistics(user_id: int, batch_size: int = RECOMPUTE_BATCH_SIZE) -> int:
+    """
+    Пересчитывает SleepStatistics всех записей сна пользователя по текущим формулам.
+    Существующие строки обновляются на месте (рекомендации сохраняются), недостающие создаются.
+    Возвращает количество пересчитанных ночей.
+    """
+    user_data = UserData.objects.filter(user_id=user_id).first()
+    if user_data is None:
+        return 0
+
+    processed = 0
+    for records in _iter_record_batches(user_id, batch_size):
+        meta, items, night_hr = _frames_for_batch(records)
+        stats = sleep_statistics_from_frames(meta, items, user_data.get_age_months(), user_data.gender,
+                                             user_data.weight, user_data.height, night_hr)
+        stats['record_id'] = records['id'].to_numpy()
+
+        with transaction.atomic():
+            existing = {stat.record_id: stat for stat in SleepStatistics.objects.filter(
+                record_id__in=stats['record_id'].tolist())}
+            # Статистика, посчитанная до привязки к записям, сопоставляется по дате
+            legacy = {stat.date: stat for stat in SleepStatistics.objects.filter(
+                user_id=user_id, record__isnull=True, date__in=set(stats['date']))}
+
+            to_update: List[SleepStatistics] = []
+            to_create: List[SleepStatistics] = []
+            for row in stats[RECOMPUTED_FIELDS + ['record_id']].to_dict('records'):
+                stat = existing.get(row['record_id']) or legacy.pop(row['date'], None)
+                if stat is None:
+                    to_create.append(SleepStatistics(user_id=user_id, **row))
+                    continue
+                for field, value in row.items():
+                    setattr(stat, field, value)
+                to_update.append(stat)
+
+            removed = counted_cohort_values(SleepStatistics.objects.filter(pk__in=[stat.pk for stat in to_update]),
+                                            user_data)
+            SleepStatistics.objects.bulk_update(to_update, RECOMPUTED_FIELDS + ['record_id'], batch_size=1000)
+            SleepStatistics.objects.bulk_create(to_create, batch_size=1000)
+            update_cohort_sketches(user_data, removed=removed, added=SleepStatistics.objects.filter(
+                record_id__in=stats['record_id'].tolist()))
+
+        processed += len(stats)
+    return processed
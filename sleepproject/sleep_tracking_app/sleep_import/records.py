@@ -0,0 +1,69 @@
+from typing import Dict
+
+import pandas as pd
+from django.contrib.auth.models import User
+
+from ..models import SleepRecord
+
+# Поля SleepRecord, которые заполняются из метаданных выгрузки
+SLEEP_RECORD_FIELDS = [
+    'sleep_rem_duration',
+    'has_rem',
+    'min_hr',
+    'device_bedtime',
+    'sleep_deep_duration',
+    'wake_up_time',
+    'bedtime',
+    'awake_count',
+    'duration',
+    'max_hr',
+    'sleep_awake_duration',
+    'avg_hr',
+    'sleep_light_duration',
+    'device_wake_up_time',
+]
+
+# Служебные поля, которые вычисляются при импорте, а не берутся из выгрузки
+SLEEP_RECORD_SERVICE_FIELDS = [
+    'content_hash',
+    'sleep_bitmap',
+    'hypnogram_start',
+    'hypnogram_states',
+    'hypnogram_durations',
+]
+
+
+def upsert_sleep_records(user: User, meta: pd.DataFrame, batch_size: int = 1000) -> Dict:
+    """
+    Создаёт или обновляет записи сна пачками одним INSERT ... ON CONFLICT
+    по уникальному ключу (user, sleep_date_time).
+    Возвращает словарь {время записи из индекса meta: id SleepRecord}.
+    """
+    meta = meta[~meta.index.duplicated(keep='last')]
+    columns = [field for field in SLEEP_RECORD_FIELDS + SLEEP_RECORD_SERVICE_FIELDS if field in meta.columns]
+    values = meta[columns].astype(object).where(meta[columns].notna(), None)
+
+    records = [
+        SleepRecord(user=user, sleep_date_time=sleep_time, **dict(zip(columns, row)))
+        for sleep_time, row in zip(values.index, values.itertuples(index=False, name=None))
+    ]
+
+    SleepRecord.objects.bulk_create(
+        records,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['user', 'sleep_date_time'],
+        update_fields=columns,
+    )
+
+    record_ids = {sleep_time: record.pk for sleep_time, record in zip(meta.index, records)}
+
+    # Не все СУБД возвращают id при ON CONFLICT — добираем их одним запросом
+    if any(pk is None for pk in record_ids.values()):
+        existing = SleepRecord.objects.filter(
+            user=user, sleep_date_time__in=list(meta.index)
+        ).values_list('pk', 'sleep_date_time')
+        for pk, sleep_date_time in existing:
+            record_ids[pd.Timestamp(sleep_date_time)] = pk
+
+    return record_ids
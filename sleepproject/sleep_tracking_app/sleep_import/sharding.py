@@ -0,0 +1,55 @@
+import os
+from datetime import date
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+# Размер шарда при параллельном импорте: месяц
+SHARD_FREQ = os.getenv("SLEEP_IMPORT_SHARD_FREQ", "M")
+
+Frames = Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+
+
+def _periods(times: pd.DatetimeIndex, freq: str) -> pd.PeriodIndex:
+    return pd.DatetimeIndex(times).tz_convert(None).to_period(freq)
+
+
+def split_into_shards(meta: pd.DataFrame, items: pd.DataFrame, night_hr: pd.DataFrame,
+                      freq: str = SHARD_FREQ) -> Dict[str, Frames]:
+    """
+    Делит разобранную выгрузку на шарды по времени записи сна (по умолчанию по месяцам).
+    Сегменты и пульс попадают в шард своей ночи. Возвращает {ключ периода: (meta, items, night_hr)}.
+    """
+    meta_groups = dict(iter(meta.groupby(_periods(meta.index, freq))))
+    items_groups = dict(iter(items.groupby(_periods(items.index, freq))))
+    hr_groups = dict(iter(night_hr.groupby(_periods(night_hr['sleep_time'], freq))))
+
+    return {
+        str(period): (
+            shard_meta,
+            items_groups.get(period, items.iloc[:0]),
+            hr_groups.get(period, night_hr.iloc[:0]),
+        )
+        for period, shard_meta in sorted(meta_groups.items())
+    }
+
+
+def shard_start(key: str, freq: str = SHARD_FREQ) -> date:
+    """Первая дата периода шарда по его ключу"""
+    return pd.Period(key, freq=freq).start_time.date()
+
+
+def write_shards(shards: Dict[str, Frames], directory: str) -> List[str]:
+    """Сохраняет шарды в pickle-файлы в directory, чтобы передать их воркерам по пути"""
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for key, frames in shards.items():
+        path = os.path.join(directory, f'{key}.pkl')
+        pd.to_pickle(frames, path)
+        paths.append(path)
+    return paths
+
+
+def read_shard(path: str) -> Frames:
+    return pd.read_pickle(path)
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+from ..models import SleepRecord, SleepStatistics
+
+from ..sleep_statistic import sleep_statistics_batch, sleep_cycle_counts, sleep_bitmaps, night_anchors, \
+    stage_heart_rate_stats
+
+# Колонки, которые возвращает sleep_statistics_from_frames
+SLEEP_STATISTICS_COLUMNS = [
+    'date',
+    'latency_minutes',
+    'sleep_efficiency',
+    'sleep_phases',
+    *SleepStatistics.PHASE_FIELDS.values(),
+    'sleep_fragmentation_index',
+    'sleep_calories_burned',
+    'cycle_count',
+    'stage_heart_rate',
+]
+
+
+def sleep_statistics_from_frames(meta: pd.DataFrame, items: pd.DataFrame, age: float, gender: int, weight: float,
+                                 height: int, night_hr: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Считает метрики сна для всех ночей выгрузки по разобранным meta и items, без обращения к БД.
+    Если передан night_hr, добавляется пульс по стадиям сна.
+    Возвращает DataFrame с индексом meta и колонками SLEEP_STATISTICS_COLUMNS.
+    """
+    first_segment = items['start_time'].groupby(level=0).min().reindex(meta.index)
+
+    metrics = sleep_statistics_batch(
+        bedtime=meta['bedtime'],
+        device_bedtime=meta['device_bedtime'],
+        wake_up_time=meta['wake_up_time'],
+        device_wake_up_time=meta['device_wake_up_time'],
+        first_segment_start=first_segment,
+        duration=meta['duration'],
+        sleep_deep_duration=meta['sleep_deep_duration'],
+        sleep_light_duration=meta['sleep_light_duration'],
+        sleep_rem_duration=meta['sleep_rem_duration'],
+        sleep_awake_duration=meta['sleep_awake_duration'],
+        awake_count=meta['awake_count'],
+        age=age, gender=gender, weight=weight, height=height,
+    )
+
+    # Циклы сна по сегментам, упорядоченным по времени внутри ночи
+    ordered = items.sort_values('start_time', kind='stable').sort_index(kind='stable')
+    cycle_count = sleep_cycle_counts(
+        ordered.index, ordered['state'],
+        ((ordered['end_time'] - ordered['start_time']).dt.total_seconds() / 60),
+    ).reindex(meta.index, fill_value=0)
+
+    stage_heart_rate = {}
+    if night_hr is not None:
+        stage_heart_rate = stage_heart_rate_stats(items.index, items['start_time'], items['end_time'],
+                                                  items['state'], night_hr.index, night_hr['bpm'])
+
+    phases = metrics['sleep_phases']
+    return pd.DataFrame({
+        'date': meta.index.date,
+        'latency_minutes': metrics['latency_minutes'],
+        'sleep_efficiency': metrics['sleep_efficiency'],
+        'sleep_phases': [
+            {phase: float(values[i]) for phase, values in phases.items()} for i in range(len(meta))
+        ],
+        **{field: np.asarray(phases[phase], dtype='float64') for phase, field in SleepStatistics.PHASE_FIELDS.items()},
+        'sleep_fragmentation_index': metrics['sleep_fragmentation_index'],
+        'sleep_calories_burned': metrics['sleep_calories_burned'],
+        'cycle_count': cycle_count.to_numpy(),
+        'stage_heart_rate': [stage_heart_rate.get(sleep_time) for sleep_time in meta.index],
+    }, index=meta.index)
+
+
+def sleep_bitmaps_from_frames(meta: pd.DataFrame, items: pd.DataFrame) -> list:
+    """Упакованные минутные карты сна (bytes) для каждой ночи meta, в порядке meta"""
+    bitmaps = sleep_bitmaps(night_anchors(meta.index), meta.index.get_indexer(items.index),
+                            items['start_time'], items['end_time'], items['state'])
+    return [bitmap.tobytes() for bitmap in bitmaps]
+
+
+def hypnograms_from_frames(meta: pd.DataFrame, items: pd.DataFrame) -> pd.DataFrame:
+    """
+    Упакованные гипнограммы RLE для каждой ночи meta: колонки hypnogram_start, hypnogram_states
+    и hypnogram_durations (None для ночей без сегментов), индекс как у meta
+    """
+    seconds = pd.DataFrame({
+        'start': pd.DatetimeIndex(items['start_time']).as_unit('s').asi8,
+        'end': pd.DatetimeIndex(items['end_time']).as_unit('s').asi8,
+        'state': items['state'].to_numpy(dtype='int64'),
+    }, index=items.index).sort_values('start', kind='stable')
+
+    packed = {
+        night: SleepRecord.pack_hypnogram(group['start'].to_numpy(), group['end'].to_numpy(),
+                                          group['state'].to_numpy())
+        for night, group in seconds.groupby(level=0, sort=False)
+    }
+    empty = (None, None, None)
+    return pd.DataFrame(
+        [packed.get(night, empty) for night in meta.index],
+        columns=['hypnogram_start', 'hypnogram_states', 'hypnogram_durations'],
+        index=meta.index,
+    )
@@ -1,5 +1,16 @@
-from .calculate_sleep_statistic import chronotype_assessment, sleep_regularity, calculate_sleep_statistics_metrics, avg_sleep_duration, calculate_calories_burned, evaluate_bedtime, evaluate_wake_time, calculate_cycle_count, time_to_minutes
-from .plot_diagram import get_sleep_phases_pie_data, get_heart_rate_bell_curve_data, get_sleep_efficiency_trend, get_sleep_duration_trend
+from .calculate_sleep_statistic import chronotype_assessment, sleep_regularity, calculate_sleep_statistics_metrics, sleep_statistics_batch, avg_sleep_duration, calculate_calories_burned, evaluate_bedtime, evaluate_wake_time, calculate_cycle_count, sleep_cycle_counts, time_to_minutes, chronotype_from_midsleep, chronotype_from_history
+from .rolling import update_rolling_aggregates, ensure_rolling_aggregates, rolling_window, rolling_sleep_metrics, \
+    ROLLING_WINDOWS
+from .regularity import sleep_bitmaps, night_anchors, sleep_days, sleep_regularity_index, user_sleep_regularity_index, \
+    ensure_sleep_bitmaps
+from .hypnogram import hypnogram_frame
+from .heart_rate import stage_heart_rate_stats, stage_heart_rate_for_records, night_heart_rate_frame, STAGE_NAMES
+from .cohorts import QuantileSketch, age_band, cohort_values, counted_cohort_values, update_cohort_sketches, \
+    rebuild_cohort_sketches, cohort_percentile, user_cohort_benchmarks, COHORT_METRICS
+from .anomaly import StreamingBaseline, advance_sleep_baseline, reset_sleep_baseline, recent_sleep_anomalies, \
+    ANOMALY_METRICS
+from .plot_diagram import get_sleep_phases_pie_data, get_heart_rate_bell_curve_data, get_sleep_efficiency_trend, get_sleep_duration_trend, \
+    get_sleep_phases_trend
 from .num_to_str import interpret_chronotype
 from .gigachat import get_rec_to_prompt
 
@@ -7,14 +18,55 @@ __all__ = [
     'chronotype_assessment',
     'sleep_regularity',
     'calculate_sleep_statistics_metrics',
+    'sleep_statistics_batch',
     'avg_sleep_duration',
     'calculate_calories_burned',
     'evaluate_bedtime',
     'evaluate_wake_time',
     'calculate_cycle_count',
+    'sleep_cycle_counts',
     'time_to_minutes',
+    'chronotype_from_midsleep',
+    'chronotype_from_history',
+
+    'update_rolling_aggregates',
+    'ensure_rolling_aggregates',
+    'rolling_window',
+    'rolling_sleep_metrics',
+    'ROLLING_WINDOWS',
+
+    'sleep_bitmaps',
+    'night_anchors',
+    'sleep_days',
+    'sleep_regularity_index',
+    'user_sleep_regularity_index',
+    'ensure_sleep_bitmaps',
+
+    'hypnogram_frame',
+
+    'stage_heart_rate_stats',
+    'stage_heart_rate_for_records',
+    'night_heart_rate_frame',
+    'STAGE_NAMES',
+
+    'QuantileSketch',
+    'age_band',
+    'cohort_values',
+    'counted_cohort_values',
+    'update_cohort_sketches',
+    'rebuild_cohort_sketches',
+    'cohort_percentile',
+    'user_cohort_benchmarks',
+    'COHORT_METRICS',
+
+    'StreamingBaseline',
+    'advance_sleep_baseline',
+    'reset_sleep_baseline',
+    'recent_sleep_anomalies',
+    'ANOMALY_METRICS',
 
     'get_sleep_phases_pie_data',
+    'get_sleep_phases_trend',
 
     'get_heart_rate_bell_curve_data',
     'get_sleep_efficiency_trend',
@@ -0,0 +1,148 @@
+import math
+from datetime import timedelta
+from typing import List, Optional
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from ..models import SleepAnomaly, SleepBaseline, SleepStatistics
+
+# Метрики детектора: имя -> (поле SleepStatistics или записи сна, минимальный масштаб отклонения).
+# Минимальный масштаб не даёт почти постоянной метрике (например, 0 пробуждений) отмечать любую ночь
+ANOMALY_METRICS = {
+    'sleep_efficiency': ('sleep_efficiency', 2.0),
+    'latency_minutes': ('latency_minutes', 3.0),
+    'awake_count': ('record__awake_count', 0.5),
+    'avg_hr': ('record__avg_hr', 2.0),
+}
+
+# Вес новой ночи в сглаживании (эффективная память ~ 2 / alpha ночей)
+ANOMALY_ALPHA = 0.1
+# Порог робастного z-score для отметки ночи
+ANOMALY_THRESHOLD = 3.5
+# Сколько ночей копится базовая линия до первых отметок
+ANOMALY_WARMUP = 7
+
+# Для нормального распределения sigma = sqrt(pi / 2) * среднее абсолютное отклонение
+MAD_TO_SIGMA = math.sqrt(math.pi / 2)
+
+
+class StreamingBaseline:
+    """
+    Экспоненциально сглаженные среднее, дисперсия и среднее абсолютное отклонение одной метрики.
+    Каждое обновление — O(1) по времени и памяти. Отклонение оценивается робастным z-score
+    по абсолютному отклонению, а выбросы перед обновлением обрезаются до порога,
+    чтобы одна аномальная ночь не сдвигала базовую линию.
+    """
+
+    def __init__(self, n: int = 0, mean: float = 0.0, var: float = 0.0, mad: float = 0.0,
+                 min_scale: float = 0.0):
+        self.n = n
+        self.mean = mean
+        self.var = var
+        self.mad = mad
+        self.min_scale = min_scale
+
+    @classmethod
+    def from_dict(cls, state: Optional[dict], min_scale: float = 0.0) -> 'StreamingBaseline':
+        return cls(min_scale=min_scale, **(state or {}))
+
+    def to_dict(self) -> dict:
+        return {'n': self.n, 'mean': self.mean, 'var': self.var, 'mad': self.mad}
+
+    @property
+    def scale(self) -> float:
+        return max(MAD_TO_SIGMA * self.mad, self.min_scale)
+
+    def score(self, value: float) -> Optional[float]:
+        """Робастный z-score значения относительно текущей базовой линии или None до конца прогрева"""
+        if self.n < ANOMALY_WARMUP:
+            return None
+        return (value - self.mean) / self.scale
+
+    def update(self, value: float) -> None:
+        if self.n == 0:
+            self.n, self.mean = 1, float(value)
+            return
+
+        if self.n >= ANOMALY_WARMUP:
+            limit = ANOMALY_THRESHOLD * self.scale
+            value = min(max(value, self.mean - limit), self.mean + limit)
+
+        # Пока ночей мало, вес не меньше 1 / n — первые оценки совпадают с обычным средним
+        alpha = max(ANOMALY_ALPHA, 1 / (self.n + 1))
+        diff = value - self.mean
+        self.mean += alpha * diff
+        self.var = (1 - alpha) * (self.var + alpha * diff * diff)
+        self.mad = (1 - alpha) * self.mad + alpha * abs(diff)
+        self.n += 1
+
+
+def reset_sleep_baseline(user: User) -> None:
+    """Сбрасывает базовую линию и отметки пользователя (перед полной перезаписью истории)"""
+    SleepBaseline.objects.filter(user=user).delete()
+    SleepAnomaly.objects.filter(user=user).delete()
+
+
+def advance_sleep_baseline(user: User) -> int:
+    """
+    Продвигает базовую линию пользователя по ночам, записанным после last_night,
+    в хронологическом порядке и отмечает резкие отклонения.
+    Читаются только новые ночи; ночи раньше last_night, изменённые повторным импортом,
+    не пересчитываются до полного импорта. Возвращает количество найденных отклонений.
+    """
+    fields = [field for field, _ in ANOMALY_METRICS.values()]
+
+    with transaction.atomic():
+        baseline, _ = SleepBaseline.objects.select_for_update().get_or_create(user=user)
+        statistics = SleepStatistics.objects.filter(user=user, record__isnull=False)
+        if baseline.last_night is not None:
+            statistics = statistics.filter(record__sleep_date_time__gt=baseline.last_night)
+        rows = statistics.order_by('record__sleep_date_time').values_list(
+            'record_id', 'record__sleep_date_time', *fields
+        )
+
+        detectors = {
+            metric: StreamingBaseline.from_dict(baseline.state.get(metric), min_scale)
+            for metric, (_, min_scale) in ANOMALY_METRICS.items()
+        }
+        anomalies = []
+        for record_id, sleep_date_time, *values in rows:
+            for (metric, detector), value in zip(detectors.items(), values):
+                if value is None:
+                    continue
+                value = float(value)
+                score = detector.score(value)
+                if score is not None and abs(score) >= ANOMALY_THRESHOLD:
+                    anomalies.append(SleepAnomaly(
+                        user=user, record_id=record_id, metric=metric, value=value,
+                        baseline=round(detector.mean, 2), score=round(score, 2),
+                    ))
+                detector.update(value)
+            baseline.last_night = sleep_date_time
+
+        baseline.state = {metric: detector.to_dict() for metric, detector in detectors.items()}
+        baseline.save()
+        SleepAnomaly.objects.bulk_create(
+            anomalies,
+            update_conflicts=True,
+            unique_fields=['record', 'metric'],
+            update_fields=['value', 'baseline', 'score'],
+        )
+    return len(anomalies)
+
+
+def recent_sleep_anomalies(user: User, days: int = 14) -> List[SleepAnomaly]:
+    """
+    Отклонения за последние days дней до последней учтённой ночи, от новых к старым.
+    Читает только таблицу отметок, без пересчёта истории.
+    """
+    last_night = SleepBaseline.objects.filter(user=user).values_list('last_night', flat=True).first()
+    if last_night is None:
+        return []
+    return list(
+        SleepAnomaly.objects.filter(user=user, record__sleep_date_time__gt=last_night - timedelta(days=days))
+        .select_related('record')
+        .order_by('-record__sleep_date_time', 'metric')
+    )
+
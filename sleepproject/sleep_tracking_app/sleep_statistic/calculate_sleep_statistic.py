@@ -1,13 +1,22 @@
-from datetime import datetime, timedelta, time
+from datetime import date, datetime, timedelta, time, timezone as dt_timezone
+from typing import Dict, Optional
 import numpy as np
+import pandas as pd
+from django.db.models import Avg, Case, Count, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast, Coalesce, ExtractHour, ExtractIsoWeekDay, ExtractMinute, \
+    ExtractSecond, Least
 from ..models import SleepRecord, User
 from .num_to_str import interpret_chronotype
 
 
+def _bmr(gender: int, weight: float, height: int, age: np.float64) -> float:
+    # Расчёт BMR (Basal Metabolic Rate) по формуле Миффлина-Джеора, age в месяцах
+    return 10 * weight + 6.25 * height - 5 * age / 12 + 5 if gender else 10 * weight + 6.25 * height - 5 * age / 12 - 161
+
+
 def calculate_calories_burned(gender: int, weight: float, height: int, age: np.float64,
                               sleep_duration: int) -> float:
-    # Расчёт BMR (Basal Metabolic Rate) по формуле Миффлина-Джеора
-    bmr = 10 * weight + 6.25 * height - 5 * age / 12 + 5 if gender else 10 * weight + 6.25 * height - 5 * age / 12 - 161
+    bmr = _bmr(gender, weight, height, age)
 
     calories_burned = (bmr * (
             int(sleep_duration) / 60)) / 24  # round((bmr / 24 ) * 0.85 * float(sleep_duration / 60), 1)
@@ -57,6 +66,61 @@ def chronotype_assessment(sleep_records: list ) -> dict:
     sd_free = float(np.mean(np.array(free_durations))) if free_durations else 0
     sd_week = float(np.mean(np.array(all_durations))) if all_durations else 0
 
+    return chronotype_from_midsleep(msf, sd_free, sd_week)
+
+
+def chronotype_from_history(user: User, start: Optional[date] = None, end: Optional[date] = None) -> dict:
+    """
+    Хронотип по всей истории пользователя (или за период дат start..end включительно).
+    Разделение на выходные и будни и усреднение середины и длительности сна
+    выполняются одним агрегирующим SQL-запросом.
+    """
+    records = SleepRecord.objects.filter(user=user)
+    if start is not None:
+        records = records.filter(sleep_date_time__date__gte=start)
+    if end is not None:
+        records = records.filter(sleep_date_time__date__lte=end)
+
+    # Как evaluate_bedtime: более раннее из device_bedtime и bedtime (NULL не учитывается)
+    total_bedtime = Least(Coalesce('device_bedtime', 'bedtime'), Coalesce('bedtime', 'device_bedtime'))
+    duration_hours = Cast(Coalesce('duration', 0), FloatField()) / Value(60.0)
+    clock_hours = (
+            Cast(ExtractHour(total_bedtime, tzinfo=dt_timezone.utc), FloatField())
+            + Cast(ExtractMinute(total_bedtime, tzinfo=dt_timezone.utc), FloatField()) / Value(60.0)
+            + Cast(ExtractSecond(total_bedtime, tzinfo=dt_timezone.utc), FloatField()) / Value(3600.0)
+    )
+
+    records = records.filter(Q(device_bedtime__isnull=False) | Q(bedtime__isnull=False)).annotate(
+        duration_hours=duration_hours,
+        # Середина сна по часам суток: начало сна + половина длительности (не больше 12 ч, поэтому один перенос)
+        midpoint_raw=clock_hours + F('duration_hours') / Value(2.0),
+        midpoint=Case(
+            When(midpoint_raw__gte=24, then=F('midpoint_raw') - Value(24.0)),
+            default=F('midpoint_raw'),
+            output_field=FloatField(),
+        ),
+        iso_weekday=ExtractIsoWeekDay(total_bedtime, tzinfo=dt_timezone.utc),
+    )
+
+    free_days = Q(iso_weekday__gte=6)
+    result = records.aggregate(
+        free_nights=Count('id', filter=free_days),
+        msf=Avg('midpoint', filter=free_days),
+        sd_free=Avg('duration_hours', filter=free_days),
+        sd_week=Avg('duration_hours'),
+    )
+
+    if not result['free_nights']:
+        return {}
+
+    return chronotype_from_midsleep(result['msf'], result['sd_free'] or 0, result['sd_week'] or 0)
+
+
+def chronotype_from_midsleep(msf: float, sd_free: float, sd_week: float) -> dict:
+    """
+    Интерпретирует хронотип по средней середине сна в выходные msf (часы)
+    и средней длительности сна в выходные sd_free и за все дни sd_week (часы).
+    """
     msf_sc = msf - 0.5 * (sd_free - sd_week)
     msf_sc_hours = int(msf_sc)
     msf_sc_minutes = int((msf_sc % 1) * 60)
@@ -78,6 +142,38 @@ def chronotype_assessment(sleep_records: list ) -> dict:
     return interpret_str
 
 
+def sleep_cycle_counts(nights, states, durations_min) -> pd.Series:
+    """
+    Количество завершённых циклов сна для каждой ночи за один векторный проход.
+    nights, states, durations_min — массивы сегментов одинаковой длины, отсортированные по времени внутри ночи.
+    Цикл — отрезок между пробуждениями (или концом ночи) длиной не менее 90 минут сна,
+    в котором есть и глубокий сон, и REM. Возвращает Series {ночь: количество циклов}.
+    """
+    segments = pd.DataFrame({
+        'night': pd.Index(nights),
+        'state': np.asarray(states, dtype='int64'),
+        'duration': np.asarray(durations_min, dtype='float64'),
+    })
+    if segments.empty:
+        return pd.Series(dtype='int64')
+
+    state = segments['state'].to_numpy()
+    is_sleep = np.isin(state, (2, 3, 4))  # Light, Deep, REM
+    # Каждое пробуждение открывает новый отрезок; ключ (ночь, отрезок) не смешивает ночи
+    segments['block'] = np.cumsum(state == 5)
+    segments['sleep'] = np.where(is_sleep, segments['duration'].to_numpy(), 0.0)
+    segments['deep'] = state == 3
+    segments['rem'] = state == 4
+
+    blocks = segments.groupby(['night', 'block'], sort=False).agg(
+        sleep=('sleep', 'sum'), deep=('deep', 'any'), rem=('rem', 'any'),
+    )
+    complete = (blocks['sleep'] >= 90) & blocks['deep'] & blocks['rem']
+
+    nights_order = pd.unique(segments['night'])
+    return complete.groupby(level='night', sort=False).sum().reindex(nights_order, fill_value=0).astype('int64')
+
+
 def calculate_cycle_count(sleep_data: SleepRecord) -> int:
     """
     Количество циклов сна в последней записи сна пользователя.
@@ -85,28 +181,14 @@ def calculate_cycle_count(sleep_data: SleepRecord) -> int:
     1 цикл = 90 минут (минимум) + глубокий сон + REM
     Если цикл не завершён, то он не учитывается.
     """
+    # Гипнограмма читается из упакованных полей записи, без запроса сегментов
+    starts, ends, states = sleep_data.hypnogram()
+    if not len(states):
+        return 0
 
-    # Находим последнюю запись сна для пользователя
-    segments = sleep_data.segments.order_by('start_time')
-    cycle_count = 0
-    current_cycle_duration = 0
-    has_deep = False
-    has_rem = False
-    for i, seg in enumerate(segments):
-        duration_min = (seg['end_time'] - seg['start_time']).total_seconds() / 60
-        if seg['state'] in [2, 3, 4]:  # Light, Deep, REM
-            current_cycle_duration += duration_min
-            if seg['state'] == 3:
-                has_deep = True
-            if seg['state'] == 4:
-                has_rem = True
-        if seg['state'] == 5 or i == len(segments) - 1:  # Awake or end
-            if current_cycle_duration >= 90 and has_deep and has_rem:
-                cycle_count += 1
-            current_cycle_duration = 0
-            has_deep = False
-            has_rem = False
-    return cycle_count
+    durations = (ends - starts).astype('int64') / 60
+    counts = sleep_cycle_counts(np.zeros(len(states), dtype='int64'), states.astype('int64'), durations)
+    return int(counts.iloc[0])
 
 
 def time_to_minutes(dt, ref_hour=20):
@@ -142,60 +224,108 @@ def sleep_regularity(sleep_records: list ) -> dict:
 
 
 
-def calculate_sleep_statistics_metrics(sleep_data: SleepRecord, age: np.float64, gender: int, weight: float,
-                                       height: int) -> dict:
+def _epoch_seconds(values) -> np.ndarray:
+    """Время (datetime, datetime64 или pandas) -> секунды Unix в float64, пропуски -> NaN"""
+    index = pd.DatetimeIndex(pd.to_datetime(values, utc=True))
+    seconds = index.asi8.astype('float64') / 1e9
+    seconds[index.isna()] = np.nan
+    return seconds
+
+
+def _minutes_array(values) -> np.ndarray:
+    return np.nan_to_num(np.asarray(values, dtype='float64'))
+
+
+def sleep_statistics_batch(bedtime, device_bedtime, wake_up_time, device_wake_up_time, first_segment_start,
+                           duration, sleep_deep_duration, sleep_light_duration, sleep_rem_duration,
+                           sleep_awake_duration, awake_count, age: np.float64, gender: int, weight: float,
+                           height: int) -> Dict[str, np.ndarray]:
     """
-    Вычисляет основные метрики сна на основе последней записи сна пользователя.
-    Возвращает словарь с метриками:
-    - latency_minutes: Латентность сна в минутах
-    - sleep_efficiency: Эффективность сна в процентах
-    - sleep_phases: Процент каждой фазы сна (глубокий, легкий, REM, бодрствование)
-    - sleep_fragmentation_index: Индекс фрагментации сна
-    - sleep_calories_burned: Сожжённые калории во время сна (на основе BMR)
+    Вычисляет метрики сна сразу для N ночей. Все аргументы, кроме профиля пользователя,
+    — массивы длины N (numpy, pandas или списки): время — datetime, длительности — минуты.
+    Возвращает словарь массивов с теми же ключами, что calculate_sleep_statistics_metrics;
+    sleep_phases — словарь массивов по фазам.
     """
-    if not sleep_data:
-        return {}
+    bedtime_s = np.fmin(_epoch_seconds(device_bedtime), _epoch_seconds(bedtime))
+    wake_time_s = np.fmax(_epoch_seconds(device_wake_up_time), _epoch_seconds(wake_up_time))
 
-    total_bedtime = evaluate_bedtime(sleep_data)
-    total_wake_time = evaluate_wake_time(sleep_data)
+    # Латентность сна в минутах: от отхода ко сну до первого сегмента
+    latency_minutes = np.nan_to_num((_epoch_seconds(first_segment_start) - bedtime_s) / 60)
 
-    # Латентность сна в минутах
-    latency_delta = sleep_data.segments.order_by('start_time').values_list('start_time',
-                                                                           flat=True).first() - total_bedtime
-    latency_minutes = latency_delta.total_seconds() / 60 if latency_delta else 0
+    duration = _minutes_array(duration)
+    awake = _minutes_array(sleep_awake_duration)
+    has_sleep = duration > 0
+    zeros = np.zeros_like(duration)
 
     # Эффективность сна
-    total_time_in_bed_min = (total_wake_time - total_bedtime).total_seconds() / 60
-    sleep_efficiency = sleep_data.duration * 100 / total_time_in_bed_min if total_time_in_bed_min else 0
+    time_in_bed_min = np.nan_to_num((wake_time_s - bedtime_s) / 60)
+    sleep_efficiency = np.divide(duration * 100, time_in_bed_min, out=zeros.copy(), where=time_in_bed_min != 0)
 
     # Процент каждой фазы сна
+    phase_minutes = {'deep': sleep_deep_duration, 'light': sleep_light_duration, 'rem': sleep_rem_duration,
+                     'awake': awake}
     sleep_phases = {
-        'deep': sleep_data.sleep_deep_duration / (
-                sleep_data.duration + sleep_data.sleep_awake_duration) * 100 if sleep_data.duration else 0,
-        'light': sleep_data.sleep_light_duration / (
-                sleep_data.duration + sleep_data.sleep_awake_duration) * 100 if sleep_data.duration else 0,
-        'rem': sleep_data.sleep_rem_duration / (
-                sleep_data.duration + sleep_data.sleep_awake_duration) * 100 if sleep_data.duration else 0,
-        'awake': sleep_data.sleep_awake_duration / (
-                sleep_data.duration + sleep_data.sleep_awake_duration) * 100 if sleep_data.duration else 0,
+        phase: np.divide(_minutes_array(minutes) * 100, duration + awake, out=zeros.copy(), where=has_sleep)
+        for phase, minutes in phase_minutes.items()
     }
 
     # Индекс фрагментации сна
-    interpret_fragmentation = (sleep_data.awake_count / (sleep_data.duration / 60)) if sleep_data.duration else 0
+    fragmentation = np.divide(_minutes_array(awake_count), duration / 60, out=zeros.copy(), where=has_sleep)
 
     # Сожжённые калории во время сна (на основе BMR)
-    sleep_calories_burned = calculate_calories_burned(gender=gender, weight=weight, height=height, age=age,
-                                                      sleep_duration=sleep_data.duration)
+    sleep_calories_burned = np.round(_bmr(gender, weight, height, age) * np.trunc(duration) / 60 / 24, 1)
 
     return {
         'latency_minutes': latency_minutes,
         'sleep_efficiency': sleep_efficiency,
         'sleep_phases': sleep_phases,
-        'sleep_fragmentation_index': interpret_fragmentation,
+        'sleep_fragmentation_index': fragmentation,
         'sleep_calories_burned': sleep_calories_burned,
     }
 
 
+def calculate_sleep_statistics_metrics(sleep_data: SleepRecord, age: np.float64, gender: int, weight: float,
+                                       height: int) -> dict:
+    """
+    Вычисляет основные метрики сна на основе последней записи сна пользователя.
+    Обёртка над sleep_statistics_batch для одной записи.
+    Возвращает словарь с метриками:
+    - latency_minutes: Латентность сна в минутах
+    - sleep_efficiency: Эффективность сна в процентах
+    - sleep_phases: Процент каждой фазы сна (глубокий, легкий, REM, бодрствование)
+    - sleep_fragmentation_index: Индекс фрагментации сна
+    - sleep_calories_burned: Сожжённые калории во время сна (на основе BMR)
+    """
+    if not sleep_data:
+        return {}
+
+    starts, _, _ = sleep_data.hypnogram()
+    first_segment_start = starts[0] if len(starts) else None
+
+    metrics = sleep_statistics_batch(
+        bedtime=[sleep_data.bedtime],
+        device_bedtime=[sleep_data.device_bedtime],
+        wake_up_time=[sleep_data.wake_up_time],
+        device_wake_up_time=[sleep_data.device_wake_up_time],
+        first_segment_start=[first_segment_start],
+        duration=[sleep_data.duration],
+        sleep_deep_duration=[sleep_data.sleep_deep_duration],
+        sleep_light_duration=[sleep_data.sleep_light_duration],
+        sleep_rem_duration=[sleep_data.sleep_rem_duration],
+        sleep_awake_duration=[sleep_data.sleep_awake_duration],
+        awake_count=[sleep_data.awake_count],
+        age=age, gender=gender, weight=weight, height=height,
+    )
+
+    return {
+        'latency_minutes': float(metrics['latency_minutes'][0]),
+        'sleep_efficiency': float(metrics['sleep_efficiency'][0]),
+        'sleep_phases': {phase: float(values[0]) for phase, values in metrics['sleep_phases'].items()},
+        'sleep_fragmentation_index': float(metrics['sleep_fragmentation_index'][0]),
+        'sleep_calories_burned': float(metrics['sleep_calories_burned'][0]),
+    }
+
+
 def avg_sleep_duration(items: list):
     """
     Средняя продолжительность сна за последние N дней.
@@ -0,0 +1,260 @@
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from django.db import transaction
+from django.db.models import QuerySet
+
+from ..models import CohortSketch, SleepStatistics, UserData
+
+# Относительная точность квантилей скетча (1%)
+SKETCH_ACCURACY = 0.01
+
+# Метрики когорт: имя метрики -> поле SleepStatistics (длительность берётся из записи сна)
+COHORT_METRICS = {
+    'sleep_efficiency': 'sleep_efficiency',
+    'duration': 'record__duration',
+    'latency_minutes': 'latency_minutes',
+    'sleep_fragmentation_index': 'sleep_fragmentation_index',
+    'deep_percent': 'deep_percent',
+    'rem_percent': 'rem_percent',
+}
+
+# Верхние границы возрастных групп (лет, не включая) и их названия
+AGE_BANDS = [
+    (18, '0-17'),
+    (25, '18-24'),
+    (35, '25-34'),
+    (45, '35-44'),
+    (55, '45-54'),
+    (65, '55-64'),
+    (None, '65+'),
+]
+
+
+class QuantileSketch:
+    """
+    Скетч с логарифмическими корзинами: значение x > 0 попадает в корзину ceil(log_gamma(x)),
+    где gamma = (1 + a) / (1 - a), и восстанавливается с относительной ошибкой не больше a.
+    Значения <= 0 учитываются отдельно как нули. Скетчи складываются и вычитаются покорзинно.
+    """
+
+    def __init__(self, accuracy: float = SKETCH_ACCURACY, buckets: Dict[int, int] = None, zero_count: int = 0):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = dict(buckets or {})
+        self.zero_count = zero_count
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.buckets.values())
+
+    def _index(self, values: np.ndarray) -> np.ndarray:
+        return np.ceil(np.log(values) / self.log_gamma).astype('int64')
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def update(self, values, weight: int = 1) -> None:
+        """Добавляет (weight=1) или вычитает (weight=-1) значения; NaN и None пропускаются"""
+        values = np.asarray([v for v in values if v is not None], dtype='float64')
+        values = values[~np.isnan(values)]
+
+        self.zero_count = max(self.zero_count + weight * int((values <= 0).sum()), 0)
+        indexes, counts = np.unique(self._index(values[values > 0]), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            total = self.buckets.get(index, 0) + weight * count
+            if total > 0:
+                self.buckets[index] = total
+            else:
+                self.buckets.pop(index, None)
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Значение квантиля q (0..1) или None для пустого скетча"""
+        total = self.count
+        if not total:
+            return None
+
+        rank = q * (total - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.buckets))
+
+    def rank(self, value: float) -> Optional[float]:
+        """Доля значений, не превышающих value (0..1), или None для пустого скетча"""
+        total = self.count
+        if not total:
+            return None
+        if value <= 0:
+            return self.zero_count / total
+
+        index = int(self._index(np.array([value]))[0])
+        below = self.zero_count + sum(count for i, count in self.buckets.items() if i <= index)
+        return below / total
+
+
+def age_band(user_data: UserData) -> str:
+    """Возрастная группа пользователя по UserData"""
+    years = user_data.get_age_months() / 12
+    for upper, name in AGE_BANDS:
+        if upper is None or years < upper:
+            return name
+    return AGE_BANDS[-1][1]
+
+
+def cohort_values(statistics: QuerySet) -> Dict[str, list]:
+    """Значения метрик когорт из выборки SleepStatistics одним запросом"""
+    rows = list(statistics.values_list(*COHORT_METRICS.values()))
+    return {metric: [row[i] for row in rows] for i, metric in enumerate(COHORT_METRICS)}
+
+
+def _load(row: CohortSketch) -> QuantileSketch:
+    return QuantileSketch(buckets={int(index): count for index, count in row.buckets.items()},
+                          zero_count=row.zero_count)
+
+
+def counted_cohort_values(statistics: QuerySet, user_data: UserData) -> Dict[Tuple[str, int], Dict[str, list]]:
+    """
+    Значения метрик когорт из выборки SleepStatistics, сгруппированные по когорте, в скетчи которой они учтены.
+    Строки без сохранённой когорты (учтённые до её появления) относятся к текущей когорте пользователя.
+    """
+    current = (age_band(user_data), user_data.gender)
+    rows = statistics.values_list('cohort_age_band', 'cohort_gender', *COHORT_METRICS.values())
+
+    grouped: Dict[Tuple[str, int], Dict[str, list]] = {}
+    for band, gender, *values in rows:
+        key = (band, gender) if band is not None and gender is not None else current
+        metrics = grouped.setdefault(key, {metric: [] for metric in COHORT_METRICS})
+        for metric, value in zip(COHORT_METRICS, values):
+            metrics[metric].append(value)
+    return grouped
+
+
+def _update_sketch_rows(band: str, gender: int, added: Dict[str, list], removed: Dict[str, list]) -> None:
+    for metric in COHORT_METRICS:
+        if not added.get(metric) and not removed.get(metric):
+            continue
+
+        row, _ = CohortSketch.objects.select_for_update().get_or_create(age_band=band, gender=gender, metric=metric)
+        sketch = _load(row)
+        sketch.update(removed.get(metric, []), weight=-1)
+        sketch.update(added.get(metric, []))
+
+        row.buckets = {str(index): count for index, count in sketch.buckets.items()}
+        row.zero_count = sketch.zero_count
+        row.count = sketch.count
+        row.save(update_fields=['buckets', 'zero_count', 'count'])
+
+
+def update_cohort_sketches(user_data: UserData, added: QuerySet = None,
+                           removed: Dict[Tuple[str, int], Dict[str, list]] = None) -> None:
+    """
+    Добавляет в скетчи текущей когорты пользователя метрики статистики added и отмечает на ней эту когорту;
+    вычитает заменённые значения removed (из counted_cohort_values, снятые до замены) из тех когорт,
+    в которых они были учтены, — после смены возрастной группы или пола скетчи не расходятся.
+    Строки скетчей блокируются на время обновления, чтобы параллельные импорты не теряли изменения.
+    """
+    current = (age_band(user_data), user_data.gender)
+    removed = dict(removed or {})
+
+    with transaction.atomic():
+        if added is not None:
+            _update_sketch_rows(*current, cohort_values(added), removed.pop(current, {}))
+            added.update(cohort_age_band=current[0], cohort_gender=current[1])
+        for (band, gender), values in removed.items():
+            _update_sketch_rows(band, gender, {}, values)
+
+
+def rebuild_cohort_sketches(chunk_size: int = 10_000) -> int:
+    """
+    Строит все скетчи заново одним потоковым проходом по SleepStatistics по текущим когортам пользователей
+    (для первичного заполнения и после ручных правок данных) и сохраняет эти когорты в статистике.
+    Возвращает количество строк скетчей.
+    """
+    columns = ['user_id', 'user__user_data__date_of_birth', 'user__user_data__gender'] + \
+        list(COHORT_METRICS.values())
+    rows = SleepStatistics.objects.filter(user__user_data__isnull=False).values_list(*columns) \
+        .iterator(chunk_size=chunk_size)
+
+    sketches: Dict[tuple, QuantileSketch] = {}
+    pending: Dict[tuple, list] = {}
+    bands: Dict = {}
+    # Пользователи по когортам, в которые учтены их ночи: когорта сохраняется в статистике
+    cohort_users: Dict[tuple, set] = {}
+
+    def flush():
+        for key, values in pending.items():
+            sketches.setdefault(key, QuantileSketch()).update(values)
+        pending.clear()
+
+    for n, (user_id, date_of_birth, gender, *values) in enumerate(rows, start=1):
+        if date_of_birth not in bands:
+            bands[date_of_birth] = age_band(UserData(date_of_birth=date_of_birth))
+        cohort_users.setdefault((bands[date_of_birth], gender), set()).add(user_id)
+        for metric, value in zip(COHORT_METRICS, values):
+            pending.setdefault((bands[date_of_birth], gender, metric), []).append(value)
+        if n % chunk_size == 0:
+            flush()
+    flush()
+
+    with transaction.atomic():
+        CohortSketch.objects.all().delete()
+        CohortSketch.objects.bulk_create([
+            CohortSketch(age_band=band, gender=gender, metric=metric, count=sketch.count,
+                         zero_count=sketch.zero_count,
+                         buckets={str(index): count for index, count in sketch.buckets.items()})
+            for (band, gender, metric), sketch in sketches.items()
+        ])
+        for (band, gender), user_ids in cohort_users.items():
+            user_ids = sorted(user_ids)
+            for start in range(0, len(user_ids), chunk_size):
+                SleepStatistics.objects.filter(user_id__in=user_ids[start:start + chunk_size]) \
+                    .update(cohort_age_band=band, cohort_gender=gender)
+    return len(sketches)
+
+
+def cohort_percentile(user_data: UserData, metric: str, value: float) -> Optional[float]:
+    """Перцентиль (0..100) значения метрики среди когорты пользователя или None, если данных нет"""
+    if value is None:
+        return None
+    row = CohortSketch.objects.filter(age_band=age_band(user_data), gender=user_data.gender, metric=metric).first()
+    if row is None:
+        return None
+    rank = _load(row).rank(value)
+    return round(rank * 100, 1) if rank is not None else None
+
+
+def user_cohort_benchmarks(user_data: UserData, statistics: SleepStatistics) -> Dict[str, dict]:
+    """
+    Сравнение последней статистики пользователя с когортой: значение, перцентиль и медиана когорты.
+    Читает только строки скетчей когорты (по одной на метрику).
+    """
+    if statistics is None:
+        return {}
+
+    values = cohort_values(SleepStatistics.objects.filter(pk=statistics.pk))
+    rows = {row.metric: row for row in CohortSketch.objects.filter(age_band=age_band(user_data),
+                                                                    gender=user_data.gender)}
+    benchmarks = {}
+    for metric in COHORT_METRICS:
+        value = values[metric][0] if values[metric] else None
+        row = rows.get(metric)
+        if value is None or row is None or not row.count:
+            continue
+        sketch = _load(row)
+        benchmarks[metric] = {
+            'value': round(float(value), 2),
+            'percentile': round(sketch.rank(value) * 100, 1),
+            'median': round(sketch.quantile(0.5), 2),
+        }
+    return benchmarks
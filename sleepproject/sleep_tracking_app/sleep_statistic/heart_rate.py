@@ -0,0 +1,120 @@
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..csv_data_extraction import assign_night_records
+from ..models import NightHeartRateEntry, NightHeartRateSeries, NightHeartRateAggregate
+from .hypnogram import hypnogram_frame
+
+# Названия стадий сна по коду состояния сегмента
+STAGE_NAMES = {
+    2: 'light',
+    3: 'deep',
+    4: 'rem',
+    5: 'awake',
+}
+
+
+def stage_heart_rate_stats(segment_nights, starts, ends, states, hr_times, bpm) -> Dict:
+    """
+    Пульс по стадиям сна для каждой ночи: среднее, минимум, максимум и снижение (dip, %)
+    среднего пульса стадии относительно среднего пульса за все сегменты ночи.
+    Замеры сопоставляются сегментам одним интервальным соединением (searchsorted по началам
+    сегментов), без запросов на сегмент. Возвращает {ночь: {стадия: {'mean', 'min', 'max', 'dip'}}};
+    ночи без замеров внутри сегментов в результат не попадают.
+    """
+    segments = pd.DataFrame({
+        'night': pd.Index(segment_nights),
+        'start': pd.to_datetime(pd.Index(starts), utc=True),
+        'end': pd.to_datetime(pd.Index(ends), utc=True),
+        'state': np.asarray(states, dtype='int64'),
+    })
+    # Сегменты нулевой или отрицательной длины assign_night_records посчитал бы переходящими через сутки
+    segments = segments[segments['end'] > segments['start']].reset_index(drop=True)
+
+    hr_index = pd.DatetimeIndex(pd.to_datetime(pd.Index(hr_times), utc=True))
+    position = assign_night_records(hr_index, segments)
+    inside = position >= 0
+    if not inside.any():
+        return {}
+
+    matched = segments.iloc[position[inside]]
+    samples = pd.DataFrame({
+        'night': matched['night'].to_numpy(),
+        'state': matched['state'].to_numpy(),
+        'bpm': np.asarray(bpm, dtype='float64')[inside],
+    })
+
+    per_stage = samples.groupby(['night', 'state'])['bpm'].agg(['mean', 'min', 'max'])
+    night_mean = samples.groupby('night')['bpm'].mean()
+    reference = night_mean.reindex(per_stage.index.get_level_values('night')).to_numpy()
+    per_stage['dip'] = (reference - per_stage['mean'].to_numpy()) / reference * 100
+
+    result: Dict = {}
+    for (night, state), row in per_stage.iterrows():
+        result.setdefault(night, {})[STAGE_NAMES.get(state, str(state))] = {
+            'mean': round(float(row['mean']), 1),
+            'min': int(row['min']),
+            'max': int(row['max']),
+            'dip': round(float(row['dip']), 1),
+        }
+    return result
+
+
+def night_heart_rate_frame(record_ids: Iterable[int], time_range: Optional[Tuple[datetime, datetime]] = None) \
+        -> pd.DataFrame:
+    """
+    Ночной пульс записей одним DataFrame (record_id, time UTC, bpm).
+    Упакованные ряды читаются по строке на ночь; ночи старше срока хранения замеров дают средние
+    по интервалам огрублённого ряда; строки замеров — только для записей без ряда.
+    time_range (SleepRecord.heart_rate_time_range) ограничивает чтение строк замеров нужными помесячными секциями.
+    """
+    record_ids = set(record_ids)
+    series_rows = NightHeartRateSeries.objects.filter(record_id__in=record_ids)
+    entry_rows = NightHeartRateEntry.objects.all()
+    if time_range is not None:
+        entry_rows = entry_rows.filter(time__range=time_range)
+
+    ids = [np.array([], dtype='int64')]
+    times = [np.array([], dtype='datetime64[s]')]
+    bpm = [np.array([], dtype='int64')]
+    for series in series_rows:
+        series_times, series_bpm = series.arrays()
+        ids.append(np.full(len(series_times), series.record_id, dtype='int64'))
+        times.append(series_times)
+        bpm.append(series_bpm.astype('int64'))
+        record_ids.discard(series.record_id)
+
+    for aggregate in NightHeartRateAggregate.objects.filter(record_id__in=record_ids):
+        aggregate_times, aggregate_bpm = aggregate.arrays()
+        ids.append(np.full(len(aggregate_times), aggregate.record_id, dtype='int64'))
+        times.append(aggregate_times)
+        bpm.append(aggregate_bpm.astype('int64'))
+        record_ids.discard(aggregate.record_id)
+
+    packed = pd.DataFrame({
+        'record_id': np.concatenate(ids),
+        'time': pd.to_datetime(np.concatenate(times).astype('datetime64[ns]'), utc=True),
+        'bpm': np.concatenate(bpm),
+    })
+    if not record_ids:
+        return packed
+
+    rows = pd.DataFrame.from_records(
+        entry_rows.filter(record_id__in=record_ids).order_by('record_id', 'time')
+        .values_list('record_id', 'time', 'bpm'),
+        columns=['record_id', 'time', 'bpm'],
+    )
+    rows = rows.astype({'record_id': 'int64', 'bpm': 'int64'}).assign(time=pd.to_datetime(rows['time'], utc=True))
+    return pd.concat([packed, rows], ignore_index=True) if not packed.empty else rows
+
+
+def stage_heart_rate_for_records(record_ids: Iterable[int]) -> Dict[int, Dict]:
+    """Пульс по стадиям для сохранённых записей: гипнограммы и пульс читаются по строке на ночь"""
+    record_ids = list(record_ids)
+    segments = hypnogram_frame(record_ids)
+    heart_rate = night_heart_rate_frame(record_ids)
+    return stage_heart_rate_stats(segments['record_id'], segments['start_time'], segments['end_time'],
+                                  segments['state'], heart_rate['time'], heart_rate['bpm'])
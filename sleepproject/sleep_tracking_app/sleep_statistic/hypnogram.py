@@ -0,0 +1,52 @@
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from ..models import SleepRecord, SleepSegment
+
+HYPNOGRAM_COLUMNS = ['record_id', 'start_time', 'end_time', 'state']
+
+
+def hypnogram_frame(record_ids: Iterable[int]) -> pd.DataFrame:
+    """
+    Гипнограммы записей одним DataFrame (record_id, start_time UTC, end_time UTC, state) в порядке времени.
+    Упакованные гипнограммы читаются одним запросом к SleepRecord без join;
+    сегменты сна — только для записей, импортированных до появления упаковки.
+    """
+    record_ids = set(record_ids)
+    ids = [np.array([], dtype='int64')]
+    starts = [np.array([], dtype='datetime64[s]')]
+    ends = [np.array([], dtype='datetime64[s]')]
+    states = [np.array([], dtype='uint8')]
+    packed = SleepRecord.objects.filter(pk__in=record_ids, hypnogram_start__isnull=False).values_list(
+        'pk', 'hypnogram_start', 'hypnogram_states', 'hypnogram_durations'
+    )
+    for record_id, start, record_states, record_durations in packed:
+        record_starts, record_ends, record_stages = SleepRecord.unpack_hypnogram(start, record_states,
+                                                                                 record_durations)
+        ids.append(np.full(len(record_stages), record_id, dtype='int64'))
+        starts.append(record_starts)
+        ends.append(record_ends)
+        states.append(record_stages)
+        record_ids.discard(record_id)
+
+    frame = pd.DataFrame({
+        'record_id': np.concatenate(ids),
+        'start_time': pd.to_datetime(np.concatenate(starts).astype('datetime64[ns]'), utc=True),
+        'end_time': pd.to_datetime(np.concatenate(ends).astype('datetime64[ns]'), utc=True),
+        'state': np.concatenate(states).astype('int64'),
+    })
+    if not record_ids:
+        return frame
+
+    rows = pd.DataFrame.from_records(
+        SleepSegment.objects.filter(record_id__in=record_ids).order_by('record_id', 'start_time')
+        .values_list(*HYPNOGRAM_COLUMNS),
+        columns=HYPNOGRAM_COLUMNS,
+    )
+    rows = rows.astype({'record_id': 'int64', 'state': 'int64'}).assign(
+        start_time=pd.to_datetime(rows['start_time'], utc=True),
+        end_time=pd.to_datetime(rows['end_time'], utc=True),
+    )
+    return pd.concat([frame, rows], ignore_index=True) if not frame.empty else rows
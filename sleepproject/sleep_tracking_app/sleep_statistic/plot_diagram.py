@@ -1,4 +1,10 @@
-from django.db.models import QuerySet
+from datetime import timedelta
+
+import pandas as pd
+
+from django.contrib.auth.models import User
+from django.db.models import QuerySet, Avg
+from django.db.models.functions import TruncWeek
 
 from sleep_tracking_app.models import SleepRecord, SleepStatistics
 from math import log
@@ -12,7 +18,8 @@ def get_sleep_phases_pie_data(stat: [SleepStatistics]) -> list:
     if not stat:
         return []
 
-    phases = stat.sleep_phases
+    # Проценты читаются из отдельных колонок; JSON sleep_phases — только для строк до их появления
+    phases = stat.phase_percentages()
 
     def point(name, key):
         val = round(phases.get(key, 0), 2)
@@ -42,13 +49,14 @@ def get_heart_rate_bell_curve_data(latest_sleep: SleepRecord) -> dict:
     if not latest_sleep:
         return {'date': [], 'bpm': []}
 
-    hr_entries = list(latest_sleep.night_hr_entries.all())
+    # Одна строка упакованного ряда вместо строки на каждый замер
+    times, bpm = latest_sleep.night_heart_rate()
 
-    if not hr_entries:
+    if not len(times):
         return {'date': [], 'bpm': []}
 
-    date = [e.time.strftime('%H:%M') for e in hr_entries]
-    bpm = [e.bpm for e in hr_entries]
+    date = pd.DatetimeIndex(times).strftime('%H:%M').tolist()
+    bpm = bpm.tolist()
 
     return {'date': date, 'bpm': bpm}
 
@@ -107,3 +115,34 @@ def get_sleep_efficiency_trend(items: list) -> dict:
         "sleep_calories_burned": calories_list,
     }
     return graph_data_dict
+
+
+def get_sleep_phases_trend(user: User, weeks: int = 12) -> dict:
+    """
+    Тренд фаз сна: средний процент каждой фазы по неделям за последние weeks недель
+    до последней статистики пользователя. Средние считаются одним агрегирующим запросом
+    по колонкам процентов, без чтения JSON; ночи без этих колонок не учитываются.
+    Возвращает пустой словарь, если статистики нет.
+    """
+    # Колонки фаз записываются вместе, поэтому у недель в выборке нет пустых средних
+    statistics = SleepStatistics.objects.filter(user=user, deep_percent__isnull=False)
+    last_date = statistics.order_by('-date').values_list('date', flat=True).first()
+    if last_date is None:
+        return {}
+
+    fields = SleepStatistics.PHASE_FIELDS
+    rows = (
+        statistics.filter(date__gt=last_date - timedelta(weeks=weeks))
+        .annotate(week=TruncWeek('date'))
+        .values('week')
+        .annotate(**{phase: Avg(field) for phase, field in fields.items()})
+        .order_by('week')
+    )
+
+    trend = {'weeks': []}
+    trend.update({phase: [] for phase in fields})
+    for row in rows:
+        trend['weeks'].append(row['week'].isoformat())
+        for phase in fields:
+            trend[phase].append(round(row[phase], 2))
+    return trend
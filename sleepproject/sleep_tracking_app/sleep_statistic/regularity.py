@@ -0,0 +1,173 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+
+from ..models import SleepRecord
+from .hypnogram import hypnogram_frame
+
+MINUTES_PER_DAY = 1440
+# Окно карты ночи — двое суток UTC: ночь в любом часовом поясе помещается в него целиком
+NIGHT_WINDOW_MINUTES = 2 * MINUTES_PER_DAY
+BITMAP_BYTES = NIGHT_WINDOW_MINUTES // 8
+
+# Состояния сегментов, которые считаются сном (Light, Deep, REM)
+SLEEP_STATES = (2, 3, 4)
+
+# Количество единичных битов в каждом значении байта
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+# Полуширина окна сглаживания (минуты), по которому выбирается граница суток пользователя
+DAY_BOUNDARY_SMOOTHING = 6 * 60
+
+
+def night_anchors(sleep_times) -> pd.DatetimeIndex:
+    """
+    Начало окна карты ночи: полночь UTC накануне дня, которым закончилась запись.
+    Окно в двое суток не обрезает ночь ни в одном часовом поясе (от UTC-12 до UTC+14).
+    """
+    times = pd.DatetimeIndex(pd.to_datetime(sleep_times, utc=True))
+    return times.normalize() - pd.Timedelta(days=1)
+
+
+def sleep_bitmaps(anchors: pd.DatetimeIndex, segment_nights, starts, ends, states) -> np.ndarray:
+    """
+    Строит для каждой ночи битовую карту окна по минутам (1 — сон, 0 — бодрствование или нет данных).
+    anchors — начала окон ночей; segment_nights — позиция ночи (0..N-1) для каждого сегмента.
+    Возвращает упакованный массив uint8 формы (N, BITMAP_BYTES).
+    """
+    nights = len(anchors)
+    night = np.asarray(segment_nights, dtype='int64')
+    sleep = np.isin(np.asarray(states, dtype='int64'), SLEEP_STATES) & (night >= 0)
+    night = night[sleep]
+
+    anchor_ns = anchors.asi8[night]
+    start = pd.DatetimeIndex(pd.to_datetime(starts, utc=True)).asi8[sleep]
+    end = pd.DatetimeIndex(pd.to_datetime(ends, utc=True)).asi8[sleep]
+    ns_per_minute = 60 * 10 ** 9
+    start_min = np.clip((start - anchor_ns) // ns_per_minute, 0, NIGHT_WINDOW_MINUTES)
+    end_min = np.clip((end - anchor_ns) // ns_per_minute, 0, NIGHT_WINDOW_MINUTES)
+
+    # Разностный массив: +1 в начале сегмента, -1 в конце, накопленная сумма > 0 — минуты сна
+    diff = np.zeros((nights, NIGHT_WINDOW_MINUTES + 1), dtype=np.int32)
+    np.add.at(diff, (night, start_min), 1)
+    np.add.at(diff, (night, end_min), -1)
+    asleep = np.cumsum(diff[:, :NIGHT_WINDOW_MINUTES], axis=1) > 0
+
+    return np.packbits(asleep, axis=1)
+
+
+def sleep_days(anchor_days, bitmaps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Раскладывает карты ночей на одну непрерывную шкалу минут пользователя и режет её на сутки
+    от границы, где пользователь реже всего спит (середина самого долгого бодрствования).
+    Так ночь не разрывается ни в одном часовом поясе, а минута t сравнивается с t + 1440.
+    anchor_days — номера суток UTC начал окон, bitmaps — упакованные карты (N, BITMAP_BYTES).
+    Возвращает (номера суток, в которые есть сон; их карты (M, 180)).
+    """
+    anchor_days = np.asarray(anchor_days, dtype='int64')
+    first = anchor_days.min()
+    # Сутки в запасе спереди — для сна раньше границы в первые сутки
+    offsets = (anchor_days - first + 1) * MINUTES_PER_DAY
+    timeline = np.zeros(int(offsets.max()) + NIGHT_WINDOW_MINUTES + MINUTES_PER_DAY, dtype=bool)
+
+    asleep = np.unpackbits(np.asarray(bitmaps, dtype=np.uint8), axis=1)[:, :NIGHT_WINDOW_MINUTES].astype(bool)
+    night, minute = np.nonzero(asleep)
+    timeline[offsets[night] + minute] = True
+
+    # Граница суток — минута суток с наименьшей долей сна в окрестности ±DAY_BOUNDARY_SMOOTHING
+    folded = timeline.reshape(-1, MINUTES_PER_DAY).sum(axis=0)
+    window = np.ones(2 * DAY_BOUNDARY_SMOOTHING + 1)
+    smoothed = np.convolve(np.tile(folded, 3), window, mode='same')[MINUTES_PER_DAY:2 * MINUTES_PER_DAY]
+    boundary = int(np.argmin(smoothed))
+
+    days = timeline[boundary:boundary + (len(timeline) - boundary) // MINUTES_PER_DAY * MINUTES_PER_DAY] \
+        .reshape(-1, MINUTES_PER_DAY)
+    observed = np.flatnonzero(days.any(axis=1))
+    return first - 1 + observed, np.packbits(days[observed], axis=1)
+
+
+def sleep_regularity_index(days, bitmaps: np.ndarray) -> Optional[float]:
+    """
+    Sleep Regularity Index: вероятность оказаться в том же состоянии (сон/бодрствование)
+    через 24 часа, приведённая к шкале от -100 до 100.
+    days — номера суток (например, date.toordinal()), bitmaps — упакованные карты суток (N, 180), см. sleep_days.
+    Учитываются только пары соседних суток; карты одних суток объединяются.
+    Возвращает None, если соседних суток нет.
+    """
+    days = np.asarray(days, dtype='int64')
+    if len(days) < 2:
+        return None
+
+    order = np.argsort(days, kind='stable')
+    days = days[order]
+    bitmaps = np.asarray(bitmaps, dtype=np.uint8)[order]
+
+    # Несколько записей за одни сутки (например, дневной сон) — побитовое ИЛИ
+    unique_days, first = np.unique(days, return_index=True)
+    bitmaps = np.bitwise_or.reduceat(bitmaps, first, axis=0)
+
+    consecutive = np.flatnonzero(np.diff(unique_days) == 1)
+    if not len(consecutive):
+        return None
+
+    mismatches = POPCOUNT[bitmaps[consecutive] ^ bitmaps[consecutive + 1]].sum()
+    agreement = 1 - mismatches / (MINUTES_PER_DAY * len(consecutive))
+    return round(float(-100 + 200 * agreement), 2)
+
+
+def _bitmap_array(blobs) -> np.ndarray:
+    return np.frombuffer(b''.join(bytes(blob) for blob in blobs), dtype=np.uint8).reshape(-1, BITMAP_BYTES)
+
+
+def ensure_sleep_bitmaps(user: User) -> int:
+    """
+    Строит и сохраняет битовые карты для записей пользователя, у которых их ещё нет
+    (записи, импортированные до появления карт). Возвращает количество обновлённых записей.
+    """
+    records = list(SleepRecord.objects.filter(user=user, sleep_bitmap__isnull=True).only('id', 'sleep_date_time'))
+    if not records:
+        return 0
+
+    positions = {record.pk: i for i, record in enumerate(records)}
+    segments = hypnogram_frame(positions)
+
+    bitmaps = sleep_bitmaps(
+        night_anchors([record.sleep_date_time for record in records]),
+        segments['record_id'].map(positions).to_numpy(dtype='int64'),
+        segments['start_time'], segments['end_time'], segments['state'],
+    )
+    for record, bitmap in zip(records, bitmaps):
+        record.sleep_bitmap = bitmap.tobytes()
+
+    SleepRecord.objects.bulk_update(records, ['sleep_bitmap'], batch_size=1000)
+    return len(records)
+
+
+def user_sleep_regularity_index(user: User, days: Optional[int] = None) -> Optional[float]:
+    """
+    SRI пользователя по сохранённым картам ночей: за всю историю или за последние days суток.
+    Карты для старых записей достраиваются один раз по гипнограммам.
+    """
+    ensure_sleep_bitmaps(user)
+
+    rows = SleepRecord.objects.filter(user=user, sleep_bitmap__isnull=False)
+    if days is not None:
+        last = rows.order_by('-sleep_date_time').values_list('sleep_date_time', flat=True).first()
+        if last is None:
+            return None
+        rows = rows.filter(sleep_date_time__gt=last - pd.Timedelta(days=days))
+
+    values = list(rows.values_list('sleep_date_time', 'sleep_bitmap'))
+    if not values:
+        return None
+
+    # Ночи без сегментов сна (пустые карты) — это отсутствие данных, а не бодрствование
+    values = [(sleep_time, blob) for sleep_time, blob in values if any(bytes(blob))]
+    if not values:
+        return None
+
+    sleep_times, blobs = zip(*values)
+    anchor_days = night_anchors(sleep_times).asi8 // (MINUTES_PER_DAY * 60 * 10 ** 9)
+    return sleep_regularity_index(*sleep_days(anchor_days, _bitmap_array(blobs)))
@@ -0,0 +1,176 @@
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from ..models import SleepRecord, SleepRollingAggregate
+from .calculate_sleep_statistic import chronotype_from_midsleep
+
+# Окна, для которых метрики читаются из накопленных сумм
+ROLLING_WINDOWS = (7, 30, 90)
+
+AGGREGATE_FIELDS = [
+    'nights',
+    'duration_nights',
+    'duration_sum',
+    'duration_sq_sum',
+    'bedtime_nights',
+    'bedtime_sum',
+    'bedtime_sq_sum',
+    'wake_nights',
+    'wake_sum',
+    'wake_sq_sum',
+    'free_nights',
+    'free_midpoint_sum',
+    'free_duration_sum',
+]
+
+COUNT_FIELDS = ['nights', 'duration_nights', 'bedtime_nights', 'wake_nights', 'free_nights']
+
+# Опорный час time_to_minutes: время отсчитывается от 20:00, чтобы ночь не разрывалась полуночью
+REF_MINUTES = 20 * 60
+
+
+def _clock_minutes(times: pd.Series) -> pd.Series:
+    """Векторный time_to_minutes: минуты от 20:00 по модулю суток"""
+    return (times.dt.hour * 60 + times.dt.minute - REF_MINUTES) % 1440
+
+
+def _daily_sums(records: pd.DataFrame) -> pd.DataFrame:
+    """Суммы по дням из записей сна (колонки sleep_date_time, bedtime, device_bedtime, wake_up_time, duration)"""
+    duration = pd.to_numeric(records['duration'], errors='coerce').fillna(0).astype('float64')
+    bedtime = _clock_minutes(records['bedtime'])
+    wake = _clock_minutes(records['wake_up_time'])
+
+    # Как в chronotype_assessment: начало сна — более раннее из bedtime и device_bedtime
+    total_bedtime = records[['device_bedtime', 'bedtime']].min(axis=1)
+    midpoint = total_bedtime + pd.to_timedelta(duration / 2, unit='m')
+    midpoint_hour = midpoint.dt.hour + midpoint.dt.minute / 60 + midpoint.dt.second / 3600
+    free = (total_bedtime.dt.weekday >= 5).to_numpy()
+
+    daily = pd.DataFrame({
+        'nights': 1,
+        'duration_nights': (duration > 0).astype('int64'),
+        'duration_sum': duration,
+        'duration_sq_sum': duration ** 2,
+        'bedtime_nights': bedtime.notna().astype('int64'),
+        'bedtime_sum': bedtime.fillna(0),
+        'bedtime_sq_sum': bedtime.fillna(0) ** 2,
+        'wake_nights': wake.notna().astype('int64'),
+        'wake_sum': wake.fillna(0),
+        'wake_sq_sum': wake.fillna(0) ** 2,
+        'free_nights': free.astype('int64'),
+        'free_midpoint_sum': np.where(free, midpoint_hour.fillna(0), 0.0),
+        'free_duration_sum': np.where(free, duration, 0.0),
+    })
+    daily['date'] = records['sleep_date_time'].dt.date
+    return daily.groupby('date').sum()
+
+
+def update_rolling_aggregates(user: User, since: date) -> int:
+    """
+    Пересчитывает накопленные суммы пользователя начиная с даты since.
+    Строки до since не трогаются: к ним прибавляются суммы по записям сна с этой даты.
+    Возвращает количество записанных строк.
+    """
+    base = SleepRollingAggregate.objects.filter(user=user, date__lt=since).order_by('-date') \
+        .values(*AGGREGATE_FIELDS).first() or {field: 0 for field in AGGREGATE_FIELDS}
+
+    since_time = datetime.combine(since, time.min, tzinfo=dt_timezone.utc)
+    records = pd.DataFrame.from_records(
+        SleepRecord.objects.filter(user=user, sleep_date_time__gte=since_time).values(
+            'sleep_date_time', 'bedtime', 'device_bedtime', 'wake_up_time', 'duration'),
+        columns=['sleep_date_time', 'bedtime', 'device_bedtime', 'wake_up_time', 'duration'],
+    )
+    for column in ('sleep_date_time', 'bedtime', 'device_bedtime', 'wake_up_time'):
+        records[column] = pd.to_datetime(records[column], utc=True)
+
+    aggregates = []
+    if not records.empty:
+        cumulative = _daily_sums(records).cumsum() + pd.Series(base)
+        cumulative = cumulative.astype({field: 'int64' for field in COUNT_FIELDS})
+        aggregates = [
+            SleepRollingAggregate(user=user, date=day, **row)
+            for day, row in zip(cumulative.index, cumulative[AGGREGATE_FIELDS].to_dict('records'))
+        ]
+
+    with transaction.atomic():
+        SleepRollingAggregate.objects.filter(user=user, date__gte=since).delete()
+        SleepRollingAggregate.objects.bulk_create(aggregates, batch_size=1000)
+    return len(aggregates)
+
+
+def ensure_rolling_aggregates(user: User) -> int:
+    """
+    Строит накопленные суммы пользователя по всей истории, если их ещё нет
+    (записи, импортированные до появления сумм). Возвращает количество записанных строк.
+    """
+    if SleepRollingAggregate.objects.filter(user=user).exists():
+        return 0
+    first = SleepRecord.objects.filter(user=user).order_by('sleep_date_time') \
+        .values_list('sleep_date_time', flat=True).first()
+    if first is None:
+        return 0
+    return update_rolling_aggregates(user, first.astimezone(dt_timezone.utc).date())
+
+
+def rolling_window(user: User, days: int, end: Optional[date] = None) -> Dict[str, float]:
+    """
+    Суммы за days дней, заканчивая датой end (по умолчанию — дата последней ночи).
+    Два чтения по индексу (user, date) вместо скана записей. Пустой словарь, если данных нет.
+    Суммы для старых записей достраиваются один раз по всей истории.
+    """
+    ensure_rolling_aggregates(user)
+    rows = SleepRollingAggregate.objects.filter(user=user).order_by('-date')
+    if end is not None:
+        rows = rows.filter(date__lte=end)
+    last = rows.values('date', *AGGREGATE_FIELDS).first()
+    if last is None:
+        return {}
+
+    window_end = end or last['date']
+    before = SleepRollingAggregate.objects.filter(user=user, date__lte=window_end - timedelta(days=days)) \
+        .order_by('-date').values(*AGGREGATE_FIELDS).first() or {}
+
+    return {field: last[field] - before.get(field, 0) for field in AGGREGATE_FIELDS}
+
+
+def _std(total: float, squares: float, count: int) -> float:
+    """Стандартное отклонение (как np.std) по сумме и сумме квадратов"""
+    mean = total / count
+    return float(np.sqrt(max(squares / count - mean ** 2, 0.0)))
+
+
+def rolling_sleep_metrics(user: User, days: int = 7, end: Optional[date] = None) -> dict:
+    """
+    Хронотип, регулярность сна и средняя длительность сна за окно в days дней.
+    Значения совпадают с chronotype_assessment, sleep_regularity и avg_sleep_duration
+    для записей этого окна, но считаются по накопленным суммам.
+    """
+    window = rolling_window(user, days, end)
+    if not window or not window['nights']:
+        return {'chronotype': {}, 'sleep_regularity': {}, 'avg_sleep_duration': 0}
+
+    chronotype = {}
+    if window['free_nights']:
+        chronotype = chronotype_from_midsleep(
+            msf=window['free_midpoint_sum'] / window['free_nights'],
+            sd_free=window['free_duration_sum'] / window['free_nights'] / 60,
+            sd_week=window['duration_sum'] / window['nights'] / 60,
+        )
+
+    bedtime_nights, wake_nights = window['bedtime_nights'], window['wake_nights']
+    sleep_regularity = {
+        'bedtime_std': round(_std(window['bedtime_sum'], window['bedtime_sq_sum'], bedtime_nights), 2)
+        if bedtime_nights >= 2 else 0,
+        'wake_time_std': round(_std(window['wake_sum'], window['wake_sq_sum'], wake_nights), 2)
+        if wake_nights >= 2 else 0,
+    }
+
+    avg_duration = round(window['duration_sum'] / window['duration_nights'] / 60, 2) \
+        if window['duration_nights'] else 0
+
+    return {'chronotype': chronotype, 'sleep_regularity': sleep_regularity, 'avg_sleep_duration': avg_duration}
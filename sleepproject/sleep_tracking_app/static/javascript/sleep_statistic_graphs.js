@@ -151,6 +151,26 @@ function VariableRadius(containerId, data) {
 }
 
 
+function PhasesTrend(containerId, trend) {
+    charts[containerId] = Highcharts.chart(containerId, {
+        credits: {enabled: false},
+        chart: {type: 'area'},
+        title: {text: 'Фазы сна по неделям'},
+        colors: ['#64bff7', '#8053d5', '#45c454', '#ffad61'],
+        xAxis: {categories: trend.weeks},
+        yAxis: {title: {text: 'Доля ночи, %'}, max: 100},
+        plotOptions: {area: {stacking: 'normal'}},
+        tooltip: {shared: true, valueSuffix: '%'},
+        series: [
+            {name: 'Глубокий', data: trend.deep},
+            {name: 'Легкий', data: trend.light},
+            {name: 'REM', data: trend.rem},
+            {name: 'Бодрствование', data: trend.awake},
+        ]
+    });
+}
+
+
 function DurationLiner(containerId, data, seriesName, dataKey) {
     if (charts[containerId]) {
         charts[containerId].destroy(); // Удаляем предыдущий график, если он существует
@@ -350,6 +370,9 @@ $(document).ready(function () {
     // Инициализация графиков с начальными данными
     const data = initialGraphData;
     VariableRadius('graph-Phase', data.phases);
+    if (data.phases_trend && data.phases_trend.weeks) {
+        PhasesTrend('graph-PhasesTrend', data.phases_trend);
+    }
     DurationLiner('graph-Duration', data.graph_data, 'Продолжительность сна', 'sleep_duration');
     BPMGraph('graph-BPM', data.heart_rate);
     bindNavigationEvents();
@@ -1,21 +1,28 @@
-from typing import List
+from datetime import date
+from typing import List, Optional
 
-from celery import shared_task
-import pandas as pd
+from celery import shared_task, chord, group
 import os
+import shutil
 
 from celery_progress.backend import ProgressRecorder
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
 
 from sleepproject.celery import app  # Фоновая задача
 
 from django.core.mail import send_mass_mail
-from django.db import transaction
 
-from .csv_data_extraction import sleep_record_from_csv
-from .models import SleepRecord, SleepSegment, NightHeartRateEntry, SleepStatistics, UserData
+from .csv_data_extraction import sleep_record_from_csv_chunks
+from .models import SleepRecord, SleepStatistics, UserData
+from .partitioning import partitioning_supported, ensure_month_partitions
+from .sleep_import import night_fingerprints, select_changed_nights, split_into_shards, write_shards, read_shard, \
+    file_digest, completed_shards, imported_total, import_shard_checkpointed, clear_checkpoints, ThrottledProgress, \
+    IMPORT_STAGES, shard_start, downsample_night_heart_rate, report_shard_progress
+from .sleep_statistic import update_rolling_aggregates, counted_cohort_values, update_cohort_sketches, \
+    advance_sleep_baseline, reset_sleep_baseline, recent_sleep_anomalies
 
-from .sleep_statistic import calculate_sleep_statistics_metrics
 from .prompts import get_sleep_recommendation
 
 from sleep_tracking_app.rag.rag_service import RagService
@@ -23,125 +30,189 @@ from sleep_tracking_app.prompts.baseline import call_gemini
 from sleep_tracking_app.prompts.prompts_templates import create_sleep_analysis_prompt, get_system_prompt
 from sleep_tracking_app.models import UserData, SleepRecord, SleepStatistics
 
-@shared_task(bind=True, name='import_sleep_records_task')
-def import_sleep_records(self, user_id: int, csv_path: str):
-    progress_recorder = ProgressRecorder(self)
+@shared_task(bind=True, name='import_sleep_records_task', acks_late=True, reject_on_worker_lost=True,
+             max_retries=3, default_retry_delay=30)
+def import_sleep_records(self, user_id: int, csv_path: str, incremental: bool = False, sharded: bool = False):
+    """
+    Импортирует записи сна из выгрузки Mi Fitness.
+    В инкрементальном режиме записываются и пересчитываются только новые ночи
+    и ночи, содержимое которых изменилось с прошлого импорта.
+    Выгрузка записывается шардами по месяцам, каждый шард — своей транзакцией с отметкой
+    ImportCheckpoint, поэтому повторный запуск (retry или повторная доставка после падения воркера)
+    продолжает с первого незаписанного шарда. CSV удаляется только после завершения импорта.
+    В шардированном режиме шарды обрабатываются параллельно группой задач,
+    а итог подводит finalize_sleep_import.
+    """
+    # Прогресс отправляется в backend с ограничением частоты, разбор и запись — отдельные этапы шкалы
+    progress = ThrottledProgress(ProgressRecorder(self))
+    stages = progress.stages(IMPORT_STAGES)
 
     user = User.objects.get(pk=user_id)
     user_data = UserData.objects.get(user=user)
-    # Считаем CSV прямо по пути
-    df = pd.read_csv(csv_path, encoding='utf-8')
-    sleep_data = sleep_record_from_csv(df, progress_recorder)
-
-    if sleep_data is None:
-        os.remove(csv_path)
-        return {"status": "error", "message": "Invalid CSV file"}
+    shard_dir = f'{csv_path}.shards'
+    try:
+        # Читаем CSV по пути кусками, не загружая файл в память целиком
+        sleep_data = sleep_record_from_csv_chunks(csv_path, stages['parse'])
+
+        if sleep_data is None:
+            os.remove(csv_path)
+            return {"status": "error", "message": "Invalid CSV file"}
+
+        file_hash = file_digest(csv_path)
+        done = completed_shards(user, file_hash)
+
+        meta, items, night_hr = sleep_data
+        meta = meta.assign(content_hash=night_fingerprints(meta, items, night_hr))
+
+        if incremental:
+            meta, items, night_hr = select_changed_nights(user, meta, items, night_hr)
+
+        # С какой даты пересчитывать скользящие суммы: с первой новой ночи или первого уже записанного шарда
+        since_dates = [shard_start(key) for key in done] + ([meta.index.min().date()] if not meta.empty else [])
+        since = min(since_dates).isoformat() if since_dates else None
+
+        shards = split_into_shards(meta, items, night_hr)
+        # Полный импорт начинается с чистой статистики, но при продолжении она уже частично записана заново
+        if not incremental and not done:
+            with transaction.atomic():
+                wiped = SleepStatistics.objects.filter(user=user)
+                update_cohort_sketches(user_data, removed=counted_cohort_values(wiped, user_data))
+                wiped.delete()
+                reset_sleep_baseline(user)
+
+        if sharded:
+            total_shards = len(shards)
+            shards = {key: frames for key, frames in shards.items() if key not in done}
+            if not shards:
+                os.remove(csv_path)
+                return finalize_sleep_import([], user_id, file_hash, None, since, self.request.id)
+            shard_paths = write_shards(shards, shard_dir)
+    except Exception:
+        # Ошибка разбора или подготовки не повторяется — временные файлы выгрузки не должны оставаться
+        _discard_import_files(csv_path, shard_dir)
+        raise
+
+    if sharded:
+        # Итог аккорда наследует id этой задачи. Шарды пишут прогресс в её состояние сами
+        # (записано шардов из total_shards), иначе шкала стояла бы на конце разбора до конца импорта
+        progress_task_id = self.request.id
+        report_shard_progress(self, progress_task_id, len(done), total_shards, 'Запись шардов')
+        return self.replace(chord(
+            group(import_sleep_shard.s(user_id, file_hash, key, path, progress_task_id, total_shards)
+                  for key, path in zip(shards, shard_paths)),
+            # CSV и каталог шардов удаляет итоговая задача, а если шард исчерпал повторы — abort_sleep_import
+            finalize_sleep_import.s(user_id, file_hash, shard_dir, since, progress_task_id, csv_path).on_error(
+                abort_sleep_import.s(user_id, file_hash, shard_dir, since, csv_path)
+            ),
+        ))
 
-    meta, items, night_hr = sleep_data
     total = len(meta)
-    processed = 0
-
-    # Получаем данные пользователя
-    age = user_data.get_age_months()
-    gender = user_data.gender
-    weight = user_data.weight
-    height = user_data.height
-
-    with transaction.atomic():
-        # Создаём или обновляем базовые записи сна и собираем их в словарь
-        record_map = {}
-        for sleep_time, meta_row in meta.iterrows():
-            record, _ = SleepRecord.objects.update_or_create(
-                user=user,
-                sleep_date_time=sleep_time,
-                defaults={
-                    'sleep_rem_duration': meta_row.get('sleep_rem_duration'),
-                    'has_rem': meta_row.get('has_rem'),
-                    'min_hr': meta_row.get('min_hr'),
-                    'device_bedtime': meta_row.get('device_bedtime'),
-                    'sleep_deep_duration': meta_row.get('sleep_deep_duration'),
-                    'wake_up_time': meta_row.get('wake_up_time'),
-                    'bedtime': meta_row.get('bedtime'),
-                    'awake_count': meta_row.get('awake_count'),
-                    'duration': meta_row.get('duration'),
-                    'max_hr': meta_row.get('max_hr'),
-                    'sleep_awake_duration': meta_row.get('sleep_awake_duration'),
-                    'avg_hr': meta_row.get('avg_hr'),
-                    'sleep_light_duration': meta_row.get('sleep_light_duration'),
-                    'device_wake_up_time': meta_row.get('device_wake_up_time'),
-                }
-            )
-            record_map[sleep_time] = record
-
-            processed += 1
-
-            progress_recorder.set_progress(processed, total, f'Обработано: {processed}/{total}')
-
-        # Удаляем старые дочерние объекты разом
-        SleepSegment.objects.filter(record__in=record_map.values()).delete()
-        NightHeartRateEntry.objects.filter(record__in=record_map.values()).delete()
-        SleepStatistics.objects.filter(user=user).delete()
-
-        # Подготавливаем объекты для bulk_create
-        segments_to_create = []
-        night_hr_to_create = []
-
-
-        # --- подготавливаем сегменты сна ---
-        for idx, seg in items.iterrows():
-            record = record_map.get(idx)
-            if record is None:
-                continue
-            segments_to_create.append(
-                SleepSegment(
-                    record=record,
-                    start_time=seg['start_time'],
-                    end_time=seg['end_time'],
-                    state=seg['state']
-                )
-            )
-
-        # --- подготавливаем пульс ---
-        for record in record_map.values():
-            # ночной пульс
-            night_mask = (night_hr.index >= record.device_bedtime) & (
-                    night_hr.index <= record.device_wake_up_time)
-            night_df = night_hr[night_mask]
-            night_hr_to_create.extend([
-                NightHeartRateEntry(record=record, time=idx, bpm=row['bpm'])
-                for idx, row in night_df.iterrows()
-            ])
-
-        # bulk insert
-        SleepSegment.objects.bulk_create(segments_to_create, batch_size=1000)
-        NightHeartRateEntry.objects.bulk_create(night_hr_to_create, batch_size=1000)
-
-        # --- подготавливаем статистику сна ---
-        sleep_statistic_to_create = []
-        for record in record_map.values():
-            record.refresh_from_db()
-            stats  = calculate_sleep_statistics_metrics(record, age, gender, weight, height)
-
-            sleep_statistic_to_create.append(
-                SleepStatistics(
-                    user=user,
-                    date=record.sleep_date_time.date(),
-                    latency_minutes=stats ['latency_minutes'],
-                    sleep_efficiency=stats ['sleep_efficiency'],
-                    sleep_phases=stats ['sleep_phases'],
-                    sleep_fragmentation_index=stats ['sleep_fragmentation_index'],
-                    sleep_calories_burned=stats ['sleep_calories_burned']
-                )
-            )
-
-        # bulk insert
-        SleepStatistics.objects.bulk_create(sleep_statistic_to_create, batch_size=1000)
-
-    # transaction.atomic откатит изменения автоматически
+    written = 0
+    try:
+        for key, (shard_meta, shard_items, shard_hr) in shards.items():
+            if key not in done:
+                import_shard_checkpointed(user, user_data, file_hash, key, shard_meta, shard_items, shard_hr,
+                                          stages['import'].span(written, len(shard_meta), total))
+            written += len(shard_meta)
+    except Exception as exc:
+        # Записанные шарды остаются в БД вместе с отметками, повтор продолжит со следующего
+        if self.request.retries >= self.max_retries:
+            # Повторов больше не будет: как в abort_sleep_import, производные данные доводятся
+            # до записанных шардов, отметки снимаются, чтобы повторная загрузка выгрузки не считалась продолжением
+            _close_sleep_import(user, file_hash, None, since, csv_path)
+            raise
+        raise self.retry(exc=exc)
+
+    processed = imported_total(user, file_hash)
+    if since is not None:
+        update_rolling_aggregates(user, date.fromisoformat(since))
+    # Базовая линия ночных метрик продвигается по новым ночам в хронологическом порядке
+    advance_sleep_baseline(user)
+    clear_checkpoints(user, file_hash)
+    progress.finish(f'Обработано: {processed}')
 
     os.remove(csv_path)
     return {"status": "completed", "imported": processed}
 
+
+@shared_task(bind=True, name='import_sleep_shard_task', acks_late=True, reject_on_worker_lost=True,
+             max_retries=3, default_retry_delay=30)
+def import_sleep_shard(self, user_id: int, file_hash: str, shard: str, shard_path: str,
+                       progress_task_id: Optional[str] = None, shards_total: int = 0) -> int:
+    """
+    Импортирует один шард выгрузки и отмечает его в ImportCheckpoint.
+    Файл шарда удаляется после записи, при ошибке остаётся для повтора.
+    После записи отмечает в прогрессе задачи импорта progress_task_id, сколько шардов из shards_total готово.
+    Возвращает количество записанных ночей.
+    """
+    user = User.objects.get(pk=user_id)
+    user_data = UserData.objects.get(user=user)
+
+    meta, items, night_hr = read_shard(shard_path)
+    try:
+        processed = import_shard_checkpointed(user, user_data, file_hash, shard, meta, items, night_hr)
+    except Exception as exc:
+        raise self.retry(exc=exc)
+
+    os.remove(shard_path)
+    done = len(completed_shards(user, file_hash))
+    report_shard_progress(self, progress_task_id, done, shards_total, f'Записано шардов: {done} из {shards_total}')
+    return processed
+
+
+def _discard_import_files(csv_path: Optional[str], shard_dir: Optional[str] = None) -> None:
+    """Удаляет временные файлы импорта: CSV выгрузки и каталог шардов, если они ещё есть"""
+    if shard_dir is not None:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    if csv_path is not None and os.path.exists(csv_path):
+        os.remove(csv_path)
+
+
+def _close_sleep_import(user: User, file_hash: str, shard_dir: Optional[str], since: Optional[str],
+                        csv_path: Optional[str]) -> int:
+    """
+    Доводит производные данные до записанных шардов: скользящие суммы с даты since и базовую линию,
+    снимает отметки и удаляет временные файлы. Возвращает количество записанных ночей.
+    """
+    processed = imported_total(user, file_hash)
+    if since is not None:
+        update_rolling_aggregates(user, date.fromisoformat(since))
+    # Базовая линия ночных метрик продвигается по новым ночам в хронологическом порядке
+    advance_sleep_baseline(user)
+    clear_checkpoints(user, file_hash)
+
+    _discard_import_files(csv_path, shard_dir)
+    return processed
+
+
+@shared_task(bind=True, name='finalize_sleep_import_task')
+def finalize_sleep_import(self, results: List[int], user_id: int, file_hash: str, shard_dir: Optional[str],
+                          since: Optional[str] = None, progress_task_id: Optional[str] = None,
+                          csv_path: Optional[str] = None) -> dict:
+    """
+    Завершает шардированный импорт: пересчитывает скользящие суммы с даты since,
+    продвигает базовую линию ночных метрик, подводит итог, снимает отметки и удаляет CSV и временные файлы шардов
+    """
+    user = User.objects.get(pk=user_id)
+    shards_done = len(completed_shards(user, file_hash))
+    report_shard_progress(self, progress_task_id, shards_done, shards_done, 'Пересчёт итогов')
+    processed = _close_sleep_import(user, file_hash, shard_dir, since, csv_path)
+    return {"status": "completed", "imported": processed, "shards": len(results)}
+
+
+@shared_task(name='abort_sleep_import_task')
+def abort_sleep_import(request, exc, traceback, user_id: int, file_hash: str, shard_dir: Optional[str],
+                       since: Optional[str] = None, csv_path: Optional[str] = None) -> dict:
+    """
+    Errback шардированного импорта: шард исчерпал повторы, и finalize_sleep_import не запустится.
+    Записанные шарды остаются в БД и учитываются в скользящих суммах и базовой линии,
+    отметки и временные файлы удаляются, чтобы не оставались осиротевшими; выгрузку можно загрузить заново.
+    """
+    user = User.objects.get(pk=user_id)
+    processed = _close_sleep_import(user, file_hash, shard_dir, since, csv_path)
+    return {"status": "error", "message": str(exc), "imported": processed}
+
+
 @shared_task
 def sleep_recommended(user_data_id: int, sleep_record_id: List[int], sleep_statistics_id:List[int]):
     user_data = UserData.objects.get(id=user_data_id)
@@ -153,7 +224,7 @@ def sleep_recommended(user_data_id: int, sleep_record_id: List[int], sleep_stati
 
     sleep_statistics_qs = SleepStatistics.objects.only(
         'id', 'sleep_efficiency', 'sleep_fragmentation_index',
-        'latency_minutes', 'sleep_calories_burned', 'recommended',
+        'latency_minutes', 'sleep_calories_burned', 'recommended', 'cycle_count',
     ).filter(id__in=sleep_statistics_id)
 
     sleep_records_map = {r.id: r for r in sleep_records_qs}
@@ -168,7 +239,8 @@ def sleep_recommended(user_data_id: int, sleep_record_id: List[int], sleep_stati
 
      # Этап 1: Gemini (используем точно такой же промпт как раньше)
     system_prompt = get_system_prompt()
-    user_prompt = create_sleep_analysis_prompt(user_data, sleep_statistics_list, sleep_records_list)
+    anomalies = recent_sleep_anomalies(user_data.user)
+    user_prompt = create_sleep_analysis_prompt(user_data, sleep_statistics_list, sleep_records_list, anomalies)
     full_prompt = f"{system_prompt}\n\n{user_prompt}"
     
     gemini_response = call_gemini(full_prompt)
@@ -203,6 +275,27 @@ def sleep_recommended(user_data_id: int, sleep_record_id: List[int], sleep_stati
     latest_stat.save(update_fields=['recommended', 'health_impact'])    
     return latest_stat.recommended
 
+@shared_task(name='downsample_night_heart_rate_task')
+def downsample_night_heart_rate_task() -> int:
+    """
+    Ежедневное огрубление ночного пульса старых ночей по срокам HEART_RATE_RETENTION_TIERS.
+    Графики и аналитика читают огрублённый ряд сами, когда исходных замеров уже нет.
+    """
+    return downsample_night_heart_rate()
+
+
+@shared_task(name='ensure_heart_rate_partitions_task')
+def ensure_heart_rate_partitions_task(ahead: int = 2) -> int:
+    """
+    Ежемесячное создание секций таблиц ночного пульса на ahead месяцев вперёд, включая текущий,
+    чтобы замеры новых ночей не копились в секции по умолчанию (как manage_heart_rate_partitions).
+    На СУБД без секционирования ничего не делает. Возвращает количество новых секций.
+    """
+    if not partitioning_supported():
+        return 0
+    return ensure_month_partitions(timezone.now().date(), ahead)
+
+
 @app.task
 def send_reminder_email():
     # Получаем все активные напоминания, которые должны быть отправлены
@@ -7,6 +7,12 @@ from .tests_plot import *
 from .tests_tasks import *
 from .tests_views_additional import *
 from .test_error_handling import *
+from .tests_import import *
+from .tests_rolling import *
+from .tests_cohorts import *
+from .tests_anomaly import *
+from .tests_partitioning import *
+from .tests_retention import *
 
 __all__ = [
     'test_forms_validation',
@@ -16,5 +22,11 @@ __all__ = [
     'tests_plot',
     'tests_tasks',
     'tests_views_additional',
-    'test_error_handling'
+    'test_error_handling',
+    'tests_import',
+    'tests_rolling',
+    'tests_cohorts',
+    'tests_anomaly',
+    'tests_partitioning',
+    'tests_retention',
 ]
@@ -113,6 +113,49 @@ class ExtendedViewTests(TestCase):
         self.assertIn('page', response.context)  # страница с SleepRecord
         self.assertIn('rec', response.context)  # рекомендация по сну (строка или None)
 
+    @patch('sleep_tracking_app.tasks.sleep_recommended.delay')
+    def test_sleep_statistics_show_cycle_count(self, mock_task):
+        """Количество циклов сна читается вместе со статистикой, без отдельного запроса"""
+        mock_task.return_value = MagicMock(id='test-task-id')
+        SleepStatistics.objects.filter(pk=self.sleep_stat.pk).update(cycle_count=4)
+
+        refresh_from_db = SleepStatistics.refresh_from_db
+        deferred = []
+
+        def track_refresh(instance, *args, fields=None, **kwargs):
+            deferred.extend(fields or [])
+            return refresh_from_db(instance, *args, fields=fields, **kwargs)
+
+        self.client.login(username='testuser', password='testpass123')
+        with patch.object(SleepStatistics, 'refresh_from_db', autospec=True, side_effect=track_refresh):
+            response = self.client.get(reverse('sleep_statistics_show'))
+
+        self.assertNotIn('cycle_count', deferred)
+
+        self.assertEqual(response.context['metric']['cycle_count'], 4)
+        _, kwargs = mock_task.call_args
+        self.assertEqual(kwargs['sleep_statistics_id'], [self.sleep_stat.pk])
+
+    @patch('sleep_tracking_app.tasks.sleep_recommended.delay')
+    def test_sleep_statistics_show_phases_trend(self, mock_task):
+        """Недельный тренд фаз строится по колонкам процентов и выводится графиком"""
+        mock_task.return_value = MagicMock(id='test-task-id')
+        self.client.login(username='testuser', password='testpass123')
+
+        # Статистика без колонок фаз в тренд не попадает
+        response = self.client.get(reverse('sleep_statistics_show'))
+        self.assertEqual(response.context['plot_data']['phases_trend'], {})
+        self.assertNotContains(response, 'graph-PhasesTrend')
+
+        SleepStatistics.objects.filter(pk=self.sleep_stat.pk).update(
+            deep_percent=25, light_percent=62.5, rem_percent=12.5, awake_percent=6.25)
+        response = self.client.get(reverse('sleep_statistics_show'))
+
+        trend = response.context['plot_data']['phases_trend']
+        self.assertEqual(len(trend['weeks']), 1)
+        self.assertEqual((trend['deep'], trend['rem']), ([25.0], [12.5]))
+        self.assertContains(response, 'graph-PhasesTrend')
+
     @patch('sleep_tracking_app.tasks.sleep_recommended.delay')
     def test_sleep_statistics_show_no_data(self, mock_task):
         """Test the view when no sleep data exists"""
@@ -11,9 +11,11 @@ from sleep_tracking_app.sleep_statistic import (
     evaluate_wake_time,
     chronotype_assessment,
     calculate_cycle_count,
+    sleep_cycle_counts,
     time_to_minutes,
     sleep_regularity,
     calculate_sleep_statistics_metrics,
+    sleep_statistics_batch,
     avg_sleep_duration,
 )
 
@@ -25,33 +27,13 @@ from sleep_tracking_app.views import home, register, custom_logout, profile, sle
 from sleep_tracking_app.models import UserData
 
 
-class DummySegments:
-    def __init__(self, segs):
-        # segs: list of dicts with keys 'start_time','end_time','state'
-        self._segs = segs
-
-    def order_by(self, *args, **kwargs):
-        return self
-
-    def values_list(self, *args, **kwargs):
-        class VList:
-            def __init__(self, vals):
-                self._vals = vals
-
-            def first(self):
-                return self._vals[0] if self._vals else None
-
-        vals = [s['start_time'] for s in self._segs]
-        return VList(vals)
-
-    def __iter__(self):
-        return iter(self._segs)
-
-    def __len__(self):
-        return len(self._segs)
-
-    def __getitem__(self, idx):
-        return self._segs[idx]
+def dummy_hypnogram(segs):
+    # segs: list of dicts with keys 'start_time','end_time','state'; returns SleepRecord.hypnogram-like callable
+    def hypnogram():
+        return (np.array([seg['start_time'] for seg in segs], dtype='datetime64[s]'),
+                np.array([seg['end_time'] for seg in segs], dtype='datetime64[s]'),
+                np.array([seg['state'] for seg in segs], dtype='uint8'))
+    return hypnogram
 
 
 class DummyRecord:
@@ -105,9 +87,17 @@ class CalculateSleepStatisticTests(unittest.TestCase):
             {'start_time': now + timedelta(minutes=90), 'end_time': now + timedelta(minutes=110), 'state': 4},
             {'start_time': now + timedelta(minutes=110), 'end_time': now + timedelta(minutes=115), 'state': 5},
         ]
-        record = DummyRecord(segments=DummySegments(segs))
+        record = DummyRecord(hypnogram=dummy_hypnogram(segs))
         self.assertEqual(calculate_cycle_count(record), 1)
 
+    def test_sleep_cycle_counts_per_night(self):
+        # Ночь 1: два полных цикла через пробуждение; ночь 2: короткий цикл без REM
+        nights = [1, 1, 1, 1, 1, 1, 1, 2, 2]
+        states = [2, 3, 4, 5, 2, 3, 4, 2, 3]
+        durations = [30, 40, 30, 5, 50, 30, 20, 30, 30]
+        counts = sleep_cycle_counts(nights, states, durations)
+        self.assertEqual(counts.to_dict(), {1: 2, 2: 0})
+
     def test_calculate_sleep_statistics_metrics(self):
         # Create a fake sleep_data with required attributes
         device_bedtime = datetime(2025, 11, 22, 22, 0)
@@ -123,7 +113,7 @@ class CalculateSleepStatisticTests(unittest.TestCase):
             bedtime=bedtime,
             device_wake_up_time=device_wake,
             wake_up_time=wake_time,
-            segments=DummySegments(segs),
+            hypnogram=dummy_hypnogram(segs),
             sleep_deep_duration=180,
             sleep_light_duration=270,
             sleep_rem_duration=30,
@@ -148,6 +138,23 @@ class CalculateSleepStatisticTests(unittest.TestCase):
         expected_cal = calculate_calories_burned(gender=1, weight=70.0, height=175, age=np.float64(360), sleep_duration=480)
         self.assertAlmostEqual(metrics['sleep_calories_burned'], expected_cal)
 
+    def test_sleep_statistics_batch(self):
+        bedtime = [datetime(2025, 11, 22, 22, 0), datetime(2025, 11, 23, 23, 0)]
+        wake = [datetime(2025, 11, 23, 6, 0), datetime(2025, 11, 24, 7, 0)]
+        metrics = sleep_statistics_batch(
+            bedtime=bedtime, device_bedtime=bedtime, wake_up_time=wake, device_wake_up_time=wake,
+            first_segment_start=[bedtime[0] + timedelta(minutes=15), None],
+            duration=np.array([480, 0]), sleep_deep_duration=[120, 0], sleep_light_duration=[300, 0],
+            sleep_rem_duration=[60, 0], sleep_awake_duration=[0, 0], awake_count=[2, 0],
+            age=np.float64(360), gender=1, weight=70.0, height=175,
+        )
+
+        np.testing.assert_allclose(metrics['latency_minutes'], [15, 0])
+        np.testing.assert_allclose(metrics['sleep_efficiency'], [100, 0])
+        np.testing.assert_allclose(metrics['sleep_phases']['deep'], [25, 0])
+        np.testing.assert_allclose(metrics['sleep_fragmentation_index'], [0.25, 0])
+        np.testing.assert_allclose(metrics['sleep_calories_burned'], [round(1648.75 / 3, 1), 0])
+
     def test_chronotype_assessment_with_mocked_interpret(self):
         # Monkeypatch interpret_chronotype inside module to return a dict with known key
         mod = importlib.import_module('sleep_tracking_app.sleep_statistic.calculate_sleep_statistic')
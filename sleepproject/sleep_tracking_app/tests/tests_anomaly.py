@@ -0,0 +1,93 @@
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.test import TestCase
+
+from sleep_tracking_app.models import SleepRecord, SleepStatistics, SleepAnomaly, SleepBaseline
+from sleep_tracking_app.prompts.prompts_templates import create_sleep_analysis_prompt
+from sleep_tracking_app.sleep_statistic import StreamingBaseline, advance_sleep_baseline, recent_sleep_anomalies
+from sleep_tracking_app.tests.tests_import import ImportedUserMixin
+
+
+class StreamingBaselineTests(unittest.TestCase):
+    def test_warmup_mean_matches_plain_average(self):
+        baseline = StreamingBaseline()
+        values = [80, 84, 86, 82, 88]
+        for value in values:
+            self.assertIsNone(baseline.score(value))
+            baseline.update(value)
+        self.assertAlmostEqual(baseline.mean, np.mean(values))
+
+    def test_spike_is_scored_and_clipped(self):
+        rng = np.random.default_rng(3)
+        baseline = StreamingBaseline(min_scale=1.0)
+        for value in 85 + rng.normal(0, 2, size=60):
+            baseline.update(value)
+        mean = baseline.mean
+
+        self.assertLess(abs(baseline.score(mean + 1)), 1)
+        self.assertLess(baseline.score(50), -3.5)
+
+        # Выброс обрезается до порога и почти не сдвигает базовую линию
+        baseline.update(50)
+        self.assertLess(abs(baseline.mean - mean), 2)
+
+    def test_state_round_trip(self):
+        baseline = StreamingBaseline()
+        for value in (1, 2, 3):
+            baseline.update(value)
+        restored = StreamingBaseline.from_dict(baseline.to_dict())
+        self.assertEqual(restored.to_dict(), baseline.to_dict())
+
+
+class SleepAnomalyDetectionTests(ImportedUserMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = datetime(2025, 10, 1, 7, 0, tzinfo=dt_timezone.utc)
+
+    def add_night(self, n: int, efficiency: float, avg_hr: int = 60) -> SleepRecord:
+        record = SleepRecord.objects.create(user=self.user, sleep_date_time=self.first + timedelta(days=n),
+                                            duration=420, awake_count=1, avg_hr=avg_hr)
+        SleepStatistics.objects.create(user=self.user, record=record, date=record.sleep_date_time.date(),
+                                       sleep_efficiency=efficiency, latency_minutes=12)
+        return record
+
+    def test_spike_night_is_flagged_once(self):
+        for n in range(20):
+            self.add_night(n, 88 + (n % 3))
+        spike = self.add_night(20, 55)
+
+        self.assertEqual(advance_sleep_baseline(self.user), 1)
+        anomaly = SleepAnomaly.objects.get()
+        self.assertEqual((anomaly.record_id, anomaly.metric), (spike.pk, 'sleep_efficiency'))
+        self.assertLess(anomaly.score, 0)
+
+        # Повторный вызов без новых ночей ничего не читает и не отмечает
+        self.assertEqual(advance_sleep_baseline(self.user), 0)
+        self.assertEqual(SleepBaseline.objects.get(user=self.user).state['sleep_efficiency']['n'], 21)
+
+        # Новая ночь продвигает сохранённое состояние на один шаг
+        self.add_night(21, 89, avg_hr=85)
+        self.assertEqual(advance_sleep_baseline(self.user), 1)
+        self.assertEqual(SleepBaseline.objects.get(user=self.user).state['sleep_efficiency']['n'], 22)
+
+        anomalies = recent_sleep_anomalies(self.user)
+        self.assertEqual([a.metric for a in anomalies], ['avg_hr', 'sleep_efficiency'])
+
+        prompt = create_sleep_analysis_prompt(self.user_data, [], [], anomalies)
+        self.assertIn('Эффективность сна 55 (обычно около', prompt)
+        self.assertIn('Средний пульс 85', prompt)
+
+    def test_import_advances_baseline(self):
+        self.import_export()
+
+        baseline = SleepBaseline.objects.get(user=self.user)
+        self.assertEqual(baseline.last_night, SleepRecord.objects.filter(user=self.user)
+                         .order_by('-sleep_date_time').first().sleep_date_time)
+        self.assertEqual(baseline.state['sleep_efficiency']['n'], 3)
+        self.assertEqual(recent_sleep_anomalies(self.user), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from io import StringIO
+from datetime import datetime
+
+import numpy as np
+from django.core.management import call_command
+from django.test import TestCase
+
+from sleep_tracking_app.models import SleepStatistics, CohortSketch
+from sleep_tracking_app.sleep_statistic.cohorts import QuantileSketch, SKETCH_ACCURACY, age_band, cohort_percentile, \
+    user_cohort_benchmarks
+from sleep_tracking_app.tests.tests_import import ImportedUserMixin, make_export_rows
+
+
+class QuantileSketchTests(unittest.TestCase):
+    def setUp(self):
+        self.values = np.random.default_rng(7).lognormal(mean=4, sigma=0.5, size=5000)
+
+    def test_quantiles_within_relative_accuracy(self):
+        sketch = QuantileSketch()
+        sketch.update(self.values)
+
+        for q in (0.1, 0.5, 0.9, 0.99):
+            expected = np.quantile(self.values, q, method='lower')
+            self.assertLessEqual(abs(sketch.quantile(q) - expected) / expected, 2 * SKETCH_ACCURACY)
+        self.assertAlmostEqual(sketch.rank(np.median(self.values)), 0.5, delta=0.02)
+
+    def test_merge_and_subtract(self):
+        left, right = QuantileSketch(), QuantileSketch()
+        left.update(self.values[:3000])
+        right.update(self.values[3000:])
+        left.merge(right)
+
+        whole = QuantileSketch()
+        whole.update(self.values)
+        self.assertEqual(left.buckets, whole.buckets)
+
+        # Вычитание добавленных значений возвращает скетч к исходному состоянию
+        whole.update(self.values[3000:], weight=-1)
+        whole.update([0, None, float('nan')])
+        self.assertEqual(whole.count, 3001)
+        self.assertEqual(whole.rank(0), 1 / 3001)
+
+    def test_empty_sketch(self):
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+        self.assertIsNone(QuantileSketch().rank(10))
+
+
+class CohortSketchImportTests(ImportedUserMixin, TestCase):
+    def sketch_state(self) -> dict:
+        return {
+            row.metric: (row.count, row.zero_count, row.buckets)
+            for row in CohortSketch.objects.filter(age_band=age_band(self.user_data), gender=1)
+        }
+
+    def test_import_and_reimport_keep_counts(self):
+        self.import_export(make_export_rows())
+        state = self.sketch_state()
+        self.assertEqual(state['sleep_efficiency'][0], 3)
+        self.assertEqual(state['duration'][0], 3)
+
+        # Повторный полный и инкрементальный импорт заменяют значения, а не добавляют их
+        self.import_export(make_export_rows())
+        self.import_export(make_export_rows(nights=4), incremental=True)
+        self.assertEqual(self.sketch_state()['sleep_efficiency'][0], 4)
+
+    def test_reimport_after_cohort_change_removes_from_counted_cohort(self):
+        self.import_export(make_export_rows())
+        old_band = age_band(self.user_data)
+        self.assertEqual(set(SleepStatistics.objects.values_list('cohort_age_band', 'cohort_gender')),
+                         {(old_band, 1)})
+
+        # Пользователь перешёл в другую возрастную группу и сменил пол в профиле
+        self.user_data.date_of_birth = datetime(1960, 1, 1).date()
+        self.user_data.gender = 2
+        self.user_data.save()
+        self.import_export(make_export_rows())
+
+        old = CohortSketch.objects.get(age_band=old_band, gender=1, metric='sleep_efficiency')
+        new = CohortSketch.objects.get(age_band=age_band(self.user_data), gender=2, metric='sleep_efficiency')
+        self.assertEqual((old.count, old.buckets), (0, {}))
+        self.assertEqual(new.count, 3)
+        self.assertEqual(set(SleepStatistics.objects.values_list('cohort_age_band', 'cohort_gender')),
+                         {(age_band(self.user_data), 2)})
+
+    def test_rebuild_matches_incremental_updates(self):
+        self.import_export(make_export_rows(nights=4))
+        incremental = self.sketch_state()
+
+        CohortSketch.objects.all().delete()
+        SleepStatistics.objects.update(cohort_age_band=None, cohort_gender=None)
+        call_command('rebuild_cohort_sketches', stdout=StringIO())
+        self.assertEqual(self.sketch_state(), incremental)
+        self.assertFalse(SleepStatistics.objects.filter(cohort_age_band__isnull=True).exists())
+
+    def test_benchmarks_for_latest_statistics(self):
+        self.import_export(make_export_rows())
+        latest = SleepStatistics.objects.filter(user=self.user).order_by('-date').first()
+
+        benchmarks = user_cohort_benchmarks(self.user_data, latest)
+        self.assertEqual(set(benchmarks), {'sleep_efficiency', 'duration', 'latency_minutes',
+                                           'sleep_fragmentation_index', 'deep_percent', 'rem_percent'})
+        self.assertGreater(benchmarks['duration']['percentile'], 0)
+        self.assertEqual(cohort_percentile(self.user_data, 'duration', 10 ** 6), 100.0)
+        self.assertEqual(user_cohort_benchmarks(self.user_data, None), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
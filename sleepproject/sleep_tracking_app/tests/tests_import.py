@@ -0,0 +1,732 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+from io import StringIO
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from sleep_tracking_app.csv_data_extraction import sleep_record_from_csv, sleep_record_from_csv_chunks, \
+    assign_night_records, decode_heart_rate_payloads, decode_sleep_payloads
+from sleep_tracking_app.sleep_import import upsert_sleep_records, checkpoint, copy_loader, ThrottledProgress, \
+    sleep_statistics_from_frames, pack_heart_rate_frame, night_fingerprints, report_shard_progress, copy_frame, \
+    supports_copy
+from sleep_tracking_app.models import UserData, SleepRecord, SleepSegment, NightHeartRateEntry, SleepStatistics, \
+    ImportCheckpoint, SleepRollingAggregate, NightHeartRateSeries, SleepBaseline
+from sleep_tracking_app.sleep_statistic import calculate_sleep_statistics_metrics, stage_heart_rate_stats, \
+    stage_heart_rate_for_records, night_heart_rate_frame, hypnogram_frame, calculate_cycle_count, \
+    get_sleep_phases_pie_data, get_sleep_phases_trend
+from sleep_tracking_app.tasks import import_sleep_records, abort_sleep_import
+
+User = get_user_model()
+
+
+def make_sleep_value(bedtime: datetime, segments: list) -> str:
+    """
+    Собирает JSON записи сна в формате выгрузки Mi Fitness.
+    segments: список (state, минуты) подряд начиная с bedtime
+    """
+    items = []
+    start = int(bedtime.timestamp())
+    durations = {2: 0, 3: 0, 4: 0, 5: 0}
+    for state, minutes in segments:
+        items.append({'start_time': start, 'end_time': start + minutes * 60, 'state': state})
+        durations[state] += minutes
+        start += minutes * 60
+
+    bed = int(bedtime.timestamp())
+    return json.dumps({
+        'version': 2,
+        'has_stage': True,
+        'timezone': 0,
+        'items': items,
+        'bedtime': bed,
+        'device_bedtime': bed,
+        'wake_up_time': start,
+        'device_wake_up_time': start,
+        'duration': durations[2] + durations[3] + durations[4],
+        'sleep_light_duration': durations[2],
+        'sleep_deep_duration': durations[3],
+        'sleep_rem_duration': durations[4],
+        'sleep_awake_duration': durations[5],
+        'awake_count': sum(1 for state, _ in segments if state == 5),
+        'has_rem': durations[4] > 0,
+        'min_hr': 50,
+        'max_hr': 80,
+        'avg_hr': 60,
+    })
+
+
+def make_export_rows(nights: int = 3, first_night: datetime = datetime(2025, 11, 20, 22, 0, tzinfo=dt_timezone.utc),
+                     hr_step_seconds: int = 600) -> list:
+    """Строки выгрузки: по записи сна на ночь и пульс каждые hr_step_seconds секунд весь период"""
+    segments = [(2, 30), (3, 60), (4, 20), (5, 5), (2, 60), (3, 40), (4, 30), (2, 155)]
+    rows = []
+    for n in range(nights):
+        bedtime = first_night + timedelta(days=n)
+        wake = bedtime + timedelta(minutes=sum(m for _, m in segments))
+        rows.append({'Uid': 1, 'Sid': 's', 'Key': 'sleep', 'Time': int(wake.timestamp()),
+                     'Value': make_sleep_value(bedtime, segments), 'UpdateTime': 0})
+
+    start = int(first_night.timestamp()) - 3600
+    end = int((first_night + timedelta(days=nights)).timestamp())
+    for i, t in enumerate(range(start, end, hr_step_seconds)):
+        rows.append({'Uid': 1, 'Sid': 's', 'Key': 'heart_rate', 'Time': t,
+                     'Value': json.dumps({'time': t, 'bpm': 55 + i % 20}), 'UpdateTime': 0})
+        if i % 50 == 0:
+            rows.append({'Uid': 1, 'Sid': 's', 'Key': 'steps', 'Time': t,
+                         'Value': json.dumps({'time': t, 'steps': 10}), 'UpdateTime': 0})
+    return rows
+
+
+def write_export_csv(rows: list) -> str:
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['Uid', 'Sid', 'Key', 'Time', 'Value', 'UpdateTime'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+class ImportedUserMixin:
+    """Общая подготовка тестов импорта: пользователь с анкетой и импорт выгрузки задачей импорта"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='importer', password='pass12345', email='i@e.com')
+        self.user_data = UserData.objects.create(user=self.user, date_of_birth=datetime(1990, 1, 1).date(),
+                                                 weight=70, gender=1, height=175)
+
+    def import_export(self, rows: list = None, **kwargs) -> dict:
+        """Импортирует строки выгрузки (по умолчанию make_export_rows()) и возвращает результат задачи"""
+        csv_path = write_export_csv(make_export_rows() if rows is None else rows)
+        # throw=False: Retry не пробрасывается из eager-вызова, а выполняется повтором, как на воркере
+        return import_sleep_records.apply(args=(self.user.id, csv_path), kwargs=kwargs, throw=False).get()
+
+
+class CsvExtractionTests(unittest.TestCase):
+    def setUp(self):
+        self.rows = make_export_rows()
+        self.csv_path = write_export_csv(self.rows)
+
+    def tearDown(self):
+        os.remove(self.csv_path)
+
+    def test_chunked_matches_in_memory(self):
+        expected = sleep_record_from_csv(pd.read_csv(self.csv_path))
+        # Маленький кусок, чтобы записи одной ночи оказались в разных кусках
+        result = sleep_record_from_csv_chunks(self.csv_path, chunksize=17)
+
+        self.assertIsNotNone(result)
+        for exp, res in zip(expected, result):
+            pd.testing.assert_frame_equal(res, exp, check_dtype=False)
+
+    def test_chunked_parses_nights(self):
+        meta, items, night_hr = sleep_record_from_csv_chunks(self.csv_path, chunksize=50)
+        self.assertEqual(len(meta), 3)
+        self.assertEqual(len(items), 3 * 8)
+        self.assertFalse(night_hr.empty)
+
+    def test_frames_keep_native_datetimes(self):
+        meta, items, night_hr = sleep_record_from_csv_chunks(self.csv_path)
+
+        for index in (meta.index, items.index, night_hr.index):
+            self.assertIsInstance(index, pd.DatetimeIndex)
+            self.assertEqual(str(index.tz), 'UTC')
+        for column in (meta['device_bedtime'], meta['wake_up_time'], items['start_time'], night_hr['sleep_time']):
+            self.assertIsInstance(column.dtype, pd.DatetimeTZDtype)
+        self.assertTrue(night_hr['sleep_time'].isin(meta.index).all())
+
+    def test_decoders_build_typed_columns(self):
+        heart = decode_heart_rate_payloads(pd.Series(['{"time": 60, "bpm": 58}', '{"bpm": 61, "time": 120}']))
+        self.assertEqual(heart['bpm'].tolist(), [58, 61])
+        self.assertEqual(heart.index[1], pd.Timestamp(120, unit='s', tz='UTC'))
+
+        sleep_rows = [r for r in self.rows if r['Key'] == 'sleep']
+        meta, items = decode_sleep_payloads(pd.Series([r['Time'] for r in sleep_rows]),
+                                            pd.Series([r['Value'] for r in sleep_rows]))
+        self.assertEqual(list(items.columns), ['start_time', 'end_time', 'state'])
+        self.assertEqual(len(items.loc[meta.index[0]]), 8)
+        self.assertNotIn('items', meta.columns)
+
+    def test_duplicated_sleep_row_keeps_one_set_of_segments(self):
+        rows = make_export_rows(nights=1)
+        sleep_row = rows[0]
+        # Повтор той же ночи в конце выгрузки, чтобы он попал в другой кусок
+        path = write_export_csv(rows + [dict(sleep_row)])
+        try:
+            for result in (sleep_record_from_csv(pd.read_csv(path)), sleep_record_from_csv_chunks(path, chunksize=17)):
+                meta, items, night_hr = result
+                self.assertEqual(len(meta), 1)
+                self.assertEqual(len(items), 8)
+                self.assertTrue(night_hr['sleep_time'].isin(meta.index).all())
+        finally:
+            os.remove(path)
+
+    def test_chunked_rejects_missing_columns(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write('Key,Time\nsleep,1\n')
+        try:
+            self.assertIsNone(sleep_record_from_csv_chunks(path))
+        finally:
+            os.remove(path)
+
+    def test_chunked_rejects_export_without_sleep(self):
+        rows = [r for r in self.rows if r['Key'] != 'sleep']
+        path = write_export_csv(rows)
+        try:
+            self.assertIsNone(sleep_record_from_csv_chunks(path))
+        finally:
+            os.remove(path)
+
+
+class NightFingerprintTests(unittest.TestCase):
+    def fingerprints(self, rows: list) -> pd.Series:
+        return night_fingerprints(*sleep_record_from_csv(pd.DataFrame(rows)))
+
+    def test_missing_flag_in_one_night_changes_only_that_night(self):
+        rows = make_export_rows(nights=5)
+        before = self.fingerprints(rows)
+
+        # Без has_rem в одной ночи колонка всей выгрузки становится object
+        value = json.loads(rows[2]['Value'])
+        del value['has_rem']
+        rows[2] = dict(rows[2], Value=json.dumps(value))
+        self.assertEqual(sleep_record_from_csv(pd.DataFrame(rows))[0]['has_rem'].dtype, object)
+
+        after = self.fingerprints(rows)
+        self.assertEqual((before != after).tolist(), [False, False, True, False, False])
+
+    def test_heart_rate_time_shift_changes_night(self):
+        meta, items, night_hr = sleep_record_from_csv(pd.DataFrame(make_export_rows()))
+        before = night_fingerprints(meta, items, night_hr)
+        shifted = night_hr.set_axis(night_hr.index.where(night_hr['sleep_time'] != meta.index[1],
+                                                         night_hr.index + pd.Timedelta(seconds=1)))
+        after = night_fingerprints(meta, items, shifted)
+        self.assertEqual((before != after).tolist(), [False, True, False])
+
+    def test_integer_and_float_columns_hash_equally(self):
+        meta, items, night_hr = sleep_record_from_csv(pd.DataFrame(make_export_rows()))
+        expected = night_fingerprints(meta, items, night_hr)
+        meta = meta.astype({'duration': 'float64', 'has_rem': object})
+        pd.testing.assert_series_equal(night_fingerprints(meta, items, night_hr), expected)
+
+
+class AssignNightRecordsTests(unittest.TestCase):
+    def test_labels_samples_with_owning_interval(self):
+        ts = pd.Timestamp
+        intervals = pd.DataFrame({
+            'start': [ts('2025-11-21 22:00', tz='UTC'), ts('2025-11-20 22:00', tz='UTC')],
+            'end': [ts('2025-11-22 06:00', tz='UTC'), ts('2025-11-21 06:00', tz='UTC')],
+        })
+        heart_idx = pd.DatetimeIndex(['2025-11-20 21:59', '2025-11-20 22:00', '2025-11-21 05:59',
+                                      '2025-11-21 06:00', '2025-11-21 23:00', '2025-11-22 07:00'], tz='UTC')
+
+        owner = assign_night_records(heart_idx, intervals)
+        self.assertEqual(owner.tolist(), [-1, 1, 1, -1, 0, -1])
+
+    def test_wrap_around_interval_does_not_take_whole_day(self):
+        ts = pd.Timestamp
+        # Конец раньше начала: ночь 23:00 -> 07:00 с ошибочной датой подъёма
+        intervals = pd.DataFrame({'start': [ts('2025-11-20 23:00', tz='UTC')],
+                                  'end': [ts('2025-11-20 07:00', tz='UTC')]})
+        heart_idx = pd.DatetimeIndex(['2025-11-20 06:00', '2025-11-20 12:00', '2025-11-21 02:00',
+                                      '2025-11-21 08:00'], tz='UTC')
+
+        owner = assign_night_records(heart_idx, intervals)
+        self.assertEqual(owner.tolist(), [-1, -1, 0, -1])
+
+
+class StageHeartRateTests(unittest.TestCase):
+    def test_samples_are_joined_to_segment_stages(self):
+        ts = pd.Timestamp
+        night = ts('2025-11-21 06:00', tz='UTC')
+        starts = [ts('2025-11-20 22:00', tz='UTC'), ts('2025-11-20 23:00', tz='UTC')]
+        ends = [ts('2025-11-20 23:00', tz='UTC'), ts('2025-11-21 00:00', tz='UTC')]
+        hr_times = pd.DatetimeIndex(['2025-11-20 21:50', '2025-11-20 22:10', '2025-11-20 22:40',
+                                     '2025-11-20 23:00', '2025-11-20 23:30'], tz='UTC')
+
+        stats = stage_heart_rate_stats([night, night], starts, ends, [2, 3], hr_times, [90, 60, 64, 50, 54])
+
+        # Замер до начала первого сегмента не учитывается; среднее по ночи — 57
+        self.assertEqual(stats[night]['light'], {'mean': 62.0, 'min': 60, 'max': 64,
+                                                 'dip': round((57 - 62) / 57 * 100, 1)})
+        self.assertEqual(stats[night]['deep'], {'mean': 52.0, 'min': 50, 'max': 54,
+                                                'dip': round((57 - 52) / 57 * 100, 1)})
+
+
+class FakeRecorder:
+    def __init__(self):
+        self.calls = []
+
+    def set_progress(self, current, total, description=''):
+        self.calls.append((current, total, description))
+
+
+class ThrottledProgressTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.recorder = FakeRecorder()
+        self.progress = ThrottledProgress(self.recorder, min_interval=1.0, min_delta=5.0, clock=lambda: self.now)
+
+    def test_updates_are_limited_by_time_and_delta(self):
+        span = self.progress.stages({'parse': 1})['parse']
+        for night in range(1, 1001):
+            self.now += 0.01
+            span.set_progress(night, 1000, 'Записи сна')
+
+        # 10 секунд: первое обновление, не больше одного в секунду и финальное
+        self.assertLessEqual(len(self.recorder.calls), 12)
+        self.assertEqual(self.recorder.calls[0][0], 0.1)
+        self.assertEqual(self.recorder.calls[-1], (100.0, 100, 'Записи сна'))
+
+    def test_small_delta_is_skipped(self):
+        span = self.progress.stages({'parse': 1})['parse']
+        span.set_progress(10, 100)
+        self.now += 5
+        span.set_progress(12, 100)
+        self.now += 5
+        span.set_progress(16, 100)
+        self.assertEqual([call[0] for call in self.recorder.calls], [10.0, 16.0])
+
+    def test_stage_spans_map_to_overall_scale(self):
+        stages = self.progress.stages({'parse': 30, 'import': 70})
+        shard = stages['import'].span(5, 5, 10)
+        shard.set_progress(2, 4, 'Сегменты сна')
+        self.assertEqual(self.recorder.calls, [(82.5, 100, 'Сегменты сна')])
+
+
+class ImportSleepRecordsTaskTests(ImportedUserMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = make_export_rows()
+
+    def run_import(self, rows: list, **kwargs) -> dict:
+        csv_path = write_export_csv(rows)
+        # throw=False: Retry не пробрасывается из eager-вызова, а выполняется повтором, как на воркере
+        result = import_sleep_records.apply(args=(self.user.id, csv_path), kwargs=kwargs, throw=False).get()
+        self.assertFalse(os.path.exists(csv_path))
+        return result
+
+    def test_import_creates_records_and_children(self):
+        result = self.run_import(self.rows)
+
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(SleepRecord.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(SleepSegment.objects.filter(record__user=self.user).count(), 3 * 8)
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(set(SleepStatistics.objects.values_list('cycle_count', flat=True)), {2})
+        self.assertEqual(SleepRollingAggregate.objects.filter(user=self.user).order_by('-date').first().nights, 3)
+
+        record = SleepRecord.objects.filter(user=self.user).order_by('sleep_date_time').first()
+        self.assertEqual(len(bytes(record.sleep_bitmap)), 360)
+        self.assertEqual(record.statistics.stage_heart_rate, stage_heart_rate_for_records([record.pk])[record.pk])
+        self.assertEqual(set(record.statistics.stage_heart_rate), {'light', 'deep', 'rem', 'awake'})
+        # Пульс ночи хранится одной упакованной строкой
+        self.assertFalse(NightHeartRateEntry.objects.exists())
+        hr_times, hr_bpm = record.night_heart_rate()
+        self.assertEqual(record.hr_series.count, len(hr_times))
+        self.assertTrue(len(hr_times))
+        bounds = np.array([record.device_bedtime.timestamp(), record.device_wake_up_time.timestamp()])
+        self.assertTrue(((hr_times.astype('int64') >= bounds[0]) & (hr_times.astype('int64') <= bounds[1])).all())
+
+    def test_reimport_is_idempotent(self):
+        self.run_import(self.rows)
+        counts = (SleepRecord.objects.count(), SleepSegment.objects.count(), NightHeartRateSeries.objects.count(),
+                  SleepStatistics.objects.count())
+        self.run_import(self.rows)
+        self.assertEqual(counts, (SleepRecord.objects.count(), SleepSegment.objects.count(),
+                                  NightHeartRateSeries.objects.count(), SleepStatistics.objects.count()))
+
+    def test_incremental_import_touches_only_changed_nights(self):
+        self.run_import(self.rows, incremental=True)
+        stats_before = dict(SleepStatistics.objects.values_list('record_id', 'id'))
+
+        # Повторная загрузка той же выгрузки ничего не меняет
+        self.assertEqual(self.run_import(self.rows, incremental=True)['imported'], 0)
+
+        # Новая ночь и изменённый пульс в первой ночи
+        rows = make_export_rows(nights=4)
+        first_hr = next(r for r in rows if r['Key'] == 'heart_rate' and r['Time'] >= rows[0]['Time'] - 60 * 60)
+        first_hr['Value'] = json.dumps({'time': first_hr['Time'], 'bpm': 99})
+        result = self.run_import(rows, incremental=True)
+
+        self.assertEqual(result['imported'], 2)
+        self.assertEqual(SleepRecord.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user).count(), 4)
+        stats_after = dict(SleepStatistics.objects.values_list('record_id', 'id'))
+        unchanged = [record_id for record_id, stat_id in stats_before.items() if stats_after[record_id] == stat_id]
+        self.assertEqual(len(unchanged), 2)
+
+    def test_sharded_import_matches_plain_import(self):
+        # Ночи с 29 ноября по 3 декабря попадают в два месячных шарда
+        rows = make_export_rows(nights=5, first_night=datetime(2025, 11, 29, 22, 0, tzinfo=dt_timezone.utc))
+        self.run_import(rows)
+        expected = (SleepRecord.objects.count(), SleepSegment.objects.count(), NightHeartRateSeries.objects.count(),
+                    SleepStatistics.objects.count())
+
+        result = self.run_import(rows, sharded=True)
+
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(result['imported'], 5)
+        self.assertEqual(result['shards'], 2)
+        self.assertEqual(expected, (SleepRecord.objects.count(), SleepSegment.objects.count(),
+                                    NightHeartRateSeries.objects.count(), SleepStatistics.objects.count()))
+
+    def test_sharded_import_reports_progress_per_shard(self):
+        rows = make_export_rows(nights=5, first_night=datetime(2025, 11, 29, 22, 0, tzinfo=dt_timezone.utc))
+        with mock.patch('sleep_tracking_app.tasks.report_shard_progress', wraps=report_shard_progress) as report:
+            self.run_import(rows, sharded=True)
+
+        task_ids = {call.args[1] for call in report.call_args_list}
+        self.assertEqual(len(task_ids), 1)
+        self.assertIsNotNone(task_ids.pop())
+        self.assertEqual([call.args[2:4] for call in report.call_args_list], [(0, 2), (1, 2), (2, 2), (2, 2)])
+
+    def test_failed_import_resumes_from_checkpoint(self):
+        rows = make_export_rows(nights=5, first_night=datetime(2025, 11, 29, 22, 0, tzinfo=dt_timezone.utc))
+        real_import = checkpoint.import_sleep_frames
+        calls = []
+
+        def flaky_import(user, user_data, meta, *args, **kwargs):
+            calls.append(meta.index.min().month)
+            # Первая попытка падает на втором шарде, уже после записи первого
+            if len(calls) == 2:
+                raise RuntimeError('worker lost')
+            return real_import(user, user_data, meta, *args, **kwargs)
+
+        with mock.patch.object(checkpoint, 'import_sleep_frames', side_effect=flaky_import):
+            result = self.run_import(rows)
+
+        # Ноябрьский шард записан один раз, декабрьский — повторной попыткой
+        self.assertEqual(calls, [11, 12, 12])
+        self.assertEqual(result, {'status': 'completed', 'imported': 5})
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user).count(), 5)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_exhausted_retries_close_import(self):
+        rows = make_export_rows(nights=5, first_night=datetime(2025, 11, 29, 22, 0, tzinfo=dt_timezone.utc))
+        csv_path = write_export_csv(rows)
+        real_import = checkpoint.import_sleep_frames
+
+        def broken_december(user, user_data, meta, *args, **kwargs):
+            if meta.index.min().month == 12:
+                raise RuntimeError('bad shard')
+            return real_import(user, user_data, meta, *args, **kwargs)
+
+        # Последняя попытка: повторов больше не будет
+        with mock.patch.object(checkpoint, 'import_sleep_frames', side_effect=broken_december):
+            result = import_sleep_records.apply(args=(self.user.id, csv_path), retries=import_sleep_records.max_retries,
+                                                throw=False)
+
+        # Как у шардированного errback: отметки сняты, суммы и базовая линия учитывают записанный шард
+        self.assertIsInstance(result.result, RuntimeError)
+        self.assertFalse(os.path.exists(csv_path))
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        nights = SleepRecord.objects.filter(user=self.user).count()
+        self.assertGreater(nights, 0)
+        self.assertEqual(SleepRollingAggregate.objects.filter(user=self.user).order_by('-date').first().nights,
+                         nights)
+        self.assertEqual(SleepBaseline.objects.get(user=self.user).state['sleep_efficiency']['n'], nights)
+
+    def test_preparation_error_removes_temporary_files(self):
+        for sharded in (False, True):
+            csv_path = write_export_csv(self.rows)
+            with mock.patch('sleep_tracking_app.tasks.split_into_shards', side_effect=ValueError('bad value')), \
+                    self.assertRaises(ValueError):
+                import_sleep_records.apply(args=(self.user.id, csv_path), kwargs={'sharded': sharded})
+            self.assertFalse(os.path.exists(csv_path))
+            self.assertFalse(os.path.exists(f'{csv_path}.shards'))
+
+    def test_failed_shard_keeps_files_until_errback(self):
+        rows = make_export_rows(nights=5, first_night=datetime(2025, 11, 29, 22, 0, tzinfo=dt_timezone.utc))
+        csv_path = write_export_csv(rows)
+        real_import = checkpoint.import_sleep_frames
+
+        def broken_december(user, user_data, meta, *args, **kwargs):
+            if meta.index.min().month == 12:
+                raise RuntimeError('bad shard')
+            return real_import(user, user_data, meta, *args, **kwargs)
+
+        with mock.patch.object(checkpoint, 'import_sleep_frames', side_effect=broken_december), \
+                mock.patch('sleep_tracking_app.tasks.import_sleep_shard.default_retry_delay', 0), \
+                self.assertRaises(Exception):
+            # В eager-режиме ошибка шарда пробрасывается из chord, не доходя до errback
+            import_sleep_records.apply(args=(self.user.id, csv_path), kwargs={'sharded': True}, throw=False)
+
+        # Шард исчерпал повторы: finalize не запускался, CSV и каталог шардов на месте
+        shard_dir = f'{csv_path}.shards'
+        self.assertTrue(os.path.exists(csv_path))
+        self.assertTrue(os.path.isdir(shard_dir))
+        file_hash = ImportCheckpoint.objects.values_list('file_hash', flat=True).get()
+
+        # Errback chord'а доводит производные данные до записанного шарда и удаляет временные файлы
+        outcome = abort_sleep_import(mock.Mock(id='shard'), RuntimeError('bad shard'), None, self.user.id,
+                                     file_hash, shard_dir, '2025-11-29', csv_path)
+
+        self.assertEqual(outcome['status'], 'error')
+        self.assertEqual(outcome['imported'], SleepRecord.objects.filter(user=self.user).count())
+        self.assertFalse(os.path.exists(csv_path))
+        self.assertFalse(os.path.exists(shard_dir))
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        self.assertEqual(SleepRollingAggregate.objects.filter(user=self.user).order_by('-date').first().nights,
+                         outcome['imported'])
+
+    def test_frame_statistics_match_record_statistics(self):
+        csv_path = write_export_csv(self.rows)
+        meta, items, _ = sleep_record_from_csv_chunks(csv_path)
+        os.remove(csv_path)
+        # Первый сегмент позже отхода ко сну, чтобы латентность была ненулевой
+        meta['bedtime'] = meta['bedtime'] - pd.Timedelta(minutes=12)
+        record_map = upsert_sleep_records(self.user, meta)
+        for record in SleepRecord.objects.filter(pk__in=record_map.values()):
+            for item in items.loc[[pd.Timestamp(record.sleep_date_time)]].itertuples():
+                SleepSegment.objects.create(record=record, start_time=item.start_time, end_time=item.end_time,
+                                            state=item.state)
+
+        user_data = UserData.objects.get(user=self.user)
+        args = (user_data.get_age_months(), user_data.gender, user_data.weight, user_data.height)
+        frame_stats = sleep_statistics_from_frames(meta, items, *args)
+
+        for record in SleepRecord.objects.filter(pk__in=record_map.values()):
+            expected = calculate_sleep_statistics_metrics(record, *args)
+            actual = frame_stats.loc[pd.Timestamp(record.sleep_date_time)]
+            self.assertAlmostEqual(actual['latency_minutes'], expected['latency_minutes'])
+            self.assertAlmostEqual(actual['sleep_efficiency'], expected['sleep_efficiency'])
+            self.assertAlmostEqual(actual['sleep_fragmentation_index'], expected['sleep_fragmentation_index'])
+            self.assertAlmostEqual(actual['sleep_calories_burned'], expected['sleep_calories_burned'])
+            for phase, value in expected['sleep_phases'].items():
+                self.assertAlmostEqual(actual['sleep_phases'][phase], value)
+            self.assertEqual(actual['date'], record.sleep_date_time.date())
+            self.assertEqual(actual['latency_minutes'], 12)
+
+    def test_upsert_returns_ids_and_updates_existing(self):
+        csv_path = write_export_csv(self.rows)
+        meta, _, _ = sleep_record_from_csv_chunks(csv_path)
+        os.remove(csv_path)
+        first_ids = upsert_sleep_records(self.user, meta)
+        self.assertEqual(set(first_ids), set(meta.index))
+
+        meta['duration'] = 100
+        second_ids = upsert_sleep_records(self.user, meta)
+
+        self.assertEqual(first_ids, second_ids)
+        self.assertEqual(set(SleepRecord.objects.filter(user=self.user).values_list('duration', flat=True)), {100})
+
+    def test_invalid_csv_returns_error(self):
+        result = self.run_import([r for r in self.rows if r['Key'] != 'sleep'])
+        self.assertEqual(result['status'], 'error')
+
+
+class CopyFrameTests(unittest.TestCase):
+    def copy_payload(self, model, frame: pd.DataFrame, **kwargs) -> tuple:
+        """Выполняет copy_frame с подменённым курсором и возвращает SQL и переданный в COPY текст"""
+        written = []
+        connection = mock.MagicMock()
+        connection.ops.quote_name = lambda name: f'"{name}"'
+        copy = connection.cursor.return_value.__enter__.return_value.copy
+        copy.return_value.__enter__.return_value.write.side_effect = written.append
+        with mock.patch.object(copy_loader, 'connection', connection):
+            copy_frame(model, frame, **kwargs)
+        return copy.call_args.args[0], ''.join(written)
+
+    def test_payload_escapes_text_and_writes_nulls(self):
+        frame = pd.DataFrame({
+            'user_id': [1, 2],
+            'date': [datetime(2025, 11, 21).date(), None],
+            'sleep_efficiency': [91.5, float('nan')],
+            'health_impact': ['tab\there\nnew line\\slash', None],
+            'sleep_phases': [{'note': 'a\tb\nc', 'deep': 20}, None],
+        })
+        sql, payload = self.copy_payload(SleepStatistics, frame)
+
+        self.assertEqual(sql, 'COPY "sleep_tracking_app_sleepstatistics" '
+                              '("user_id", "date", "sleep_efficiency", "health_impact", "sleep_phases") FROM STDIN')
+        self.assertEqual(payload, (
+            '1\t2025-11-21\t91.5\ttab\\there\\nnew line\\\\slash\t{"note": "a\\\\tb\\\\nc", "deep": 20}\n'
+            '2\t\\N\t\\N\t\\N\t\\N\n'
+        ))
+
+    def test_payload_keeps_timezone_and_duplicate_index(self):
+        # Индекс — время записи сна, у всех замеров ночи он одинаковый
+        night = pd.Timestamp('2025-11-21 07:00', tz='UTC')
+        frame = pd.DataFrame({
+            'record_id': [5, 5, 5],
+            'time': pd.to_datetime(['2025-11-20 23:00:00', '2025-11-20 23:01:00', None], utc=True),
+            'bpm': [58, 57, 60],
+        }, index=pd.DatetimeIndex([night] * 3))
+        _, payload = self.copy_payload(NightHeartRateEntry, frame, chunk_size=2)
+
+        self.assertEqual(payload, '5\t2025-11-20 23:00:00+00:00\t58\n'
+                                  '5\t2025-11-20 23:01:00+00:00\t57\n'
+                                  '5\t\\N\t60\n')
+
+
+@unittest.skipUnless(supports_copy(), "COPY есть только на PostgreSQL с psycopg 3")
+class CopyFrameRoundTripTests(TestCase):
+    def test_copied_text_and_json_round_trip(self):
+        user = User.objects.create_user(username='copier', password='pass12345', email='c@e.com')
+        impact = 'tab\there\nnew line\r\\slash "quoted"'
+        phases = {'note': 'a\tb\nc\\', 'deep': 20}
+        frame = pd.DataFrame({'user_id': [user.pk], 'date': [datetime(2025, 11, 21).date()],
+                              'health_impact': [impact], 'sleep_phases': [phases], 'sleep_efficiency': [None]})
+
+        copy_frame(SleepStatistics, frame)
+
+        stat = SleepStatistics.objects.get(user=user)
+        self.assertEqual((stat.health_impact, stat.sleep_phases, stat.sleep_efficiency), (impact, phases, None))
+
+
+class NightHeartRateSeriesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='packer', password='pass12345', email='p@e.com')
+        self.start = datetime(2025, 11, 20, 23, 0, tzinfo=dt_timezone.utc)
+        self.record = SleepRecord.objects.create(user=self.user, sleep_date_time=self.start + timedelta(hours=8))
+        self.times = [self.start + timedelta(seconds=s) for s in (0, 60, 125, 3600, 7300)]
+        self.bpm = [58, 57, 61, 55, 70]
+
+    def test_pack_round_trip(self):
+        frame = pd.DataFrame({'record_id': self.record.pk, 'time': self.times[::-1], 'bpm': self.bpm[::-1]})
+        series, overflow = pack_heart_rate_frame(frame)
+        self.assertTrue(overflow.empty)
+        series[0].save()
+
+        times, bpm = SleepRecord.objects.get(pk=self.record.pk).night_heart_rate()
+        self.assertEqual(times.astype('int64').tolist(), [int(t.timestamp()) for t in self.times])
+        self.assertEqual(bpm.tolist(), self.bpm)
+        self.assertEqual(len(bytes(series[0].offsets)) + len(bytes(series[0].bpm)), 3 * len(self.times))
+
+    def test_long_gap_is_kept_as_rows(self):
+        frame = pd.DataFrame({'record_id': self.record.pk, 'bpm': [60, 61],
+                              'time': [self.start, self.start + timedelta(hours=20)]})
+        series, overflow = pack_heart_rate_frame(frame)
+        self.assertEqual((len(series), len(overflow)), (0, 2))
+
+    def test_pulse_above_uint8_is_kept_as_rows(self):
+        other = SleepRecord.objects.create(user=self.user, sleep_date_time=self.start + timedelta(days=1, hours=8))
+        frame = pd.DataFrame({'record_id': [self.record.pk] * 3 + [other.pk], 'bpm': [60, 280, 61, 62],
+                              'time': self.times[:3] + [self.start + timedelta(days=1)]})
+        series, overflow = pack_heart_rate_frame(frame)
+        self.assertEqual([item.record_id for item in series], [other.pk])
+        self.assertEqual(overflow['bpm'].tolist(), [60, 280, 61])
+
+        for row in overflow.itertuples():
+            NightHeartRateEntry.objects.create(record_id=row.record_id, time=row.time, bpm=row.bpm)
+        self.assertEqual(self.record.night_heart_rate()[1].tolist(), [60, 280, 61])
+        with self.assertRaises(ValueError):
+            NightHeartRateSeries.pack(self.record.pk, np.array([0, 60]), np.array([60, 280]))
+
+    def test_legacy_rows_are_read_and_packed(self):
+        for time, bpm in zip(self.times, self.bpm):
+            NightHeartRateEntry.objects.create(record=self.record, time=time, bpm=bpm)
+        before = night_heart_rate_frame([self.record.pk])
+        self.assertEqual(self.record.night_heart_rate()[1].tolist(), self.bpm)
+
+        out = StringIO()
+        call_command('pack_night_heart_rate', stdout=out)
+        self.assertIn('Упаковано ночей: 1', out.getvalue())
+        self.assertFalse(NightHeartRateEntry.objects.exists())
+        pd.testing.assert_frame_equal(night_heart_rate_frame([self.record.pk]), before)
+
+
+class HypnogramTests(ImportedUserMixin, TestCase):
+    def test_pack_merges_runs_and_keeps_gaps(self):
+        base = 1_700_000_000
+        starts = np.array([0, 600, 1200, 1500, 4000, 4100]) + base
+        ends = np.array([600, 1200, 1600, 3000, 4100, 4100 + 70_000]) + base
+        states = np.array([2, 2, 3, 4, 5, 2])
+        start, packed_states, packed_durations = SleepRecord.pack_hypnogram(starts, ends, states)
+
+        self.assertEqual(np.frombuffer(packed_states, dtype='uint8').tolist(), [2, 3, 4, 0, 5, 2, 2])
+        self.assertEqual(np.frombuffer(packed_durations, dtype='<u2').sum(), ends[-1] - starts[0])
+
+        run_starts, run_ends, run_states = SleepRecord.unpack_hypnogram(start, packed_states, packed_durations)
+        self.assertEqual(run_states.tolist(), [2, 3, 4, 5, 2, 2])
+        # Перекрывающийся сегмент REM обрезан по концу предыдущего
+        self.assertEqual((run_starts.astype('int64') - base).tolist()[:4], [0, 1200, 1600, 4000])
+        self.assertEqual(run_ends.astype('int64')[-1], ends[-1])
+
+    def test_import_writes_hypnogram_matching_segments(self):
+        self.import_export()
+
+        record = SleepRecord.objects.filter(user=self.user).order_by('sleep_date_time').first()
+        segments = list(record.segments.order_by('start_time').values_list('start_time', 'end_time', 'state'))
+        starts, ends, states = record.hypnogram()
+        self.assertEqual(starts[0].astype('int64'), int(segments[0][0].timestamp()))
+        self.assertEqual(ends[-1].astype('int64'), int(segments[-1][1].timestamp()))
+        self.assertEqual(int((ends - starts).astype('int64').sum()),
+                         sum(int((end - start).total_seconds()) for start, end, _ in segments))
+
+        # Для записей без упаковки гипнограмма собирается из сегментов, результат тот же
+        packed = hypnogram_frame([record.pk])
+        SleepRecord.objects.filter(pk=record.pk).update(hypnogram_start=None, hypnogram_states=None,
+                                                        hypnogram_durations=None)
+        legacy = hypnogram_frame([record.pk])
+        self.assertEqual(legacy['state'].tolist(), [state for _, _, state in segments])
+        self.assertEqual(packed['end_time'].iloc[-1], legacy['end_time'].iloc[-1])
+        self.assertEqual(calculate_cycle_count(SleepRecord.objects.get(pk=record.pk)), calculate_cycle_count(record))
+
+
+class RecomputeStatisticsCommandTests(ImportedUserMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_export()
+
+    def test_recompute_restores_statistics_and_keeps_recommendations(self):
+        fields = ('record_id', 'latency_minutes', 'sleep_efficiency', 'sleep_phases', 'deep_percent',
+                  'sleep_calories_burned', 'cycle_count', 'stage_heart_rate')
+        expected = sorted(SleepStatistics.objects.values_list(*fields))
+
+        first = SleepStatistics.objects.order_by('date').first()
+        SleepStatistics.objects.update(sleep_efficiency=0, cycle_count=None, stage_heart_rate=None, deep_percent=None,
+                                       recommended='совет')
+        # Статистика без привязки к записи (до появления поля record) привязывается по дате
+        SleepStatistics.objects.filter(pk=first.pk).update(record=None)
+
+        out = StringIO()
+        call_command('recompute_sleep_statistics', users=[self.user.id], batch_size=2, stdout=out)
+
+        self.assertEqual(sorted(SleepStatistics.objects.values_list(*fields)), expected)
+        self.assertEqual(SleepStatistics.objects.count(), 3)
+        self.assertEqual(set(SleepStatistics.objects.values_list('recommended', flat=True)), {'совет'})
+        self.assertIn('Пересчитано 3 ночей', out.getvalue())
+
+
+class SleepPhaseColumnsTests(ImportedUserMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_export()
+
+    def test_import_writes_phase_columns(self):
+        for stat in SleepStatistics.objects.filter(user=self.user):
+            for phase, field in SleepStatistics.PHASE_FIELDS.items():
+                self.assertAlmostEqual(getattr(stat, field), stat.sleep_phases[phase])
+            self.assertEqual(stat.phase_percentages(), stat.sleep_phases)
+
+    def test_rows_without_columns_fall_back_to_json(self):
+        SleepStatistics.objects.update(**{field: None for field in SleepStatistics.PHASE_FIELDS.values()})
+        stat = SleepStatistics.objects.filter(user=self.user).first()
+        self.assertEqual(stat.phase_percentages(), stat.sleep_phases)
+        self.assertEqual(len(get_sleep_phases_pie_data(stat)), 4)
+
+    def test_phase_trend_is_aggregated_in_database(self):
+        trend = get_sleep_phases_trend(self.user)
+        self.assertEqual(len(trend['weeks']), len(trend['deep']))
+        stats = list(SleepStatistics.objects.filter(user=self.user))
+        deep = [stat.sleep_phases['deep'] for stat in stats]
+        # Все три ночи выгрузки попадают в одну неделю
+        self.assertEqual(trend['weeks'], ['2025-11-17'])
+        self.assertAlmostEqual(trend['deep'][0], round(sum(deep) / len(deep), 2))
+        self.assertEqual(get_sleep_phases_trend(User.objects.create_user(username='empty')), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import unittest
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from sleep_tracking_app.models import SleepRecord, NightHeartRateEntry, NightHeartRateSeries
+from sleep_tracking_app.partitioning import add_months, month_partitions, create_month_partition, \
+    detach_month_partitions, partitioning_supported, PARTITIONED_MODELS
+from sleep_tracking_app.tasks import ensure_heart_rate_partitions_task
+from sleep_tracking_app.tests.tests_import import ImportedUserMixin
+
+ENTRY_TABLE = NightHeartRateEntry._meta.db_table
+SERIES_TABLE = NightHeartRateSeries._meta.db_table
+
+
+class PartitionHelpersTests(unittest.TestCase):
+    def test_add_months_wraps_year(self):
+        self.assertEqual(add_months(date(2025, 11, 1), 3), date(2026, 2, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+
+    def test_heart_rate_time_range_covers_nights(self):
+        nights = [datetime(2025, 11, 21, 7, tzinfo=dt_timezone.utc), datetime(2025, 11, 23, 7, tzinfo=dt_timezone.utc)]
+        lower, upper = SleepRecord.heart_rate_time_range(nights)
+        self.assertLessEqual(lower, nights[0] - timedelta(days=1))
+        self.assertGreater(upper, nights[-1])
+
+    def test_partition_task_skips_unsupported_database(self):
+        with mock.patch('sleep_tracking_app.tasks.partitioning_supported', return_value=False), \
+                mock.patch('sleep_tracking_app.tasks.ensure_month_partitions') as ensure:
+            self.assertEqual(ensure_heart_rate_partitions_task(), 0)
+        ensure.assert_not_called()
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "секционирование есть только на PostgreSQL")
+class HeartRatePartitioningTests(ImportedUserMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_export()
+        self.records = list(SleepRecord.objects.filter(user=self.user).order_by('sleep_date_time'))
+        self.record = self.records[0]
+        # Импорт пакует пульс в ряды, поэтому строки старого формата создаются вручную
+        NightHeartRateEntry.objects.bulk_create(
+            NightHeartRateEntry(record=record, time=record.sleep_date_time - timedelta(hours=1), bpm=60)
+            for record in self.records)
+
+    def explain(self, queryset) -> str:
+        return queryset.explain()
+
+    def test_month_partition_takes_rows_from_default(self):
+        self.assertTrue(partitioning_supported())
+        expected = self.record.night_heart_rate()[1].tolist()
+
+        self.assertTrue(create_month_partition(NightHeartRateEntry, date(2025, 11, 1)))
+        self.assertFalse(create_month_partition(NightHeartRateEntry, date(2025, 11, 15)))
+        self.assertIn(date(2025, 11, 1), month_partitions(NightHeartRateEntry))
+        self.assertEqual(NightHeartRateEntry.objects.filter(record__user=self.user).count(), 3)
+        self.assertEqual(self.record.night_heart_rate()[1].tolist(), expected)
+
+        # Чтение замеров ночи с диапазоном времени затрагивает только секцию её месяца
+        plan = self.explain(NightHeartRateEntry.objects.filter(
+            record=self.record, time__range=SleepRecord.heart_rate_time_range([self.record.sleep_date_time])))
+        self.assertIn('nightheartrateentry_p2025_11', plan)
+        self.assertNotIn('nightheartrateentry_default', plan)
+
+    def test_command_creates_and_detaches_partitions(self):
+        out = StringIO()
+        call_command('manage_heart_rate_partitions', since='2025-10', ahead=0, stdout=out)
+        self.assertIn(date(2025, 10, 1), month_partitions(NightHeartRateEntry))
+
+        detached = detach_month_partitions(date(2025, 11, 1), drop=True)
+        self.assertEqual(len(detached), 1)
+        self.assertNotIn(date(2025, 10, 1), month_partitions(NightHeartRateEntry))
+        # Данные ноября остались в таблице
+        self.assertEqual(NightHeartRateEntry.objects.filter(record__user=self.user).count(), 3)
+
+    def test_beat_task_creates_upcoming_partitions(self):
+        current = timezone.now().date().replace(day=1)
+        self.assertEqual(ensure_heart_rate_partitions_task(ahead=2), 2)
+        self.assertEqual(ensure_heart_rate_partitions_task(ahead=2), 0)
+        for model in PARTITIONED_MODELS:
+            self.assertTrue({current, add_months(current, 1)} <= set(month_partitions(model)))
+
+    def test_reimport_keeps_one_series_per_record(self):
+        self.import_export()
+        for record in SleepRecord.objects.filter(user=self.user):
+            self.assertEqual(NightHeartRateSeries.objects.filter(record=record).count(), 1)
+        self.assertNotIn(NightHeartRateSeries, PARTITIONED_MODELS)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "секционирование есть только на PostgreSQL")
+class PartitionMigrationTests(ImportedUserMixin, TransactionTestCase):
+    before = [('sleep_tracking_app', '0017_sleeprecord_hypnogram')]
+    before_unpartition = [('sleep_tracking_app', '0022_sleepstatistics_cohort')]
+
+    def setUp(self):
+        super().setUp()
+        self.import_export()
+        self.latest = MigrationExecutor(connection).loader.graph.leaf_nodes('sleep_tracking_app')
+
+    def tearDown(self):
+        # Схема возвращается к последней миграции, даже если проверка упала на полпути
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.latest)
+
+    def relkind(self, table: str) -> str:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [table])
+            return cursor.fetchone()[0]
+
+    def count(self, table: str) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            return cursor.fetchone()[0]
+
+    def test_partitioning_migration_reverses_and_reapplies(self):
+        record = SleepRecord.objects.filter(user=self.user).first()
+        NightHeartRateEntry.objects.create(record=record, time=record.sleep_date_time, bpm=60)
+        rows = NightHeartRateSeries.objects.count()
+        self.assertEqual(self.relkind(ENTRY_TABLE), 'p')
+        self.assertEqual(self.relkind(SERIES_TABLE), 'r')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.assertEqual(self.relkind(ENTRY_TABLE), 'r')
+        self.assertEqual(self.relkind(SERIES_TABLE), 'r')
+        self.assertEqual(self.count(SERIES_TABLE), rows)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.latest)
+        self.assertEqual(self.relkind(ENTRY_TABLE), 'p')
+        self.assertEqual(self.relkind(SERIES_TABLE), 'r')
+        self.assertIn(date(2025, 11, 1), month_partitions(NightHeartRateEntry))
+        self.assertEqual(NightHeartRateSeries.objects.count(), rows)
+
+    def test_unpartition_migration_keeps_latest_series(self):
+        rows = NightHeartRateSeries.objects.count()
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before_unpartition)
+        # Ряд, секционированный прежней версией 0018, с устаревшей копией ночи в другом месяце
+        rebuild = import_module('sleep_tracking_app.migrations.0018_partition_night_heart_rate')._rebuild
+        with connection.schema_editor() as schema_editor:
+            rebuild(schema_editor, SERIES_TABLE, ['record_id'], 'start', partitioned=True)
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {SERIES_TABLE} (record_id, start, count, offsets, bpm) "
+                           f"SELECT record_id, start - interval '40 days', count, offsets, bpm "
+                           f"FROM {SERIES_TABLE}")
+        self.assertEqual(self.relkind(SERIES_TABLE), 'p')
+        self.assertEqual(self.count(SERIES_TABLE), 2 * rows)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.latest)
+        self.assertEqual(self.relkind(SERIES_TABLE), 'r')
+        self.assertEqual(self.count(SERIES_TABLE), rows)
+        stale = datetime(2025, 10, 1, tzinfo=dt_timezone.utc)
+        self.assertFalse(NightHeartRateSeries.objects.filter(start__lt=stale).exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
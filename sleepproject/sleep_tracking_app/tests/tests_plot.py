@@ -1,6 +1,8 @@
 import unittest
 from datetime import datetime
 
+import numpy as np
+
 from sleep_tracking_app.sleep_statistic import (
     get_sleep_phases_pie_data,
     get_heart_rate_bell_curve_data,
@@ -13,27 +15,17 @@ class DummyStat:
     def __init__(self, sleep_phases=None):
         self.sleep_phases = sleep_phases or {}
 
-
-class DummyHR:
-    def __init__(self, time, bpm):
-        self.time = time
-        self.bpm = bpm
+    def phase_percentages(self):
+        return self.sleep_phases
 
 
 class DummyRecord:
-    def __init__(self, hr_entries):
-        self._hr = hr_entries
-
-    @property
-    def night_hr_entries(self):
-        class Q:
-            def __init__(self, arr):
-                self._arr = arr
-
-            def all(self):
-                return self._arr
+    def __init__(self, times, bpm):
+        self._times = np.array(times, dtype='datetime64[s]')
+        self._bpm = np.array(bpm, dtype='uint8')
 
-        return Q(self._hr)
+    def night_heart_rate(self):
+        return self._times, self._bpm
 
 
 class PlotDiagramTests(unittest.TestCase):
@@ -56,8 +48,7 @@ class PlotDiagramTests(unittest.TestCase):
         self.assertEqual(get_heart_rate_bell_curve_data(None), {'date': [], 'bpm': []})
 
     def test_get_heart_rate_bell_curve_data_with_entries(self):
-        entries = [DummyHR(datetime(2025, 11, 22, 23, 0), 60), DummyHR(datetime(2025, 11, 23, 0, 0), 62)]
-        rec = DummyRecord(entries)
+        rec = DummyRecord([datetime(2025, 11, 22, 23, 0), datetime(2025, 11, 23, 0, 0)], [60, 62])
         res = get_heart_rate_bell_curve_data(rec)
         self.assertEqual(res['bpm'], [60, 62])
         self.assertEqual(res['date'][0], '23:00')
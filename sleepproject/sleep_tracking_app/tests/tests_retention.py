@@ -0,0 +1,86 @@
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.test import TestCase
+
+from sleep_tracking_app.models import SleepRecord, NightHeartRateSeries, NightHeartRateAggregate
+from sleep_tracking_app.sleep_import import downsample_night_heart_rate
+from sleep_tracking_app.sleep_statistic import night_heart_rate_frame, stage_heart_rate_for_records
+from sleep_tracking_app.sleep_statistic.plot_diagram import get_heart_rate_bell_curve_data
+from sleep_tracking_app.tests.tests_import import ImportedUserMixin, make_export_rows
+
+
+class NightHeartRateAggregateTests(unittest.TestCase):
+    def test_aggregate_and_coarsen(self):
+        seconds = np.array([0, 20, 40, 60, 400]) + 1_700_000_100
+        bpm = np.array([60, 70, 50, 80, 90])
+        minute = NightHeartRateAggregate.aggregate(1, seconds, bpm, bpm, bpm, np.ones(5), 60)
+
+        self.assertEqual(int(minute.start.timestamp()) % 60, 0)
+        lows, means, highs, samples = minute.values()
+        self.assertEqual(lows.tolist(), [50, 80, 90])
+        self.assertEqual(means.tolist(), [60, 80, 90])
+        self.assertEqual(highs.tolist(), [70, 80, 90])
+        self.assertEqual(samples.tolist(), [3, 1, 1])
+        times, mean_bpm = minute.arrays()
+        self.assertEqual(times.astype('int64').tolist()[0], int(minute.start.timestamp()) + 30)
+
+        # Среднее укрупнённого интервала взвешено по числу исходных замеров
+        coarse = minute.coarsen(300)
+        lows, means, highs, samples = coarse.values()
+        self.assertEqual(samples.tolist(), [4, 1])
+        self.assertEqual(means.tolist(), [65, 90])
+        self.assertEqual(lows.tolist(), [50, 90])
+        self.assertEqual(highs.tolist(), [80, 90])
+
+
+class HeartRateRetentionTests(ImportedUserMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_export(make_export_rows(hr_step_seconds=20))
+        self.records = list(SleepRecord.objects.filter(user=self.user).order_by('sleep_date_time'))
+        self.now = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+
+    def test_recent_nights_keep_raw_samples(self):
+        self.assertEqual(downsample_night_heart_rate(now=self.now, tiers=[(365, 60)]), 0)
+        self.assertEqual(NightHeartRateSeries.objects.filter(record__user=self.user).count(), 3)
+
+    def test_old_nights_are_downsampled_and_read_transparently(self):
+        record = self.records[0]
+        raw_times, raw_bpm = record.night_heart_rate()
+        stages_before = stage_heart_rate_for_records([record.pk])[record.pk]
+
+        self.assertEqual(downsample_night_heart_rate(now=self.now, tiers=[(90, 60)]), 3)
+        self.assertFalse(NightHeartRateSeries.objects.filter(record__user=self.user).exists())
+        aggregate = NightHeartRateAggregate.objects.get(record=record)
+        self.assertEqual(aggregate.resolution, 60)
+        self.assertEqual(int(aggregate.values()[3].sum()), len(raw_bpm))
+
+        times, bpm = SleepRecord.objects.get(pk=record.pk).night_heart_rate()
+        self.assertEqual(len(times), len(raw_times) // 3)
+        self.assertAlmostEqual(float(bpm.mean()), float(raw_bpm.mean()), delta=1)
+        self.assertEqual(len(get_heart_rate_bell_curve_data(record)['bpm']), len(times))
+        self.assertEqual(len(night_heart_rate_frame([r.pk for r in self.records])), 3 * len(times))
+
+        stages_after = stage_heart_rate_for_records([record.pk])[record.pk]
+        self.assertEqual(set(stages_after), set(stages_before))
+        self.assertAlmostEqual(stages_after['deep']['mean'], stages_before['deep']['mean'], delta=1)
+
+        # Через год ночи переходят на интервалы по 5 минут
+        later = self.now + timedelta(days=365)
+        self.assertEqual(downsample_night_heart_rate(now=later, tiers=[(90, 60), (365, 300)]), 3)
+        aggregate.refresh_from_db()
+        self.assertEqual(aggregate.resolution, 300)
+        self.assertEqual(len(SleepRecord.objects.get(pk=record.pk).night_heart_rate()[0]), len(raw_times) // 15)
+        self.assertEqual(downsample_night_heart_rate(now=later, tiers=[(90, 60), (365, 300)]), 0)
+
+    def test_reimport_replaces_aggregate_with_raw_samples(self):
+        downsample_night_heart_rate(now=self.now, tiers=[(90, 60)])
+        self.import_export(make_export_rows(hr_step_seconds=20))
+        self.assertFalse(NightHeartRateAggregate.objects.filter(record__user=self.user).exists())
+        self.assertEqual(NightHeartRateSeries.objects.filter(record__user=self.user).count(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
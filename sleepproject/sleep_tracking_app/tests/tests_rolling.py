@@ -0,0 +1,140 @@
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+import pandas as pd
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from sleep_tracking_app.models import SleepRecord, SleepRollingAggregate, SleepSegment
+from sleep_tracking_app.sleep_statistic import update_rolling_aggregates, rolling_sleep_metrics, \
+    chronotype_assessment, sleep_regularity, avg_sleep_duration, sleep_bitmaps, night_anchors, sleep_days, \
+    sleep_regularity_index, user_sleep_regularity_index, chronotype_from_history
+from sleep_tracking_app.sleep_statistic.regularity import POPCOUNT
+from sleep_tracking_app.tests.tests_import import ImportedUserMixin
+
+User = get_user_model()
+
+
+class RollingAggregatesTests(ImportedUserMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        first = datetime(2025, 11, 1, 22, 0, tzinfo=dt_timezone.utc)
+        self.records = []
+        for n in range(20):
+            bedtime = first + timedelta(days=n, minutes=(n * 37) % 120)
+            duration = 400 + (n * 13) % 90
+            wake = bedtime + timedelta(minutes=duration + 15)
+            self.records.append(SleepRecord.objects.create(
+                user=self.user, sleep_date_time=wake, bedtime=bedtime, device_bedtime=bedtime + timedelta(minutes=5),
+                wake_up_time=wake, device_wake_up_time=wake, duration=duration,
+            ))
+
+    def window_records(self, days: int) -> list:
+        end = self.records[-1].sleep_date_time.date()
+        return [r for r in self.records if (end - r.sleep_date_time.date()).days < days]
+
+    def test_window_metrics_match_direct_computation(self):
+        update_rolling_aggregates(self.user, self.records[0].sleep_date_time.date())
+
+        for days in (7, 30):
+            records = self.window_records(days)
+            metrics = rolling_sleep_metrics(self.user, days=days)
+
+            self.assertEqual(metrics['chronotype'], chronotype_assessment(records))
+            expected_regularity = sleep_regularity(records)
+            for key, value in expected_regularity.items():
+                self.assertAlmostEqual(metrics['sleep_regularity'][key], value, places=1)
+            self.assertEqual(metrics['avg_sleep_duration'], avg_sleep_duration(records))
+
+    def test_missing_aggregates_are_built_on_first_read(self):
+        # Записи импортированы до появления накопленных сумм
+        self.assertFalse(SleepRollingAggregate.objects.filter(user=self.user).exists())
+        records = self.window_records(7)
+
+        metrics = rolling_sleep_metrics(self.user, days=7)
+        self.assertEqual(metrics['avg_sleep_duration'], avg_sleep_duration(records))
+        self.assertNotEqual(metrics['sleep_regularity'], {})
+        self.assertEqual(SleepRollingAggregate.objects.filter(user=self.user).count(), 20)
+
+    def test_incremental_update_matches_full_rebuild(self):
+        update_rolling_aggregates(self.user, self.records[0].sleep_date_time.date())
+        full = list(SleepRollingAggregate.objects.order_by('date').values_list('date', 'nights', 'duration_sum'))
+
+        # Пересчёт с середины периода не меняет строки до неё и даёт тот же итог
+        update_rolling_aggregates(self.user, self.records[12].sleep_date_time.date())
+        incremental = list(SleepRollingAggregate.objects.order_by('date').values_list('date', 'nights',
+                                                                                      'duration_sum'))
+        self.assertEqual(full, incremental)
+        self.assertEqual(incremental[-1][1], 20)
+
+    def test_history_chronotype_matches_python_loop(self):
+        self.assertEqual(chronotype_from_history(self.user), chronotype_assessment(self.records))
+
+        end = self.records[6].sleep_date_time.date()
+        self.assertEqual(chronotype_from_history(self.user, end=end), chronotype_assessment(self.records[:7]))
+
+    def test_history_chronotype_without_weekends_is_empty(self):
+        # 3-5 ноября 2025 — будни
+        start = self.records[2].sleep_date_time.date()
+        end = self.records[3].sleep_date_time.date()
+        self.assertEqual(chronotype_from_history(self.user, start=start, end=end), {})
+
+    def test_empty_user_has_no_metrics(self):
+        other = User.objects.create_user(username='empty', password='pass12345', email='e@e.com')
+        self.assertEqual(rolling_sleep_metrics(other)['chronotype'], {})
+        self.assertEqual(rolling_sleep_metrics(other)['avg_sleep_duration'], 0)
+
+
+class SleepRegularityIndexTests(unittest.TestCase):
+    def nights(self, shifts: list, bedtime_hour: int = 22, hours: int = 8) -> tuple:
+        """Ночи подряд с bedtime_hour (UTC) длительностью hours часов, сдвинутые на shifts минут"""
+        bed = pd.DatetimeIndex([datetime(2025, 11, 20 + n, bedtime_hour, 0, tzinfo=dt_timezone.utc)
+                                for n in range(len(shifts))])
+        starts = [b + timedelta(minutes=s) for b, s in zip(bed, shifts)]
+        ends = [b + timedelta(hours=hours) for b in bed]
+        wake = pd.DatetimeIndex(ends)
+        bitmaps = sleep_bitmaps(night_anchors(wake), np.arange(len(shifts)), starts, ends, [2] * len(shifts))
+        return sleep_days(night_anchors(wake).asi8 // (86400 * 10 ** 9), bitmaps)
+
+    def test_bitmap_covers_two_utc_days_before_wake(self):
+        wake = pd.DatetimeIndex([datetime(2025, 11, 21, 6, 0, tzinfo=dt_timezone.utc)])
+        bitmaps = sleep_bitmaps(night_anchors(wake), [0], [wake[0] - timedelta(hours=8)], [wake[0]], [2])
+        asleep = np.unpackbits(bitmaps[0])
+        self.assertEqual(bitmaps.shape, (1, 360))
+        self.assertEqual(asleep.sum(), 8 * 60)
+        self.assertEqual(np.flatnonzero(asleep)[0], 22 * 60)
+
+    def test_identical_nights_are_fully_regular(self):
+        days, bitmaps = self.nights([0, 0, 0])
+        self.assertEqual(sleep_regularity_index(days, bitmaps), 100.0)
+
+    def test_shift_lowers_index(self):
+        days, bitmaps = self.nights([0, 60])
+        # 60 минут несовпадения в начале ночи
+        self.assertEqual(sleep_regularity_index(days, bitmaps), round(-100 + 200 * (1 - 60 / 1440), 2))
+
+    def test_night_crossing_noon_utc_is_not_clipped(self):
+        # Камчатка (UTC+12): сон 10:00–18:00 UTC, на следующую ночь — с 07:00, на 3 часа раньше
+        days, bitmaps = self.nights([180, 0], bedtime_hour=7, hours=11)
+        self.assertEqual(len(days), 2)
+        self.assertEqual(POPCOUNT[bitmaps].sum(axis=1).tolist(), [8 * 60, 11 * 60])
+        self.assertEqual(sleep_regularity_index(days, bitmaps), round(-100 + 200 * (1 - 180 / 1440), 2))
+
+    def test_non_consecutive_days_have_no_index(self):
+        days, bitmaps = self.nights([0, 0])
+        self.assertIsNone(sleep_regularity_index(days[[0]], bitmaps[[0]]))
+        self.assertIsNone(sleep_regularity_index(np.array([0, 2]), bitmaps))
+
+
+class UserSleepRegularityIndexTests(TestCase):
+    def test_bitmaps_are_built_from_segments_and_cached(self):
+        user = User.objects.create_user(username='sri', password='pass12345', email='s@e.com')
+        for n in range(3):
+            wake = datetime(2025, 11, 21 + n, 6, 0, tzinfo=dt_timezone.utc)
+            record = SleepRecord.objects.create(user=user, sleep_date_time=wake, duration=480)
+            SleepSegment.objects.create(record=record, start_time=wake - timedelta(hours=8), end_time=wake, state=3)
+
+        self.assertEqual(user_sleep_regularity_index(user), 100.0)
+        self.assertFalse(SleepRecord.objects.filter(user=user, sleep_bitmap__isnull=True).exists())
@@ -16,11 +16,12 @@ from django.views.generic import TemplateView
 from django.utils import timezone
 from django.core.files.storage import FileSystemStorage
 
-from .sleep_statistic import get_sleep_phases_pie_data, get_heart_rate_bell_curve_data, chronotype_assessment, \
-    sleep_regularity, get_sleep_efficiency_trend, get_sleep_duration_trend, avg_sleep_duration
+from .sleep_statistic import get_sleep_phases_pie_data, get_heart_rate_bell_curve_data, rolling_sleep_metrics, \
+    user_sleep_regularity_index, chronotype_from_history, get_sleep_efficiency_trend, get_sleep_duration_trend, \
+    avg_sleep_duration, user_cohort_benchmarks, recent_sleep_anomalies, get_sleep_phases_trend
 
 from .tasks import import_sleep_records, sleep_recommended
-from sleepproject.settings import MEDIA_ROOT
+from sleepproject.settings import MEDIA_ROOT, SLEEP_IMPORT_SHARD_MIN_BYTES
 
 from .forms import UserRegistrationForm, UserDataForm, UserInfoUpdateForm, \
     CSVImportForm
@@ -111,7 +112,8 @@ def sleep_records_from_csv(request: HttpRequest) -> HttpResponse:
         tmp_path = fs.path(filename)
 
         # запускаем Celery‑таску
-        task = import_sleep_records.delay(request.user.id, tmp_path)
+        task = import_sleep_records.delay(request.user.id, tmp_path, incremental=True,
+                                          sharded=csv_file.size >= SLEEP_IMPORT_SHARD_MIN_BYTES)
 
         return JsonResponse({'task_id': task.id})
 
@@ -124,8 +126,9 @@ def sleep_statistics_show(request: HttpRequest) -> HttpResponse:
     user_data = get_object_or_404(UserData, user=request.user)
 
     sleep_statistics_list = SleepStatistics.objects.only('id', 'user', 'recommended', 'sleep_calories_burned',
-                                                    'sleep_efficiency', 'sleep_phases').filter(user=user).order_by(
-        '-date')
+                                                    'sleep_efficiency', 'cycle_count',
+                                                    *SleepStatistics.PHASE_FIELDS.values()) \
+        .filter(user=user).order_by('-date')
 
     sleep_statistics = sleep_statistics_list.first() if sleep_statistics_list else None
 
@@ -170,13 +173,21 @@ def sleep_statistics_show(request: HttpRequest) -> HttpResponse:
     # Подготовка данных для графика
     graph_data = get_sleep_duration_trend(page)
 
-    # Метрики
+    # Метрики: хронотип — по всей истории одним агрегирующим запросом,
+    # регулярность за 7 дней читается из накопленных сумм
+    rolling = rolling_sleep_metrics(user, days=7)
     metric = {
-        'chronotype': chronotype_assessment(sleep_records=sleep_records) if sleep_records else {},
-        'sleep_regularity': sleep_regularity(sleep_records=sleep_records) if sleep_records else {},
+        'chronotype': chronotype_from_history(user),
+        'sleep_regularity': rolling['sleep_regularity'],
+        'sleep_regularity_index': user_sleep_regularity_index(user, days=7),
         'avg_sleep_duration': avg_sleep_duration(page) if page else 0,
         'calories_burned': getattr(sleep_statistics, 'sleep_calories_burned', 0),
         'sleep_efficiency': round(getattr(sleep_statistics, 'sleep_efficiency', 0), 2),
+        'cycle_count': getattr(sleep_statistics, 'cycle_count', None),
+        # Сравнение со сверстниками того же пола по скетчам когорт
+        'cohort': user_cohort_benchmarks(user_data, sleep_statistics),
+        # Отклонения от базовой линии, отмеченные при импорте
+        'anomalies': recent_sleep_anomalies(user),
     }
 
     # Подготовка plot_data
@@ -188,6 +199,8 @@ def sleep_statistics_show(request: HttpRequest) -> HttpResponse:
 
     plot_data = {
         'phases': phases,
+        # Средние доли фаз по неделям считаются в БД по колонкам процентов
+        'phases_trend': get_sleep_phases_trend(user),
         'graph_data': graph_data,
         'heart_rate': heart_rate,
         'first_date': first_date,
@@ -16,6 +16,14 @@ app.conf.beat_schedule = {
         'task': 'sleep_tracking_app.tasks.send_reminder_email',
         'schedule': crontab(minute=0, hour=20),  # Один раз в день
     },
+    'downsample_night_heart_rate': {
+        'task': 'downsample_night_heart_rate_task',
+        'schedule': crontab(minute=30, hour=3),  # Раз в сутки, ночью
+    },
+    'ensure_heart_rate_partitions': {
+        'task': 'ensure_heart_rate_partitions_task',
+        'schedule': crontab(minute=0, hour=2, day_of_month=1),  # Раз в месяц, первого числа
+    },
 
 }
 
@@ -180,6 +180,16 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# Выгрузки больше этого размера (в байтах) импортируются параллельно, шардами по месяцам
+SLEEP_IMPORT_SHARD_MIN_BYTES = int(os.getenv("SLEEP_IMPORT_SHARD_MIN_BYTES", 50 * 1024 * 1024))
+
+# Сроки хранения ночного пульса: (возраст ночи в днях, длина интервала огрубления в секундах).
+# Исходные замеры ночей старше первого срока заменяются минимумом/средним/максимумом по интервалам
+HEART_RATE_RETENTION_TIERS = [
+    (int(os.getenv("HEART_RATE_MINUTE_AFTER_DAYS", 90)), 60),
+    (int(os.getenv("HEART_RATE_5MIN_AFTER_DAYS", 365)), 300),
+]
+
 LOGIN_REDIRECT_URL = reverse_lazy('home')
 
 #OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://ollama:11434')
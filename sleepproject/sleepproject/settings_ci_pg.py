@@ -0,0 +1,16 @@
+# sleepproject/settings_ci_pg.py
+from .settings_ci import *
+import os
+
+# ===== БАЗА ДАННЫХ =====
+# Те же тесты на PostgreSQL: секционирование таблиц пульса и COPY проверяются только здесь
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv("BD_NAME", "postgres"),
+        'USER': os.getenv("BD_USER", "postgres"),
+        'PASSWORD': os.getenv("BD_PASSWORD", ""),
+        'HOST': os.getenv("BD_HOST", "localhost"),
+        'PORT': os.getenv("BD_PORT", "5432"),
+    }
+}